@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from events import current_event_id
+
+logger = logging.getLogger(__name__)
+
+# Нагрузка экспертов соревнования $1: принятые и еще не завершенные вызовы и принятые за окно $2
+EXPERT_LOAD_QUERY = """
+    SELECT u.user_id, u.available,
+           COUNT(c.id) FILTER (WHERE c.status = 'accepted') AS active,
+           COUNT(c.id) FILTER (WHERE c.accepted_at >= $2) AS recent,
+           MAX(c.accepted_at) AS last_accepted_at
+    FROM users u
+    LEFT JOIN calls c ON c.event_id = $1 AND c.expert_id = u.user_id
+        AND (c.status = 'accepted' OR c.accepted_at >= $2)
+    WHERE u.event_id = $1 AND u.role = 'expert'
+    GROUP BY u.user_id, u.available
+"""
+
+
+@dataclass
+class ExpertLoadEntry:
+    """Доступность и нагрузка одного эксперта"""
+    available: bool = True
+    active: int = 0
+    recent: int = 0
+    last_accepted_at: Optional[datetime] = None
+
+    @property
+    def ready(self) -> bool:
+        """Можно звать: сам отметился свободным и не занят принятым вызовом"""
+        return self.available and not self.active
+
+    @property
+    def priority(self) -> tuple:
+        # Меньше вызовов за окно, при равенстве — кто дольше без вызова
+        return self.recent, self.last_accepted_at or datetime.min
+
+
+class ExpertLoad:
+    """Индекс нагрузки экспертов в памяти процесса для адресной рассылки вызовов.
+
+    Загружается одним запросом при первом обращении, сбрасывается через invalidate()
+    (событие expert_load_changed от PgEventBus и смена соревнования). Изменения этого
+    процесса — принятие, завершение вызова, отметка «занят» — применяются к индексу сразу,
+    не дожидаясь перезагрузки.
+    Эксперты, которых еще нет в индексе (только что зарегистрировались), считаются свободными.
+    """
+
+    def __init__(self, pool, window: timedelta = timedelta(hours=1)):
+        self.pool = pool
+        self.window = window
+        self._index: Optional[dict[int, ExpertLoadEntry]] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Сбрасывает индекс, следующий запрос перечитает его из базы"""
+        self._generation += 1
+        self._index = None
+
+    async def _load(self) -> dict[int, ExpertLoadEntry]:
+        rows = await self.pool.fetch(EXPERT_LOAD_QUERY, current_event_id(), datetime.now() - self.window)
+        return {
+            row['user_id']: ExpertLoadEntry(row['available'], row['active'], row['recent'], row['last_accepted_at'])
+            for row in rows
+        }
+
+    async def _get(self) -> dict[int, ExpertLoadEntry]:
+        index = self._index
+        if index is not None:
+            return index
+        async with self._lock:
+            while self._index is None:
+                generation = self._generation
+                index = await self._load()
+                # Если во время загрузки нагрузка изменилась, читаем заново
+                if generation == self._generation:
+                    self._index = index
+            return self._index
+
+    async def warm(self):
+        """Загружает индекс, если его нет (см. RosterIndex.warm)"""
+        await self._get()
+
+    async def pick(self, candidates: Iterable[int], limit: int) -> list[int]:
+        """До limit свободных экспертов из candidates с наименьшей нагрузкой; limit 0 — все свободные"""
+        index = await self._get()
+        ready = [
+            (entry.priority, user_id)
+            for user_id, entry in ((user_id, index.get(user_id, ExpertLoadEntry())) for user_id in candidates)
+            if entry.ready
+        ]
+        chosen = heapq.nsmallest(limit, ready) if limit else sorted(ready)
+        return [user_id for _, user_id in chosen]
+
+    def _update(self, user_id: int, **changes):
+        self._generation += 1
+        if self._index is None:
+            return
+        entry = self._index.setdefault(user_id, ExpertLoadEntry())
+        for name, value in changes.items():
+            setattr(entry, name, value)
+
+    def accepted(self, user_id: int):
+        """Эксперт принял вызов — занят до завершения"""
+        entry = (self._index or {}).get(user_id, ExpertLoadEntry())
+        self._update(user_id, active=entry.active + 1, recent=entry.recent + 1, last_accepted_at=datetime.now())
+
+    def resolved(self, user_id: int):
+        """Эксперт завершил вызов"""
+        entry = (self._index or {}).get(user_id, ExpertLoadEntry())
+        self._update(user_id, active=max(entry.active - 1, 0))
+
+    def set_available(self, user_id: int, available: bool):
+        self._update(user_id, available=available)
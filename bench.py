@@ -0,0 +1,184 @@
+"""Нагрузочный стенд: прогоняет настоящие обработчики бота на синтетических обновлениях.
+
+Bot API заменен заглушкой (fake_telegram.FakeBotAPI), база — PostgreSQL из тех же переменных
+окружения, что и у бота. Лучше использовать отдельную БД: стенд создает своих пользователей
+(id от FAKE_USER_BASE) и удаляет их вместе с вызовами в конце прогона.
+
+    python bench.py --judges 200 --experts 60 --head-judges 5 --rounds 3
+
+Отчет: p50/p95/p99 задержки каждого обработчика, запросов к БД на обновление,
+ожидание соединения из пула (метрики из metrics.py) и исходящие сообщения в секунду.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Optional
+
+import asyncpg
+from telegram.ext import Application
+
+from disciplines import reload_disciplines
+from events import reload_event
+from fake_telegram import FAKE_USER_BASE, FakeBotAPI, FakeTelegram, callback_data, cleanup, fake_application_builder
+from main import build_application, db_settings, init_db_schema
+from metrics import DB_ACQUIRE_SECONDS, DB_QUERY_SECONDS, InstrumentedPool
+from persistence import PostgresPersistence
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+class Bench:
+    """Синтетические участники, которые нажимают кнопки как люди на соревновании"""
+
+    def __init__(self, application: Application, stub: FakeBotAPI, think_time: float):
+        self.telegram = FakeTelegram(application, stub)
+        self.stub = stub
+        self.think_time = think_time
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.updates = 0
+        self.stop = asyncio.Event()
+
+    def _record(self, label: str, elapsed: float):
+        self.latencies[label].append(elapsed)
+        self.updates += 1
+
+    async def message(self, label: str, user_id: int, text: str):
+        self._record(label, await self.telegram.message(user_id, text))
+
+    async def press(self, label: str, user_id: int, data: str, message_id: Optional[int] = None):
+        self._record(label, await self.telegram.press(user_id, data, message_id))
+
+    async def register(self, user_id: int, role: str, disciplines: list[str]):
+        await self.message("start", user_id, "/start")
+        await self.message("register_name", user_id, f"Участник {user_id}")
+        await self.press("register_role", user_id, role)
+        if role == "judge":
+            await self.press("judge_discipline", user_id, disciplines[0])
+        elif role == "expert":
+            for discipline in disciplines:
+                await self.press("toggle_expert_discipline", user_id, f"toggle_{discipline}")
+            await self.press("expert_disciplines_done", user_id, "disciplines_done")
+
+    async def judge(self, user_id: int, rounds: int):
+        for round_number in range(rounds):
+            await self.press("call_expert", user_id, "call_expert")
+            await asyncio.sleep(random.uniform(0, self.think_time))
+            await self.press("refresh_status", user_id, "refresh_status")
+            if round_number % 2:
+                await self.press("call_head_judge", user_id, "call_head_judge")
+            await asyncio.sleep(random.uniform(0, self.think_time))
+        await self.press("cancel_call", user_id, "cancel_calls")
+
+    async def responder(self, user_id: int):
+        """Эксперт или главный судья: откликается на каждый вызов и завершает выигранные"""
+        inbox = self.stub.inboxes[user_id]
+        while not self.stop.is_set():
+            try:
+                message = await asyncio.wait_for(inbox.get(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+
+            data = callback_data(message, "respond_")
+            if not data:
+                continue
+            await asyncio.sleep(random.uniform(0, self.think_time))
+            await self.press("respond_to_call", user_id, data, message['message_id'])
+
+            resolve = callback_data(self.stub.messages[(user_id, message['message_id'])], "resolve_")
+            if resolve:
+                await asyncio.sleep(random.uniform(0, self.think_time))
+                await self.press("finish_call", user_id, resolve, message['message_id'])
+
+    def report(self, elapsed: float, queries: int):
+        print(f"\n{'обработчик':<26}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+        for label, values in sorted(self.latencies.items()):
+            print(
+                f"{label:<26}{len(values):>7}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}"
+            )
+
+        outbound = sum(count for method, count in self.stub.calls.items() if method.startswith(("send", "edit")))
+        print(
+            f"\nобновлений: {self.updates} за {elapsed:.1f} с ({self.updates / elapsed:.0f}/с)\n"
+            f"запросов к БД на обновление: {queries / max(self.updates, 1):.2f}\n"
+            f"ожидание пула (оценка по гистограмме): p50 {DB_ACQUIRE_SECONDS.quantile(0.5) * 1000:.2f} мс, "
+            f"p95 {DB_ACQUIRE_SECONDS.quantile(0.95) * 1000:.2f} мс, "
+            f"p99 {DB_ACQUIRE_SECONDS.quantile(0.99) * 1000:.2f} мс\n"
+            f"исходящих сообщений и правок: {outbound} ({outbound / elapsed:.1f}/с), "
+            f"по методам: {dict(self.stub.calls)}, ответов 429: {dict(self.stub.flood_waits)}"
+        )
+
+
+async def run(args):
+    pool = InstrumentedPool(
+        await asyncpg.create_pool(**db_settings(), min_size=args.pool_size, max_size=args.pool_size)
+    )
+    await init_db_schema(pool)
+    await cleanup(pool)
+
+    stub = FakeBotAPI(
+        latency=args.api_latency,
+        chat_rate=args.chat_rate,
+        global_rate=args.global_rate,
+        flood_probability=args.flood_probability
+    )
+    application = build_application(fake_application_builder(stub).persistence(PostgresPersistence(pool)), pool)
+    bench = Bench(application, stub, args.think_time)
+
+    codes = list((await reload_disciplines(pool)).codes)
+    await reload_event(pool)
+    judges = [FAKE_USER_BASE + i for i in range(args.judges)]
+    experts = [FAKE_USER_BASE + 100_000 + i for i in range(args.experts)]
+    head_judges = [FAKE_USER_BASE + 200_000 + i for i in range(args.head_judges)]
+
+    await application.initialize()
+    await application.start()
+    application.bot_data['outbox'].start()
+    try:
+        # Регистрация — утренний наплыв участников
+        started = time.monotonic()
+        queries_before = DB_QUERY_SECONDS.count()
+        await asyncio.gather(
+            *(bench.register(user_id, "judge", [random.choice(codes)]) for user_id in judges),
+            *(bench.register(user_id, "expert", random.sample(codes, 2)) for user_id in experts),
+            *(bench.register(user_id, "head_judge", []) for user_id in head_judges),
+        )
+
+        responders = [asyncio.create_task(bench.responder(user_id)) for user_id in experts + head_judges]
+        await asyncio.gather(*(bench.judge(user_id, args.rounds) for user_id in judges))
+        await stub.wait_idle(quiet=float(application.bot_data['live_menus'].debounce) + 1)
+        bench.stop.set()
+        await asyncio.gather(*responders)
+
+        bench.report(time.monotonic() - started, DB_QUERY_SECONDS.count() - queries_before)
+
+    finally:
+        await application.bot_data['outbox'].stop()
+        await application.stop()
+        await application.shutdown()
+        await cleanup(pool)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд обработчиков бота")
+    parser.add_argument("--judges", type=int, default=200)
+    parser.add_argument("--experts", type=int, default=60)
+    parser.add_argument("--head-judges", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3, help="вызовов эксперта на судью")
+    parser.add_argument("--think-time", type=float, default=0.5, help="максимальная пауза между нажатиями, с")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--chat-rate", type=float, help="лимит сообщений в секунду на чат, сверх него 429")
+    parser.add_argument("--global-rate", type=float, help="лимит сообщений в секунду на бота, сверх него 429")
+    parser.add_argument("--flood-probability", type=float, default=0.0, help="доля случайных 429")
+    asyncio.run(run(parser.parse_args()))
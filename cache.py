@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from events import current_event_id
+
+_MISSING = object()
+
+
+class ProfileCache:
+    """LRU-кэш профилей из таблицы users с ограничением по времени жизни записи.
+
+    Кэшируются и отсутствующие профили (None), поэтому после любой записи в users
+    в обход кэша нужно вызвать invalidate() или put(). Профили — регистрации на текущем
+    соревновании, при смене соревнования кэш очищается целиком.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[float, object]] = OrderedDict()
+        self._generation = 0
+
+    def _lookup(self, user_id: int):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return _MISSING
+        expires_at, profile = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return _MISSING
+        self._entries.move_to_end(user_id)
+        return profile
+
+    async def get(self, db, user_id: int, role: Optional[str] = None):
+        """Профиль пользователя или None (в том числе если задана роль и она не совпадает).
+
+        db — пул или соединение asyncpg, к базе обращаемся только при промахе.
+        """
+        profile = self._lookup(user_id)
+        if profile is not _MISSING:
+            self.hits += 1
+        else:
+            self.misses += 1
+            generation = self._generation
+            profile = await db.fetchrow(
+                "SELECT * FROM users WHERE event_id = $1 AND user_id = $2", current_event_id(), user_id
+            )
+            # Пока шел запрос, запись могли изменить — тогда не кладем устаревшие данные
+            if generation == self._generation:
+                self.put(user_id, profile)
+
+        if profile is not None and role is not None and profile['role'] != role:
+            return None
+        return profile
+
+    def peek(self, user_id: int):
+        """Профиль из кэша без обращения к базе; None, если его там нет"""
+        profile = self._lookup(user_id)
+        if profile is _MISSING or profile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return profile
+
+    def put(self, user_id: int, profile):
+        """Запись профиля в кэш (write-through после изменения users)"""
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Удаляет профиль из кэша; без аргумента очищает кэш целиком"""
+        self._generation += 1
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,245 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
+
+
+class CallStatus(str, Enum):
+    """Жизненный цикл вызова: created → notified → accepted → resolved, либо cancelled / expired"""
+    CREATED = "created"
+    NOTIFIED = "notified"
+    ACCEPTED = "accepted"
+    RESOLVED = "resolved"
+    CANCELLED = "cancelled"
+    EXPIRED = "expired"
+
+
+# Вызов открыт, пока его никто не принял. Тот же предикат стоит в частичных индексах
+# (см. init_db_schema), поэтому запросы по открытым вызовам не читают историю.
+OPEN_CALL = "status IN ('created', 'notified')"
+
+# Таблица и колонка ответившего для каждого типа вызова. Таблицы разбиты на партиции
+# по соревнованиям (см. events.py): все запросы ниже получают event_id первым параметром,
+# и PostgreSQL читает только партицию этого соревнования.
+CALL_TABLES = {
+    'expert': ('calls', 'expert_id'),
+    'hj': ('hj_calls', 'head_judge_id'),
+}
+
+# Захват вызова одним запросом. Если строку в этот момент держит другая транзакция
+# (захват, эскалация, напоминание, mark_notified), UPDATE дожидается ее и заново проверяет
+# статус, поэтому «занят» означает только то, что вызов действительно принял кто-то другой.
+# Внешний SELECT видит снимок до UPDATE, поэтому отличает «занят» от «не существует».
+CLAIM_CALL = """
+    WITH claimed AS (
+        UPDATE {table} SET {responder} = $3, status = 'accepted', accepted_at = $4
+        WHERE event_id = $1 AND id = $2 AND {open_call}
+        RETURNING id
+    )
+    SELECT c.judge_id, claimed.id IS NOT NULL AS claimed
+    FROM {table} c
+    LEFT JOIN claimed ON claimed.id = c.id
+    WHERE c.event_id = $1 AND c.id = $2
+"""
+
+CANCEL_OPEN_CALLS = f"""
+    WITH expert_calls AS (
+        UPDATE calls SET status = 'cancelled', cancelled_at = $3, next_escalation_at = NULL
+        WHERE event_id = $1 AND judge_id = $2 AND {OPEN_CALL}
+        RETURNING id
+    ), hj_calls AS (
+        UPDATE hj_calls SET status = 'cancelled', cancelled_at = $3, next_escalation_at = NULL
+        WHERE event_id = $1 AND judge_id = $2 AND {OPEN_CALL}
+        RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM expert_calls) AS expert_calls,
+           (SELECT COUNT(*) FROM hj_calls) AS hj_calls
+"""
+
+# Берет из частичного индекса по next_escalation_at вызовы, которые пора эскалировать,
+# и сразу переносит следующую эскалацию (или закрывает вызов как expired).
+# SKIP LOCKED не дает двум процессам эскалировать один вызов.
+# Тип $2 указан явно: внутри CASE и рядом с interval PostgreSQL вывел бы его не как timestamp.
+ESCALATE_DUE_CALLS = """
+    UPDATE {table} c SET
+        escalations = c.escalations + 1,
+        status = CASE WHEN c.escalations >= $4 THEN 'expired' ELSE c.status END,
+        expired_at = CASE WHEN c.escalations >= $4 THEN $2::timestamp END,
+        next_escalation_at = CASE WHEN c.escalations >= $4 THEN NULL ELSE $2::timestamp + $3::interval END
+    WHERE c.event_id = $1 AND c.id IN (
+        SELECT id FROM {table}
+        WHERE event_id = $1 AND {open_call} AND next_escalation_at <= $2
+        ORDER BY next_escalation_at
+        LIMIT $5
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING c.id, c.judge_id, c.status, c.escalations
+"""
+
+# Страница очереди открытых вызовов. Keyset-пагинация: следующая страница начинается
+# после (created_at, id) последнего показанного вызова, поэтому читается только нужный
+# кусок частичного индекса {table}_open_queue / {table}_open_discipline без OFFSET.
+OPEN_QUEUE = """
+    SELECT c.id, c.discipline, c.created_at, c.escalations, u.name AS judge_name
+    FROM {table} c
+    JOIN users u ON u.event_id = c.event_id AND u.user_id = c.judge_id
+    WHERE {conditions}
+    ORDER BY c.created_at, c.id
+    LIMIT ${limit}
+"""
+
+# Не больше одного открытого вызова каждого типа на судью: это гарантирует частичный
+# уникальный индекс {table}_one_open_per_judge, и вставка при открытом вызове ничего не делает.
+INSERT_CALL = """
+    INSERT INTO {table} (event_id, judge_id, discipline, created_at, pinged_at, next_escalation_at)
+    VALUES ($1, $2, $3, $4, $4, $5)
+    ON CONFLICT (event_id, judge_id) WHERE {open_call} DO NOTHING
+    RETURNING id, escalations
+"""
+
+# Повторное нажатие: напоминание уходит, только если с прошлой рассылки прошло cooldown.
+# Строка блокируется только в этом случае: захват вызова ждет такую блокировку (см. CLAIM_CALL).
+# $4 — граница cooldown, посчитанная заранее: в «$3 - $4::interval» asyncpg выводит тип $3 как interval
+REPING_OPEN_CALL = """
+    UPDATE {table} SET pinged_at = $3
+    WHERE event_id = $1 AND judge_id = $2 AND {open_call} AND COALESCE(pinged_at, created_at) <= $4
+    RETURNING id, escalations
+"""
+
+
+class OpenStatus(Enum):
+    CREATED = "created"
+    REPINGED = "repinged"
+    DUPLICATE = "duplicate"
+
+
+@dataclass
+class OpenResult:
+    """Результат нажатия «вызвать»: новый вызов, напоминание о текущем или ничего"""
+    status: OpenStatus
+    call_id: int
+    escalations: int = 0
+
+
+class ClaimStatus(Enum):
+    CLAIMED = "claimed"
+    TAKEN = "taken"
+    NOT_FOUND = "not_found"
+
+
+@dataclass
+class ClaimResult:
+    """Результат попытки принять вызов"""
+    status: ClaimStatus
+    judge_id: Optional[int] = None
+
+
+def _query(template: str, call_type: str) -> str:
+    table, responder = CALL_TABLES[call_type]
+    return template.format(table=table, responder=responder, open_call=OPEN_CALL)
+
+
+def _claim_result(row) -> ClaimResult:
+    if row is None:
+        return ClaimResult(ClaimStatus.NOT_FOUND)
+    return ClaimResult(ClaimStatus.CLAIMED if row['claimed'] else ClaimStatus.TAKEN, row['judge_id'])
+
+
+async def open_call(db, event_id: int, call_type: str, judge_id: int, discipline: Optional[str], created_at: datetime,
+                    next_escalation_at: Optional[datetime], cooldown: timedelta) -> OpenResult:
+    """Создает вызов, если у судьи нет открытого вызова этого типа, иначе решает, пора ли о нем напомнить"""
+    while True:
+        row = await db.fetchrow(
+            _query(INSERT_CALL, call_type), event_id, judge_id, discipline, created_at, next_escalation_at
+        )
+        if row:
+            return OpenResult(OpenStatus.CREATED, row['id'])
+
+        row = await db.fetchrow(
+            _query(REPING_OPEN_CALL, call_type), event_id, judge_id, created_at, created_at - cooldown
+        )
+        if row:
+            return OpenResult(OpenStatus.REPINGED, row['id'], row['escalations'])
+
+        table, _ = CALL_TABLES[call_type]
+        row = await db.fetchrow(
+            f"SELECT id, escalations FROM {table} WHERE event_id = $1 AND judge_id = $2 AND {OPEN_CALL}",
+            event_id,
+            judge_id
+        )
+        if row:
+            return OpenResult(OpenStatus.DUPLICATE, row['id'], row['escalations'])
+        # Открытый вызов успели принять или отменить между запросами — пробуем создать снова
+
+
+async def claim_call(db, event_id: int, call_type: str, call_id: int, responder_id: int) -> ClaimResult:
+    """Атомарно назначает ответившего на вызов, если вызов еще открыт"""
+    return _claim_result(
+        await db.fetchrow(_query(CLAIM_CALL, call_type), event_id, call_id, responder_id, datetime.now())
+    )
+
+
+async def mark_notified(db, event_id: int, call_type: str, call_ids: list[int]):
+    """created → notified после первой успешной доставки"""
+    table, _ = CALL_TABLES[call_type]
+    await db.execute(
+        f"""UPDATE {table} SET status = 'notified', notified_at = $3
+        WHERE event_id = $1 AND id = ANY($2) AND status = 'created'""",
+        event_id,
+        call_ids,
+        datetime.now()
+    )
+
+
+async def resolve_call(db, event_id: int, call_type: str, call_id: int, responder_id: int) -> bool:
+    """accepted → resolved; закрыть вызов может только тот, кто его принял"""
+    table, responder = CALL_TABLES[call_type]
+    result = await db.execute(
+        f"""UPDATE {table} SET status = 'resolved', resolved_at = $4
+        WHERE event_id = $1 AND id = $2 AND {responder} = $3 AND status = 'accepted'""",
+        event_id,
+        call_id,
+        responder_id,
+        datetime.now()
+    )
+    return result.split()[-1] != "0"
+
+
+async def cancel_open_calls(db, event_id: int, judge_id: int) -> tuple[int, int]:
+    """Отменяет все открытые вызовы судьи; возвращает (вызовов экспертов, вызовов главного судьи)"""
+    row = await db.fetchrow(CANCEL_OPEN_CALLS, event_id, judge_id, datetime.now())
+    return row['expert_calls'], row['hj_calls']
+
+
+async def escalate_due_calls(db, event_id: int, call_type: str, interval: timedelta, max_escalations: int,
+                             limit: int = 100):
+    """Вызовы, у которых наступил срок эскалации; после max_escalations вызов становится expired"""
+    return await db.fetch(
+        _query(ESCALATE_DUE_CALLS, call_type),
+        event_id,
+        datetime.now(),
+        interval,
+        max_escalations,
+        limit
+    )
+
+
+async def fetch_open_queue(db, event_id: int, call_type: str, discipline: Optional[str] = None, after_id: int = 0,
+                           limit: int = 10):
+    """Открытые вызовы по возрастанию времени создания, начиная после вызова after_id"""
+    table, _ = CALL_TABLES[call_type]
+    conditions = ["c.event_id = $1", f"c.{OPEN_CALL}"]
+    args = [event_id]
+    if discipline:
+        args.append(discipline)
+        conditions.append(f"c.discipline = ${len(args)}")
+    if after_id:
+        args.append(after_id)
+        conditions.append(
+            f"(c.created_at, c.id) > (SELECT created_at, id FROM {table} WHERE event_id = $1 AND id = ${len(args)})"
+        )
+    args.append(limit)
+    return await db.fetch(
+        OPEN_QUEUE.format(table=table, conditions=" AND ".join(conditions), limit=len(args)),
+        *args
+    )
@@ -0,0 +1,465 @@
+"""Живая панель для организаторов: открытые вызовы по дисциплинам, кто что принял, сколько ждали.
+
+Панель читает не базу, а снимок в памяти процесса (CallBoard). Обработчики вызовов меняют его
+сразу (opened, accepted, closed, judge_cancelled, escalated), а из базы он перечитывается одним
+запросом при старте, после смены соревнования, после изменений в других воркерах (событие
+call_board от PgEventBus) и на всякий случай раз в resync секунд. JSON снимка собирается один раз
+на изменение, поэтому сколько бы экранов ни было открыто, запросов к базе от них нет.
+
+    GET /         — страница панели, обновляется через Server-Sent Events
+    GET /events   — поток SSE: новый снимок после каждого изменения
+    GET /state    — JSON снимка с ETag; с If-None-Match ждет изменения до poll_timeout секунд (long-poll)
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from statistics import median
+from typing import Optional
+
+from aiohttp import web
+
+from calls import CALL_TABLES
+from disciplines import current_disciplines
+from events import current_event
+
+logger = logging.getLogger(__name__)
+
+# Открытые и принятые вызовы соревнования $1, а также принятые после $2 — для времени ожидания
+BOARD_CALLS = """
+    SELECT c.id, c.judge_id, j.name AS judge_name, c.discipline, c.created_at, c.escalations, c.status,
+           r.name AS responder_name, c.accepted_at
+    FROM {table} c
+    LEFT JOIN users j ON j.event_id = c.event_id AND j.user_id = c.judge_id
+    LEFT JOIN users r ON r.event_id = c.event_id AND r.user_id = c.{responder}
+    WHERE c.event_id = $1 AND (c.status IN ('created', 'notified', 'accepted') OR c.accepted_at >= $2)
+"""
+
+
+@dataclass
+class BoardCall:
+    """Вызов на панели: открытый или принятый, но еще не завершенный"""
+    call_type: str
+    call_id: int
+    judge_id: int
+    judge_name: str
+    discipline: Optional[str]
+    created_at: datetime
+    escalations: int = 0
+    responder_name: Optional[str] = None
+    accepted_at: Optional[datetime] = None
+
+
+class CallBoard:
+    """Снимок вызовов текущего соревнования для панели организаторов.
+
+    window — за какой период считается медианное время ожидания ответа по дисциплинам.
+    Пока снимок не загружен (панель в этом процессе не запущена), обработчики его не меняют,
+    но в режиме воркеров (attach) по-прежнему сообщают об изменениях другим процессам.
+    """
+
+    def __init__(self, pool, window: timedelta = timedelta(hours=1), resync: float = 60, debounce: float = 1.0):
+        self.pool = pool
+        self.window = window
+        self.resync = resync
+        self.debounce = debounce
+        self.version = 0
+        self.body = b"{}"
+        self.bus = None
+        self._boot = uuid.uuid4().hex[:8]
+        self._calls: Optional[dict[tuple[str, int], BoardCall]] = None
+        # (accepted_at, call_type, discipline, секунды ожидания) в порядке принятия
+        self._waits: deque = deque()
+        self._event_name = None
+        self._generation = 0
+        self._changed = asyncio.Event()
+        self._stale = asyncio.Event()
+        self._task = None
+
+    @property
+    def tag(self) -> str:
+        """Метка снимка для ETag и Last-Event-ID; после перезапуска процесса не совпадает с прежними"""
+        return f"{self._boot}-{self.version}"
+
+    def attach(self, bus):
+        """Подключает обмен изменениями с другими процессами"""
+        self.bus = bus
+        bus.subscribe('call_board', self._on_remote_change)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def invalidate(self):
+        """Просит перечитать снимок из базы (смена соревнования, изменения в другом процессе)"""
+        self._stale.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки панели вызовов: {e}")
+            try:
+                await asyncio.wait_for(self._stale.wait(), self.resync)
+                # Изменения других процессов приходят пачками — перечитываем один раз на пачку
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._stale.clear()
+
+    async def reload(self):
+        """Перечитывает снимок из базы; если обработчики меняли его во время чтения — читает заново"""
+        while True:
+            generation = self._generation
+            try:
+                event = current_event()
+            except RuntimeError:
+                event = None
+            calls, waits = {}, []
+            since = datetime.now() - self.window
+            if event:
+                for call_type, (table, responder) in CALL_TABLES.items():
+                    rows = await self.pool.fetch(BOARD_CALLS.format(table=table, responder=responder), event.id, since)
+                    for row in rows:
+                        if row['accepted_at'] and row['accepted_at'] >= since:
+                            waits.append((
+                                row['accepted_at'],
+                                call_type,
+                                row['discipline'],
+                                (row['accepted_at'] - row['created_at']).total_seconds()
+                            ))
+                        if row['status'] in ('created', 'notified', 'accepted'):
+                            calls[(call_type, row['id'])] = BoardCall(
+                                call_type,
+                                row['id'],
+                                row['judge_id'],
+                                row['judge_name'] or str(row['judge_id']),
+                                row['discipline'],
+                                row['created_at'],
+                                row['escalations'],
+                                row['responder_name'],
+                                row['accepted_at'] if row['status'] == 'accepted' else None
+                            )
+            if generation == self._generation:
+                break
+        self._event_name = event.name if event else None
+        self._calls = calls
+        self._waits = deque(sorted(waits))
+        self._commit()
+
+    def opened(self, call_type: str, call_id: int, judge: dict, created_at: datetime):
+        """Судья создал вызов"""
+        self._generation += 1
+        if self._calls is not None:
+            self._calls[(call_type, call_id)] = BoardCall(
+                call_type, call_id, judge['user_id'], judge['name'], judge.get('discipline'), created_at
+            )
+        self._changed_locally()
+
+    def accepted(self, call_type: str, call_id: int, responder: dict):
+        """Эксперт или главный судья принял вызов"""
+        self._generation += 1
+        call = self._calls.get((call_type, call_id)) if self._calls is not None else None
+        if call:
+            call.responder_name = responder['name']
+            call.accepted_at = datetime.now()
+            self._waits.append((
+                call.accepted_at, call_type, call.discipline, (call.accepted_at - call.created_at).total_seconds()
+            ))
+        elif self._calls is not None:
+            # Вызов создан в другом процессе, и снимок о нем еще не знает
+            self.invalidate()
+        self._changed_locally()
+
+    def closed(self, call_type: str, call_id: int):
+        """Вызов завершен или истек без ответа"""
+        self._generation += 1
+        if self._calls is not None:
+            self._calls.pop((call_type, call_id), None)
+        self._changed_locally()
+
+    def judge_cancelled(self, judge_id: int):
+        """Судья отменил свои открытые вызовы"""
+        self._generation += 1
+        if self._calls is not None:
+            for key, call in list(self._calls.items()):
+                if call.judge_id == judge_id and call.accepted_at is None:
+                    del self._calls[key]
+        self._changed_locally()
+
+    def escalated(self, call_type: str, call_id: int, escalations: int):
+        """Вызов разослан повторно"""
+        self._generation += 1
+        call = self._calls.get((call_type, call_id)) if self._calls is not None else None
+        if call:
+            call.escalations = escalations
+        self._changed_locally()
+
+    def _changed_locally(self):
+        if self._calls is not None:
+            self._commit()
+        if self.bus:
+            asyncio.create_task(self._send_event(self.bus.origin))
+
+    async def _send_event(self, payload: str):
+        try:
+            await self.bus.publish('call_board', payload)
+        except Exception as e:
+            logger.error(f"Ошибка публикации изменения панели вызовов: {e}")
+
+    def _on_remote_change(self, payload: str):
+        # Пустой payload — соединение LISTEN переподключалось, события могли потеряться
+        if payload != self.bus.origin:
+            self.invalidate()
+
+    def _commit(self):
+        body = self._render()
+        if body != self.body:
+            self.body = body
+            self.version += 1
+            self.wake()
+
+    def wake(self):
+        """Будит всех, кто ждет изменения снимка"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_changed(self, version: int, timeout: float) -> bool:
+        """Ждет снимка новее version не дольше timeout секунд; True — снимок изменился"""
+        if self.version == version:
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.version != version
+
+    def _render(self) -> bytes:
+        disciplines = current_disciplines()
+        horizon = datetime.now() - self.window
+        while self._waits and self._waits[0][0] < horizon:
+            self._waits.popleft()
+
+        summary = {}
+
+        def discipline_row(code: Optional[str]) -> dict:
+            if code not in summary:
+                summary[code] = {
+                    'discipline': code,
+                    'label': disciplines.label(code),
+                    'open': {call_type: 0 for call_type in CALL_TABLES},
+                    'accepted': {call_type: 0 for call_type in CALL_TABLES},
+                    'median_wait': {call_type: None for call_type in CALL_TABLES},
+                }
+            return summary[code]
+
+        calls = sorted(self._calls.values(), key=lambda call: call.created_at)
+        for call in calls:
+            discipline_row(call.discipline)['accepted' if call.accepted_at else 'open'][call.call_type] += 1
+        waits = defaultdict(list)
+        for _, call_type, discipline, seconds in self._waits:
+            waits[(discipline, call_type)].append(seconds)
+        for (discipline, call_type), seconds in waits.items():
+            discipline_row(discipline)['median_wait'][call_type] = round(median(seconds))
+
+        # Дисциплины в порядке справочника, неизвестные коды — в конце
+        order = {code: position for position, code in enumerate(disciplines.codes)}
+        board = {
+            'event': self._event_name,
+            'window': int(self.window.total_seconds()),
+            'disciplines': sorted(
+                summary.values(), key=lambda row: (order.get(row['discipline'], len(order)), row['label'])
+            ),
+            'calls': [
+                {
+                    'type': call.call_type,
+                    'id': call.call_id,
+                    'judge': call.judge_name,
+                    'discipline': disciplines.label(call.discipline),
+                    'created_at': int(call.created_at.timestamp()),
+                    'escalations': call.escalations,
+                    'responder': call.responder_name,
+                    'accepted_at': int(call.accepted_at.timestamp()) if call.accepted_at else None,
+                }
+                for call in calls
+            ],
+        }
+        return json.dumps(board, ensure_ascii=False).encode()
+
+
+class DashboardServer:
+    """Локальный HTTP-сервер панели; отдает только готовый снимок CallBoard и в базу не ходит"""
+
+    def __init__(self, board: CallBoard, listen: str, port: int, poll_timeout: float = 25, keepalive: float = 15):
+        self.board = board
+        self.listen = listen
+        self.port = port
+        self.poll_timeout = poll_timeout
+        self.keepalive = keepalive
+        self._runner = None
+        self._stopping = False
+
+    def _payload(self) -> bytes:
+        # now — часы сервера, чтобы экраны считали время ожидания без расхождения часов
+        return b'{"now": %d, "board": %s}' % (int(time.time()), self.board.body)
+
+    async def handle_page(self, request: web.Request) -> web.Response:
+        return web.Response(text=DASHBOARD_PAGE, content_type="text/html", charset="utf-8")
+
+    async def handle_state(self, request: web.Request) -> web.Response:
+        version = self.board.version
+        if request.headers.get('If-None-Match') == f'"{self.board.tag}"':
+            if not await self.board.wait_changed(version, self.poll_timeout) or self._stopping:
+                return web.Response(status=304, headers={'ETag': f'"{self.board.tag}"'})
+        return web.Response(
+            body=self._payload(),
+            content_type="application/json",
+            charset="utf-8",
+            headers={'ETag': f'"{self.board.tag}"', 'Cache-Control': 'no-cache'}
+        )
+
+    async def handle_events(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            # Иначе nginx перед панелью копит поток в буфере
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(request)
+        # После переподключения EventSource присылает метку последнего снимка — тот же снимок не шлем
+        sent = self.board.version if request.headers.get('Last-Event-ID') == self.board.tag else None
+        try:
+            while not self._stopping:
+                if sent != self.board.version:
+                    sent = self.board.version
+                    await response.write(b"id: %s\ndata: %s\n\n" % (self.board.tag.encode(), self._payload()))
+                elif not await self.board.wait_changed(sent, self.keepalive) and not self._stopping:
+                    await response.write(b": keepalive\n\n")
+        except ConnectionResetError:
+            pass
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self.handle_page)
+        app.router.add_get("/state", self.handle_state)
+        app.router.add_get("/events", self.handle_events)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Панель вызовов доступна на http://{self.listen}:{self.port}/")
+
+    async def stop(self):
+        if self._runner:
+            # Открытые потоки SSE и long-poll завершаются сразу, не дожидаясь таймаутов
+            self._stopping = True
+            self.board.wake()
+            await self._runner.cleanup()
+            self._runner = None
+
+
+DASHBOARD_PAGE = """<!doctype html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Вызовы</title>
+<style>
+body { font-family: sans-serif; margin: 1em 2em; background: #111; color: #eee; }
+table { border-collapse: collapse; width: 100%; margin-bottom: 2em; }
+th, td { padding: .3em .6em; border-bottom: 1px solid #333; text-align: left; }
+.escalated { color: #f66; }
+.muted { color: #888; }
+</style>
+</head>
+<body>
+<h1 id="event">Вызовы</h1>
+<p id="status" class="muted">Подключение…</p>
+<h2>По дисциплинам</h2>
+<table>
+<thead><tr>
+<th>Дисциплина</th><th>Ждут эксперта</th><th>Ждут главного судью</th><th>В работе</th>
+<th>Ожидание эксперта, медиана</th><th>Ожидание главного судьи, медиана</th>
+</tr></thead>
+<tbody id="disciplines"></tbody>
+</table>
+<h2>Вызовы</h2>
+<table>
+<thead><tr><th>№</th><th>Кого зовут</th><th>Судья</th><th>Дисциплина</th><th>Ожидание</th><th>Принял</th></tr></thead>
+<tbody id="calls"></tbody>
+</table>
+<script>
+const TYPES = {expert: "эксперт", hj: "главный судья"};
+let board = null, skew = 0;
+
+function duration(seconds) {
+  seconds = Math.max(0, Math.round(seconds));
+  return Math.floor(seconds / 60) + ":" + String(seconds % 60).padStart(2, "0");
+}
+
+function cell(row, text, className) {
+  const td = row.insertCell();
+  td.textContent = text;
+  if (className) td.className = className;
+}
+
+function render() {
+  if (!board || !board.calls) return;
+  const now = Date.now() / 1000 - skew;
+  document.getElementById("event").textContent = board.event || "Нет текущего соревнования";
+
+  const disciplines = document.getElementById("disciplines");
+  disciplines.replaceChildren();
+  for (const d of board.disciplines) {
+    const row = disciplines.insertRow();
+    cell(row, d.label);
+    cell(row, d.open.expert);
+    cell(row, d.open.hj);
+    cell(row, d.accepted.expert + d.accepted.hj);
+    cell(row, d.median_wait.expert === null ? "—" : duration(d.median_wait.expert));
+    cell(row, d.median_wait.hj === null ? "—" : duration(d.median_wait.hj));
+  }
+
+  const calls = document.getElementById("calls");
+  calls.replaceChildren();
+  for (const c of board.calls) {
+    const row = calls.insertRow();
+    cell(row, c.id);
+    cell(row, TYPES[c.type]);
+    cell(row, c.judge);
+    cell(row, c.discipline);
+    cell(row, duration((c.accepted_at || now) - c.created_at), !c.accepted_at && c.escalations ? "escalated" : "");
+    cell(row, c.responder ? c.responder + ", " + duration(now - c.accepted_at) + " назад"
+      : c.escalations ? "никто, повторов: " + c.escalations : "никто");
+  }
+}
+
+const source = new EventSource("events");
+source.onmessage = (message) => {
+  const data = JSON.parse(message.data);
+  skew = Date.now() / 1000 - data.now;
+  board = data.board;
+  document.getElementById("status").textContent = "Обновлено в " + new Date().toLocaleTimeString();
+  render();
+};
+source.onerror = () => {
+  document.getElementById("status").textContent = "Нет связи с ботом, переподключение…";
+};
+setInterval(render, 1000);
+</script>
+</body>
+</html>
+"""
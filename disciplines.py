@@ -0,0 +1,87 @@
+"""Справочник дисциплин соревнования.
+
+Дисциплины хранятся в таблице disciplines и загружаются в неизменяемый DisciplineRegistry:
+подписи, клавиатура и множество кодов для фильтров обработчиков строятся один раз при загрузке.
+После изменения таблицы справочник перезагружается (/reload_disciplines или событие
+disciplines_changed от PgEventBus) заменой снимка целиком, без перезапуска бота.
+"""
+import logging
+from types import MappingProxyType
+from typing import Iterable, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Начальное содержимое таблицы disciplines при первом запуске
+DEFAULT_DISCIPLINES = [
+    ("relay", "Эстафета"),
+    ("practicallego", "Практическая олимпиада LEGO"),
+    ("linecons", "Следование по линии обр. конструкторы"),
+    ("BEAMline", "Следование по линии: BEAM"),
+    ("narrowline", "Следование по узкой линии"),
+    ("maze", "Лабиринт"),
+    ("robocup", "RoboCup"),
+    ("airrace", "Воздушные гонки"),
+    ("sumo", "Сумо"),
+    ("aqua", "Аквароботы"),
+    ("onstage", "OnStage"),
+    ("walking", "Марафон шагающих роботов"),
+    ("footballauto", "Футбол автономный"),
+    ("rally", "Ралли по коридору"),
+    ("android", "Сумо андроидных роботов"),
+    ("minisumo", "Мини сумо"),
+    ("microsumo", "Микро сумо"),
+]
+
+
+class DisciplineRegistry:
+    """Неизменяемый снимок справочника дисциплин"""
+
+    def __init__(self, disciplines: Iterable[tuple[str, str]]):
+        self.items = tuple((code, label) for code, label in disciplines)
+        self.codes = tuple(code for code, _ in self.items)
+        self.labels = MappingProxyType(dict(self.items))
+        # Одиночный выбор (судья) не зависит от пользователя — строится один раз
+        self.keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(label, callback_data=code)] for code, label in self.items
+        ])
+
+    def __contains__(self, code) -> bool:
+        return code in self.labels
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def label(self, code: Optional[str], default: str = "без дисциплины") -> str:
+        """Подпись дисциплины; для неизвестного кода — сам код"""
+        if not code:
+            return default
+        return self.labels.get(code, code)
+
+    def expert_keyboard(self, selected: Iterable[str]) -> InlineKeyboardMarkup:
+        """Отметки дисциплин эксперта"""
+        selected = set(selected)
+        keyboard = [
+            [InlineKeyboardButton(f"✅ {label}" if code in selected else label, callback_data=f"toggle_{code}")]
+            for code, label in self.items
+        ]
+        keyboard.append([InlineKeyboardButton("Готово", callback_data="disciplines_done")])
+        return InlineKeyboardMarkup(keyboard)
+
+
+_current = DisciplineRegistry(DEFAULT_DISCIPLINES)
+
+
+def current_disciplines() -> DisciplineRegistry:
+    """Действующий справочник дисциплин"""
+    return _current
+
+
+async def reload_disciplines(db) -> DisciplineRegistry:
+    """Перечитывает таблицу disciplines и подменяет справочник"""
+    global _current
+    rows = await db.fetch("SELECT code, label FROM disciplines WHERE active ORDER BY position, code")
+    _current = DisciplineRegistry((row['code'], row['label']) for row in rows)
+    logger.info(f"Справочник дисциплин загружен: {len(_current)}")
+    return _current
@@ -0,0 +1,268 @@
+"""Сквозная проверка сценариев судьи, эксперта и главного судьи без Telegram.
+
+Настоящие обработчики, очередь уведомлений и PostgreSQL, вместо Bot API — fake_telegram.FakeBotAPI.
+После регистрации можно включить случайные 429: рассылки и правки меню должны их пережить
+за счет повторов NotificationDispatcher. Нужна только база (лучше отдельная): пользователи создаются
+в диапазоне FAKE_USER_BASE и удаляются после прогона. Перед сценарием init_db_schema прогоняется
+на таблицах исходной версии бота во временной схеме e2e_baseline. Код выхода 1 — какой-то шаг не прошел
+или обработчик записал ошибку в лог.
+
+    python e2e.py [--flood-probability 0.2]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import asyncpg
+
+from calls import CALL_TABLES
+from disciplines import reload_disciplines
+from events import current_event_id, reload_event
+from fake_telegram import FAKE_USER_BASE, FakeBotAPI, FakeTelegram, callback_data, cleanup, fake_application_builder
+from main import build_application, db_settings, init_db_schema
+from metrics import InstrumentedPool
+from persistence import PostgresPersistence
+from roster_import import RosterEntry, import_roster
+
+JUDGE = FAKE_USER_BASE + 1
+EXPERT = FAKE_USER_BASE + 2
+OTHER_EXPERT = FAKE_USER_BASE + 3
+HEAD_JUDGE = FAKE_USER_BASE + 4
+PREREGISTERED_EXPERT = FAKE_USER_BASE + 5
+WALK_IN = FAKE_USER_BASE + 6
+
+BASELINE_SCHEMA = "e2e_baseline"
+# Таблицы исходной версии бота: регистрации без соревнований, вызовы без партиций и статусов
+BASELINE_TABLES = """
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        name TEXT NOT NULL,
+        role TEXT NOT NULL,
+        discipline TEXT
+    );
+    CREATE TABLE calls (
+        id SERIAL PRIMARY KEY,
+        judge_id BIGINT REFERENCES users(user_id),
+        expert_id BIGINT REFERENCES users(user_id),
+        discipline TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL
+    );
+    CREATE TABLE hj_calls (
+        id SERIAL PRIMARY KEY,
+        judge_id BIGINT REFERENCES users(user_id) NOT NULL,
+        head_judge_id BIGINT REFERENCES users(user_id),
+        created_at TIMESTAMP NOT NULL,
+        resolved_at TIMESTAMP
+    );
+"""
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+class HandlerErrors(logging.Handler):
+    """Ошибки обработчиков за прогон.
+
+    Свои исключения обработчики ловят и пишут в лог main, остальные доходят до error handler приложения.
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+    async def on_error(self, update, context):
+        self.messages.append(f"необработанное исключение: {context.error!r}")
+
+
+def check(condition: bool, description: str):
+    if not condition:
+        raise ScenarioFailed(description)
+    print(f"✓ {description}")
+
+
+async def expect(api: FakeBotAPI, chat_id: int, prefix: str = "", text: str = "", timeout: float = 10) -> dict:
+    """Ждет в чате сообщение с кнопкой prefix и/или фрагментом текста"""
+    inbox = api.inboxes[chat_id]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (remaining := deadline - loop.time()) > 0:
+        try:
+            message = await asyncio.wait_for(inbox.get(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if (not prefix or callback_data(message, prefix)) and text in message['text']:
+            return message
+    raise ScenarioFailed(f"в чат {chat_id} не пришло сообщение {prefix or text!r} за {timeout} с")
+
+
+async def check_baseline_migration():
+    """init_db_schema на базе исходной версии: вызовы переходят на партиции, старые записи сохраняются"""
+    settings = db_settings()
+    settings['server_settings'] = {**settings['server_settings'], 'search_path': BASELINE_SCHEMA}
+    admin = await asyncpg.connect(**db_settings())
+    await admin.execute(f"DROP SCHEMA IF EXISTS {BASELINE_SCHEMA} CASCADE; CREATE SCHEMA {BASELINE_SCHEMA}")
+    try:
+        pool = await asyncpg.create_pool(**settings, min_size=1, max_size=1)
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute(BASELINE_TABLES)
+                await conn.executemany(
+                    "INSERT INTO users (user_id, name, role, discipline) VALUES ($1, $2, $3, $4)",
+                    [(JUDGE, "Судья", "judge", "d1"), (EXPERT, "Эксперт", "expert", None)]
+                )
+                await conn.execute(
+                    "INSERT INTO calls (judge_id, expert_id, discipline, created_at) VALUES ($1, $2, 'd1', now())",
+                    JUDGE,
+                    EXPERT
+                )
+                await conn.execute("INSERT INTO hj_calls (judge_id, created_at) VALUES ($1, now())", JUDGE)
+
+            # Второй запуск — как перезапуск бота на уже обновленной базе
+            await init_db_schema(pool)
+            await init_db_schema(pool)
+
+            async with pool.acquire() as conn:
+                for table, _ in CALL_TABLES.values():
+                    relkind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = $1::regclass", table)
+                    check(relkind == "p", f"{table} базы исходной версии переведена на партиции")
+                event_id = await conn.fetchval("SELECT MIN(id) FROM events")
+                call = await conn.fetchrow("SELECT event_id, status FROM calls WHERE judge_id = $1", JUDGE)
+                check(
+                    call is not None and call['event_id'] == event_id and call['status'] == "accepted",
+                    "принятый вызов исходной версии перенесен в первое соревнование"
+                )
+                hj_call = await conn.fetchrow("SELECT event_id, discipline FROM hj_calls WHERE judge_id = $1", JUDGE)
+                check(
+                    hj_call is not None and hj_call['event_id'] == event_id and hj_call['discipline'] == "d1",
+                    "вызов главного судьи исходной версии перенесен с дисциплиной судьи"
+                )
+        finally:
+            await pool.close()
+    finally:
+        await admin.execute(f"DROP SCHEMA IF EXISTS {BASELINE_SCHEMA} CASCADE")
+        await admin.close()
+
+
+async def scenario(telegram: FakeTelegram, pool, codes: list[str], flood_probability: float):
+    api = telegram.api
+
+    await telegram.register(JUDGE, "judge", [codes[0]])
+    await telegram.register(EXPERT, "expert", [codes[0]])
+    await telegram.register(OTHER_EXPERT, "expert", [codes[1]])
+    await telegram.register(HEAD_JUDGE, "head_judge", [])
+    registered = await pool.fetchval("SELECT COUNT(*) FROM users WHERE user_id >= $1", FAKE_USER_BASE)
+    check(registered == 4, "регистрация судьи, двух экспертов и главного судьи")
+
+    await import_roster(pool, current_event_id(), [
+        RosterEntry("Эксперт из списка", "expert", telegram_id=PREREGISTERED_EXPERT, disciplines=codes[:2])
+    ])
+    await telegram.message(PREREGISTERED_EXPERT, "/start")
+    await expect(api, PREREGISTERED_EXPERT, text="организаторы уже зарегистрировали вас")
+    disciplines = await pool.fetchval(
+        "SELECT COUNT(*) FROM expert_disciplines WHERE event_id = $1 AND user_id = $2",
+        current_event_id(),
+        PREREGISTERED_EXPERT
+    )
+    check(disciplines == 2, "эксперт из списка организаторов зарегистрирован по /start со своими дисциплинами")
+    await telegram.message(WALK_IN, "/start")
+    welcome = await expect(api, WALK_IN, text="Введите ваше ФИО")
+    check(bool(welcome), "участник не из списка попадает в диалог регистрации")
+    api.flood_probability = flood_probability
+
+    await telegram.press(JUDGE, "call_expert")
+    call = await expect(api, EXPERT, prefix="respond_expert_")
+    check(bool(call), "вызов дошел до эксперта дисциплины через outbox")
+    check(
+        not any(callback_data(message, "respond_") for message in api.sent_to(OTHER_EXPERT)),
+        "эксперт другой дисциплины вызов не получил"
+    )
+
+    logged = len(api.log)
+    await telegram.press(JUDGE, "call_expert")
+    replies = [message['text'] for _, message in api.log[logged:] if message['chat']['id'] == JUDGE]
+    check(
+        any("уже отправлен экспертам" in text for text in replies),
+        "на повторное нажатие судья получил ответ о текущем вызове"
+    )
+    open_calls = await pool.fetchval(
+        "SELECT COUNT(*) FROM calls WHERE judge_id = $1 AND status IN ('created', 'notified')", JUDGE
+    )
+    check(open_calls == 1, "повторное нажатие не создало второй вызов")
+
+    await telegram.press(EXPERT, callback_data(call, "respond_expert_"), call['message_id'])
+    notice = await expect(api, JUDGE, text="ответил на ваш вызов")
+    check(bool(notice), "судья получил уведомление об отклике")
+    resolve = callback_data(api.messages[(EXPERT, call['message_id'])], "resolve_")
+    check(resolve is not None, "у эксперта появилась кнопка завершения")
+
+    await telegram.press(EXPERT, resolve, call['message_id'])
+    status = await pool.fetchval("SELECT status FROM calls WHERE judge_id = $1 ORDER BY id DESC LIMIT 1", JUDGE)
+    check(status == "resolved", "вызов завершен экспертом")
+
+    await telegram.press(JUDGE, "call_head_judge")
+    hj_call = await expect(api, HEAD_JUDGE, prefix="respond_hj_")
+    await telegram.press(HEAD_JUDGE, callback_data(hj_call, "respond_hj_"), hj_call['message_id'])
+    status = await pool.fetchval("SELECT status FROM hj_calls WHERE judge_id = $1 ORDER BY id DESC LIMIT 1", JUDGE)
+    check(status == "accepted", "главный судья принял вызов")
+
+    await telegram.press(JUDGE, "call_expert")
+    await expect(api, EXPERT, prefix="respond_expert_")
+    await telegram.press(JUDGE, "cancel_calls")
+    open_calls = await pool.fetchval(
+        "SELECT COUNT(*) FROM calls WHERE judge_id = $1 AND status IN ('created', 'notified')", JUDGE
+    )
+    check(open_calls == 0, "судья отменил открытый вызов")
+
+
+async def run(args) -> bool:
+    # Сценарий нажимает «вызвать» чаще, чем пропускает лимит по умолчанию (см. CALL_PRESS_BURST)
+    os.environ.setdefault('CALL_PRESS_BURST', '10')
+    try:
+        await check_baseline_migration()
+    except ScenarioFailed as e:
+        print(f"✗ {e}")
+        return False
+
+    pool = InstrumentedPool(await asyncpg.create_pool(**db_settings(), min_size=2, max_size=5))
+    await init_db_schema(pool)
+    await cleanup(pool)
+    codes = list((await reload_disciplines(pool)).codes)
+    await reload_event(pool)
+
+    api = FakeBotAPI(latency=args.api_latency, chat_rate=args.chat_rate)
+    application = build_application(fake_application_builder(api).persistence(PostgresPersistence(pool)), pool)
+    errors = HandlerErrors()
+    logging.getLogger("main").addHandler(errors)
+    application.add_error_handler(errors.on_error)
+    await application.initialize()
+    await application.start()
+    application.bot_data['outbox'].start()
+    try:
+        await scenario(FakeTelegram(application, api), pool, codes, args.flood_probability)
+        check(not errors.messages, "обработчики отработали без ошибок" + "".join(f"\n  {m}" for m in errors.messages))
+        print(f"Все шаги пройдены. Запросов к Bot API: {dict(api.calls)}, ответов 429: {dict(api.flood_waits)}")
+        return True
+    except ScenarioFailed as e:
+        print(f"✗ {e}")
+        return False
+    finally:
+        logging.getLogger("main").removeHandler(errors)
+        await application.bot_data['outbox'].stop()
+        await application.stop()
+        await application.shutdown()
+        await cleanup(pool)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сквозная проверка сценариев бота без Telegram")
+    parser.add_argument("--api-latency", type=float, default=0.01, help="задержка ответа Bot API, с")
+    parser.add_argument("--chat-rate", type=float, help="лимит сообщений в секунду на чат, сверх него 429")
+    parser.add_argument("--flood-probability", type=float, default=0.0, help="доля случайных 429 после регистрации")
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
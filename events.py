@@ -0,0 +1,192 @@
+"""Соревнования: у каждого свои регистрации и свои партиции вызовов.
+
+Бот обслуживает одно текущее соревнование — незавершенную строку таблицы events. Регистрации
+(users, expert_disciplines) хранятся отдельно для каждого соревнования, поэтому один человек
+может быть судьей на одном и экспертом на другом. calls и hj_calls разбиты на партиции по event_id:
+запросы бота передают id текущего соревнования, и PostgreSQL читает только его партицию.
+Завершенное соревнование можно перенести в схему archive: партиции отсоединяются от calls и hj_calls
+и остаются обычными таблицами для истории.
+
+    python events.py list
+    python events.py start "Название"    # завершает текущее соревнование и открывает новое
+    python events.py finish              # завершает текущее, открытые вызовы отменяются
+    python events.py archive ID          # отсоединяет партиции завершенного соревнования
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from calls import CALL_TABLES, OPEN_CALL
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = "archive"
+
+LIVE_EVENT = "SELECT id, name, started_at FROM events WHERE finished_at IS NULL"
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    name: str
+    started_at: datetime
+
+
+_current: Optional[Event] = None
+
+
+def current_event() -> Event:
+    """Текущее соревнование; без него бот не может ни регистрировать, ни создавать вызовы"""
+    if _current is None:
+        raise RuntimeError("Нет текущего соревнования: откройте его командой python events.py start")
+    return _current
+
+
+def current_event_id() -> int:
+    return current_event().id
+
+
+def live_event_id() -> Optional[int]:
+    """id текущего соревнования или None, если оно не открыто (для фоновых задач, которым его можно ждать)"""
+    return _current.id if _current else None
+
+
+async def reload_event(db) -> Optional[Event]:
+    """Перечитывает текущее соревнование из таблицы events"""
+    global _current
+    row = await db.fetchrow(LIVE_EVENT)
+    _current = Event(row['id'], row['name'], row['started_at']) if row else None
+    if _current:
+        logger.info(f"Текущее соревнование: {_current.name} (id {_current.id})")
+    else:
+        logger.warning("Нет текущего соревнования")
+    return _current
+
+
+def partition_name(table: str, event_id: int) -> str:
+    return f"{table}_event_{int(event_id)}"
+
+
+async def create_partition(conn, table: str, event_id: int):
+    """Партиция таблицы вызовов для соревнования (повторный вызов ничего не делает)"""
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {partition_name(table, event_id)}
+        PARTITION OF {table} FOR VALUES IN ({int(event_id)})
+    """)
+
+
+async def create_partitions(conn, event_id: int):
+    """Партиции calls и hj_calls для соревнования"""
+    for table, _ in CALL_TABLES.values():
+        await create_partition(conn, table, event_id)
+
+
+async def finish_event(conn, event_id: int) -> int:
+    """Завершает соревнование: открытые вызовы отменяются; возвращает их число"""
+    cancelled = 0
+    now = datetime.now()
+    async with conn.transaction():
+        for table, _ in CALL_TABLES.values():
+            status = await conn.execute(
+                f"""UPDATE {table} SET status = 'cancelled', cancelled_at = $2, next_escalation_at = NULL
+                WHERE event_id = $1 AND {OPEN_CALL}""",
+                event_id,
+                now
+            )
+            cancelled += int(status.split()[-1])
+        await conn.execute(
+            "UPDATE events SET finished_at = $2 WHERE id = $1 AND finished_at IS NULL", event_id, now
+        )
+    return cancelled
+
+
+async def start_event(conn, name: str) -> Event:
+    """Открывает новое соревнование, завершив текущее"""
+    async with conn.transaction():
+        live = await conn.fetchval("SELECT id FROM events WHERE finished_at IS NULL FOR UPDATE")
+        if live:
+            await finish_event(conn, live)
+        row = await conn.fetchrow(
+            "INSERT INTO events (name, started_at) VALUES ($1, $2) RETURNING id, name, started_at",
+            name,
+            datetime.now()
+        )
+        await create_partitions(conn, row['id'])
+    return Event(row['id'], row['name'], row['started_at'])
+
+
+async def archive_event(conn, event_id: int):
+    """Отсоединяет партиции завершенного соревнования и переносит их в схему archive.
+
+    DETACH PARTITION ненадолго блокирует calls и hj_calls целиком, поэтому архивировать
+    лучше между соревнованиями, а не во время вызовов.
+    """
+    async with conn.transaction():
+        event = await conn.fetchrow("SELECT finished_at, archived_at FROM events WHERE id = $1 FOR UPDATE", event_id)
+        if event is None:
+            raise ValueError(f"Соревнование {event_id} не найдено")
+        if event['finished_at'] is None:
+            raise ValueError(f"Соревнование {event_id} еще не завершено")
+        if event['archived_at'] is not None:
+            return
+
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        for table, _ in CALL_TABLES.values():
+            partition = partition_name(table, event_id)
+            await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+            await conn.execute(f"ALTER TABLE {partition} SET SCHEMA {ARCHIVE_SCHEMA}")
+        await conn.execute("UPDATE events SET archived_at = $2 WHERE id = $1", event_id, datetime.now())
+
+
+async def _cli():
+    import asyncpg
+    from main import db_settings, init_db_schema
+
+    parser = argparse.ArgumentParser(description="Соревнования: новое, завершение, архив")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="все соревнования")
+    start = commands.add_parser("start", help="завершить текущее и открыть новое соревнование")
+    start.add_argument("name")
+    commands.add_parser("finish", help="завершить текущее соревнование")
+    archive = commands.add_parser("archive", help="отсоединить партиции завершенного соревнования")
+    archive.add_argument("event_id", type=int)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(**db_settings(), min_size=1, max_size=1)
+    try:
+        await init_db_schema(pool)
+        async with pool.acquire() as conn:
+            await _run_command(conn, args)
+    finally:
+        await pool.close()
+
+
+async def _run_command(conn, args):
+    if args.command == "list":
+        for row in await conn.fetch("SELECT * FROM events ORDER BY id"):
+            state = (
+                "в архиве" if row['archived_at'] else
+                f"завершено {row['finished_at']:%d.%m.%Y}" if row['finished_at'] else
+                "текущее"
+            )
+            print(f"{row['id']}: {row['name']}, начато {row['started_at']:%d.%m.%Y}, {state}")
+    elif args.command == "start":
+        event = await start_event(conn, args.name)
+        print(f"Открыто соревнование {event.id}: {event.name}")
+    elif args.command == "finish":
+        event = await reload_event(conn)
+        if event is None:
+            print("Нет текущего соревнования")
+            return
+        cancelled = await finish_event(conn, event.id)
+        print(f"Соревнование {event.id} завершено, отменено открытых вызовов: {cancelled}")
+    else:
+        await archive_event(conn, args.event_id)
+        print(f"Соревнование {args.event_id} перенесено в схему {ARCHIVE_SCHEMA}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
@@ -0,0 +1,244 @@
+"""Офлайн-замена Telegram для стенда и сквозных проверок: бот не ходит в сеть, токен не нужен.
+
+FakeBotAPI подставляется в Application.builder().request(...) вместо HTTPXRequest: отвечает
+как Bot API, запоминает отправленные и отредактированные сообщения, умеет задержку ответа
+и 429 RetryAfter по лимитам Telegram. FakeTelegram собирает обновления от имени синтетических
+пользователей (сообщения и нажатия кнопок) и передает их в то же приложение, что собирает
+main.build_application. База — PostgreSQL из переменных окружения бота; синтетические
+пользователи живут в диапазоне от FAKE_USER_BASE и удаляются cleanup().
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+from notifications import TokenBucket
+
+FAKE_USER_BASE = 9_000_000_000
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+# Методы, на которые Telegram отвечает 429 при превышении лимитов
+_LIMITED_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup")
+
+
+class FakeBotAPI(BaseRequest):
+    """Заглушка Bot API: отвечает как Telegram и запоминает отправленные и отредактированные сообщения.
+
+    latency — задержка каждого ответа, с; chat_rate и global_rate — лимиты сообщений в секунду
+    на чат и на бота (None — без лимита), сверх них приходит 429 RetryAfter, в чат можно
+    отправить chat_burst сообщений подряд; flood_probability — доля случайных 429 независимо от лимитов.
+    """
+
+    def __init__(self, latency: float = 0.0, chat_rate: Optional[float] = None, global_rate: Optional[float] = None,
+                 chat_burst: float = 3, flood_probability: float = 0.0, retry_after: int = 1):
+        super().__init__()
+        self.latency = latency
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self.calls: dict[str, int] = defaultdict(int)
+        self.flood_waits: dict[str, int] = defaultdict(int)
+        self.messages: dict[tuple[int, int], dict] = {}
+        self.log: list[tuple[str, dict]] = []
+        self.last_message_id: dict[int, int] = {}
+        self.inboxes: dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.inflight = 0
+        self.last_request = time.monotonic()
+        self._message_ids = itertools.count(1)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(global_rate, global_rate) if global_rate else None
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.inflight += 1
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            api_method = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data else {}
+            self.calls[api_method] += 1
+            if api_method in _LIMITED_METHODS and self._flooded(int(params['chat_id'])):
+                self.flood_waits[api_method] += 1
+                return 429, json.dumps({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }).encode()
+            result = self._handle(api_method, params)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+        finally:
+            self.inflight -= 1
+            self.last_request = time.monotonic()
+
+    def _flooded(self, chat_id: int) -> bool:
+        if self.flood_probability and random.random() < self.flood_probability:
+            return True
+        if self._chat_rate:
+            bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(self._chat_rate, self._chat_burst))
+            if not bucket.try_acquire():
+                return True
+        return bool(self._global_bucket and not self._global_bucket.try_acquire())
+
+    def _handle(self, api_method: str, params: dict):
+        if api_method == "getMe":
+            return BOT_USER
+
+        if api_method == "sendMessage":
+            chat_id = int(params['chat_id'])
+            message_id = next(self._message_ids)
+            message = self._store(api_method, chat_id, message_id, params)
+            self.last_message_id[chat_id] = message_id
+            self.inboxes[chat_id].put_nowait(message)
+            return message
+
+        if api_method == "editMessageText":
+            return self._store(api_method, int(params['chat_id']), int(params['message_id']), params)
+
+        if api_method == "editMessageReplyMarkup":
+            chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+            previous = self.messages.get((chat_id, message_id), {})
+            return self._store(api_method, chat_id, message_id, {**previous, 'reply_markup': params.get('reply_markup')})
+
+        return True
+
+    def _store(self, api_method: str, chat_id: int, message_id: int, params: dict) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get('text', ''),
+        }
+        reply_markup = params.get('reply_markup')
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        if reply_markup:
+            message['reply_markup'] = reply_markup
+        self.messages[(chat_id, message_id)] = message
+        self.log.append((api_method, message))
+        return message
+
+    def sent_to(self, chat_id: int) -> list[dict]:
+        """Все новые сообщения, отправленные в чат, по порядку"""
+        return [message for method, message in self.log if method == "sendMessage" and message['chat']['id'] == chat_id]
+
+    async def wait_idle(self, quiet: float):
+        """Ждет, пока бот перестанет обращаться к API (фоновые рассылки и правки меню)"""
+        while self.inflight or time.monotonic() - self.last_request < quiet:
+            await asyncio.sleep(quiet / 4)
+
+
+def callback_data(message: dict, prefix: str) -> Optional[str]:
+    """Первая кнопка сообщения, callback_data которой начинается с prefix"""
+    for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+        for button in row:
+            if button.get('callback_data', '').startswith(prefix):
+                return button['callback_data']
+    return None
+
+
+class FakeTelegram:
+    """Синтетические пользователи: сообщения и нажатия кнопок как обновления от Telegram"""
+
+    def __init__(self, application: Application, api: FakeBotAPI):
+        self.application = application
+        self.api = api
+        self._update_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Fake {user_id}"}
+
+    async def process(self, payload: dict) -> float:
+        """Обрабатывает обновление целиком; возвращает время обработки, с"""
+        payload['update_id'] = next(self._update_ids)
+        update = Update.de_json(payload, self.application.bot)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        return time.perf_counter() - started
+
+    async def message(self, user_id: int, text: str) -> float:
+        message = {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message['entities'] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return await self.process({"message": message})
+
+    async def press(self, user_id: int, data: str, message_id: Optional[int] = None) -> float:
+        """Нажатие кнопки под сообщением message_id (по умолчанию — последним в чате)"""
+        message_id = message_id or self.api.last_message_id.get(user_id, 1)
+        message = self.api.messages.get((user_id, message_id)) or {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "text": "",
+        }
+        return await self.process({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        }})
+
+    async def register(self, user_id: int, role: str, disciplines: list[str]):
+        """Полный диалог регистрации: /start, ФИО, роль, дисциплины"""
+        await self.message(user_id, "/start")
+        await self.message(user_id, f"Участник {user_id}")
+        await self.press(user_id, role)
+        if role == "judge":
+            await self.press(user_id, disciplines[0])
+        elif role == "expert":
+            for discipline in disciplines:
+                await self.press(user_id, f"toggle_{discipline}")
+            await self.press(user_id, "disciplines_done")
+
+
+def fake_application_builder(api: FakeBotAPI):
+    """Builder приложения без сети: запросы бота идут в api, собственного Updater нет"""
+    return (
+        Application.builder()
+        .token("123456:FAKE")
+        .request(api)
+        .get_updates_request(FakeBotAPI())
+        .updater(None)
+    )
+
+
+async def cleanup(pool, base: int = FAKE_USER_BASE):
+    """Удаляет синтетических пользователей, их вызовы, уведомления и состояние диалогов"""
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM calls WHERE judge_id >= $1 OR expert_id >= $1", base)
+        await conn.execute("DELETE FROM hj_calls WHERE judge_id >= $1 OR head_judge_id >= $1", base)
+        await conn.execute("DELETE FROM outbox WHERE chat_id >= $1", base)
+        await conn.execute("DELETE FROM preregistrations WHERE telegram_id >= $1", base)
+        await conn.execute("DELETE FROM users WHERE user_id >= $1", base)
+        await conn.execute("""
+            DELETE FROM bot_persistence
+            WHERE (kind = 'user_data' AND key::bigint >= $1)
+               OR (kind LIKE 'conversation:%' AND (key::jsonb ->> 1)::bigint >= $1)
+        """, base)
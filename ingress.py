@@ -0,0 +1,237 @@
+"""Прием обновлений от Telegram: вебхук на aiohttp и параллельная обработка с порядком по пользователю.
+
+В режиме BOT_MODE=ingress процесс только принимает вебхук и раздает обновления
+воркерам (BOT_MODE=worker) по user_id, см. UpdateRouter.
+
+Записанные обновления можно отправить в локальный вебхук без Telegram:
+
+    python ingress.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+from signal import SIGINT, SIGTERM
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import ClientSession, ClientTimeout, web
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но обновления одного пользователя — строго по очереди.
+
+    ConversationHandler и обработчики меню рассчитывают на порядок нажатий одного
+    пользователя, а обновления разных пользователей друг от друга не зависят.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._queued: dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine):
+        # Очередь пользователя ждет своего замка до общего семафора: серия нажатий одного
+        # пользователя занимает один слот из max_concurrent_updates, а не по слоту на нажатие
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.setdefault(user.id, asyncio.Lock())
+        self._queued[user.id] = self._queued.get(user.id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._queued[user.id] -= 1
+            if not self._queued[user.id]:
+                del self._queued[user.id]
+                del self._locks[user.id]
+
+    async def do_process_update(self, update: object, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def application_sink(application) -> Callable[[dict], Awaitable[None]]:
+    """Приемник обновлений, кладущий их в очередь приложения"""
+    async def sink(payload: dict):
+        await application.update_queue.put(Update.de_json(payload, application.bot))
+    return sink
+
+
+class WebhookServer:
+    """Локальный HTTP-эндпоинт, принимающий обновления от Telegram и передающий их в sink"""
+
+    def __init__(self, sink: Callable[[dict], Awaitable[None]], listen: str, port: int, path: str,
+                 secret_token: Optional[str] = None):
+        self.sink = sink
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=403)
+
+        try:
+            await self.sink(await request.json())
+        except Exception as e:
+            logger.error(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Вебхук слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def update_user_id(payload: dict) -> Optional[int]:
+    """user_id автора обновления прямо из JSON, без разбора в объекты telegram"""
+    for value in payload.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user') or value.get('chat')
+            if isinstance(user, dict) and 'id' in user:
+                return user['id']
+    return None
+
+
+class UpdateRouter:
+    """Раздает обновления воркерам по user_id.
+
+    Все обновления пользователя попадают в один воркер и пересылаются туда строго по порядку
+    (своя очередь и один отправитель на воркер), а разные воркеры работают параллельно.
+    """
+
+    def __init__(self, worker_urls: list[str], secret_token: Optional[str] = None):
+        self.worker_urls = worker_urls
+        self.secret_token = secret_token
+        self._queues = [asyncio.Queue() for _ in worker_urls]
+        self._tasks = []
+        self._session = None
+
+    def partition(self, payload: dict) -> int:
+        user_id = update_user_id(payload)
+        return (user_id or 0) % len(self.worker_urls)
+
+    async def route(self, payload: dict):
+        self._queues[self.partition(payload)].put_nowait(payload)
+
+    async def start(self):
+        self._session = ClientSession(timeout=ClientTimeout(total=10))
+        self._tasks = [asyncio.create_task(self._forward(i)) for i in range(len(self.worker_urls))]
+
+    async def stop(self, timeout: float = 10):
+        # Даем воркерам дополучить уже принятые обновления
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Не переслано обновлений: {sum(queue.qsize() for queue in self._queues)}")
+        for task in self._tasks:
+            task.cancel()
+        await self._session.close()
+
+    async def _forward(self, index: int):
+        queue = self._queues[index]
+        url = self.worker_urls[index]
+        headers = {SECRET_HEADER: self.secret_token} if self.secret_token else {}
+
+        while True:
+            payload = await queue.get()
+            delay = 0.5
+            # Повторяем, пока воркер не примет обновление, иначе нарушится порядок
+            while True:
+                try:
+                    async with self._session.post(url, json=payload, headers=headers) as response:
+                        if response.status < 500:
+                            if response.status != 200:
+                                logger.error(f"Воркер {url} отклонил обновление: HTTP {response.status}")
+                            break
+                except Exception as e:
+                    logger.error(f"Воркер {url} недоступен: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+            queue.task_done()
+
+
+async def run_ingress():
+    """Режим BOT_MODE=ingress: вебхук Telegram и пересылка обновлений воркерам из WORKER_URLS"""
+    secret_token = os.getenv('WEBHOOK_SECRET')
+    router = UpdateRouter(os.getenv('WORKER_URLS').split(','), secret_token)
+    server = WebhookServer(
+        router.route,
+        listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+        port=int(os.getenv('WEBHOOK_PORT', 8443)),
+        path=os.getenv('WEBHOOK_PATH', '/telegram'),
+        secret_token=secret_token
+    )
+
+    await router.start()
+    await server.start()
+    try:
+        if os.getenv('WEBHOOK_URL'):
+            async with Bot(os.getenv('BOT_TOKEN')) as bot:
+                await bot.set_webhook(
+                    url=os.getenv('WEBHOOK_URL'),
+                    secret_token=secret_token,
+                    allowed_updates=Update.ALL_TYPES
+                )
+
+        loop = asyncio.get_running_loop()
+        stop_event = asyncio.Event()
+        for sig in (SIGINT, SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await stop_event.wait()
+
+    finally:
+        await server.stop()
+        await router.stop()
+
+
+async def post_updates(path: str, url: str, secret_token: Optional[str] = None):
+    """Отправляет записанные обновления (JSON-массив или JSON Lines) в вебхук"""
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    payloads = json.loads(content) if content.startswith("[") else [json.loads(line) for line in content.splitlines() if line]
+
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    async with ClientSession() as session:
+        for payload in payloads:
+            async with session.post(url, json=payload, headers=headers) as response:
+                print(f"update_id={payload.get('update_id')}: HTTP {response.status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений в локальный вебхук")
+    parser.add_argument("updates", help="файл с обновлениями: JSON-массив или JSON Lines")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None, help="значение WEBHOOK_SECRET")
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.updates, args.url, args.secret))
@@ -0,0 +1,482 @@
+"""Журнал взаимодействий: каждое обновление, дошедшее до обработчика, каждое сообщение бота и ошибки.
+
+Таблица journal только дополняется (UPDATE и DELETE запрещены триггером). Записи копятся в памяти
+и раз в flush_interval секунд (или по batch_size записей) уходят в базу одним COPY, поэтому журнал
+не добавляет запросов на обработку обновления. Если база недоступна, записи ждут в буфере до
+max_buffer штук, дальше новые теряются (в лог пишется сколько).
+
+Что пишется:
+    update        — обновление целиком, имя обработчика, время и ошибки, залогированные при обработке
+    api           — sendMessage / editMessageText / editMessageReplyMarkup: кому, текст, код ответа
+    error         — ошибки фоновых задач (outbox, эскалация), случившиеся вне обработчиков
+
+Разбор жалобы «эксперт так и не пришел» и повтор дня на чистой базе:
+
+    python journal.py show USER_ID --since "2026-10-17 09:00" [--until ...]
+    python journal.py replay "2026-10-17 09:00" "2026-10-17 18:00" --target-db bot_replay [--speed 10]
+
+replay читает записанные обновления из базы бота (переменные окружения бота), а прогоняет их
+через настоящие обработчики на базе --target-db того же сервера с заглушкой Bot API вместо Telegram.
+Перед прогоном целевая база очищается от вызовов, уведомлений, диалогов и журнала прошлых прогонов
+(кроме --reuse), и в нее копируются дисциплины и регистрации соревнования; состояние незаконченных
+диалогов регистрации не копируется. Журнал самого прогона пишется в целевую базу. В конце replay
+сверяет число созданных вызовов с записью и завершается с кодом 1, если оно разошлось.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest, RequestData
+
+from calls import CALL_TABLES
+from events import current_event_id, live_event_id
+from metrics import iter_callback_handlers
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_COLUMNS = ('recorded_at', 'event_id', 'kind', 'name', 'user_id', 'update_id', 'duration', 'error', 'payload')
+
+# Сообщения бота, которые попадают в журнал; остальные методы (getMe, answerCallbackQuery) — нет
+_JOURNALED_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup")
+
+USER_HISTORY = """
+    SELECT recorded_at, kind, name, update_id, duration, error, payload
+    FROM journal
+    WHERE user_id = $1 AND recorded_at >= $2 AND recorded_at < $3
+    ORDER BY recorded_at, id
+"""
+
+# Вызовы, созданные за период: повтор сверяет их число с записью
+CALLS_CREATED = """
+    SELECT COUNT(*) FROM {table} WHERE event_id = $1 AND created_at >= $2 AND created_at < $3
+"""
+
+RECORDED_UPDATES = """
+    SELECT recorded_at, event_id, payload
+    FROM journal
+    WHERE kind = 'update' AND recorded_at >= $1 AND recorded_at < $2
+    ORDER BY recorded_at, id
+"""
+
+
+@dataclass
+class _Invocation:
+    """Обработка одного обновления: ошибки, залогированные по ходу, попадают в его запись"""
+    update_id: Optional[int]
+    errors: list = field(default_factory=list)
+
+
+_invocation: ContextVar[Optional[_Invocation]] = ContextVar("journal_invocation", default=None)
+
+
+class _ErrorCapture(logging.Handler):
+    """Ошибки из логов: внутри обработчика — в его запись, вне — отдельной записью error"""
+
+    def __init__(self, journal: "Journal"):
+        super().__init__(logging.ERROR)
+        self.journal = journal
+
+    def emit(self, record: logging.LogRecord):
+        # Собственные ошибки журнала (база недоступна) в журнал не пишем
+        if record.name == __name__:
+            return
+        invocation = _invocation.get()
+        if invocation is not None:
+            invocation.errors.append(record.getMessage())
+        else:
+            self.journal.record('error', record.name, error=record.getMessage())
+
+
+class Journal:
+    """Буфер записей журнала в памяти и фоновая запись в таблицу journal через COPY"""
+
+    def __init__(self, pool, flush_interval: float = 1.0, batch_size: int = 1000, max_buffer: int = 100_000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer: list[tuple] = []
+        self._dropped = 0
+        self._wake = asyncio.Event()
+        self._error_capture = _ErrorCapture(self)
+        self._task = None
+
+    def record(self, kind: str, name: str, user_id: Optional[int] = None, update_id: Optional[int] = None,
+               duration: Optional[float] = None, error: Optional[str] = None, payload=None,
+               recorded_at: Optional[datetime] = None):
+        if len(self._buffer) >= self.max_buffer:
+            self._dropped += 1
+            return
+        self._buffer.append((
+            recorded_at or datetime.now(),
+            live_event_id(),
+            kind,
+            name,
+            user_id,
+            update_id,
+            duration,
+            error,
+            json.dumps(payload, ensure_ascii=False) if payload is not None else None
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        logging.getLogger().addHandler(self._error_capture)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет то, что осталось в буфере"""
+        logging.getLogger().removeHandler(self._error_capture)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self._dropped:
+            logger.warning(f"Буфер журнала переполнен, потеряно записей: {self._dropped}")
+            self._dropped = 0
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table('journal', records=batch, columns=JOURNAL_COLUMNS)
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала ({len(batch)} записей): {e}")
+            # Возвращаем записи в начало буфера: после короткого сбоя базы они уйдут следующим COPY
+            self._buffer[:0] = batch[:max(self.max_buffer - len(self._buffer), 0)]
+
+
+def _record_callback(handler, journal: Journal):
+    callback = handler.callback
+    name = callback.__name__
+
+    @wraps(callback)
+    async def recorded(update, context):
+        if not isinstance(update, Update):
+            return await callback(update, context)
+        invocation = _Invocation(update.update_id)
+        token = _invocation.set(invocation)
+        received_at = datetime.now()
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception as e:
+            invocation.errors.append(repr(e))
+            raise
+        finally:
+            _invocation.reset(token)
+            journal.record(
+                'update',
+                name,
+                user_id=update.effective_user.id if update.effective_user else None,
+                update_id=update.update_id,
+                duration=time.perf_counter() - started,
+                error="\n".join(invocation.errors) or None,
+                payload=update.to_dict(),
+                recorded_at=received_at
+            )
+
+    handler.callback = recorded
+
+
+def record_handlers(application, journal: Journal):
+    """Пишет в журнал каждый вызов обработчика, включая вложенные в ConversationHandler.
+
+    Группы ниже 0 (проверка открытого соревнования) видят каждое обновление до основных обработчиков,
+    их не пишем: иначе обновление попало бы в журнал дважды и при повторе прогналось бы дважды.
+    """
+    for handler in iter_callback_handlers(application, min_group=0):
+        _record_callback(handler, journal)
+
+
+class JournalRequest(BaseRequest):
+    """Обертка транспорта Bot API: сообщения бота и ответы Telegram на них попадают в журнал"""
+
+    def __init__(self, request: BaseRequest, journal: Journal):
+        super().__init__()
+        self._request = request
+        self.journal = journal
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        if api_method not in _JOURNALED_METHODS:
+            return await self._request.do_request(
+                url,
+                method,
+                request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+
+        params = request_data.parameters if request_data else {}
+        message = {key: params[key] for key in ('message_id', 'text', 'reply_markup') if key in params}
+        if isinstance(message.get('reply_markup'), str):
+            message['reply_markup'] = json.loads(message['reply_markup'])
+        invocation = _invocation.get()
+        started = time.perf_counter()
+        error = None
+        try:
+            code, payload = await self._request.do_request(
+                url,
+                method,
+                request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+            message['code'] = code
+            if code >= 400:
+                error = json.loads(payload).get('description', str(code))
+            return code, payload
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self.journal.record(
+                'api',
+                api_method,
+                user_id=int(params['chat_id']) if 'chat_id' in params else None,
+                update_id=invocation.update_id if invocation else None,
+                duration=time.perf_counter() - started,
+                error=error,
+                payload=message
+            )
+
+
+def _describe(row) -> str:
+    """Одна строка хронологии пользователя"""
+    payload = json.loads(row['payload']) if row['payload'] else {}
+    if row['kind'] == 'update':
+        query = payload.get('callback_query')
+        action = f"кнопка {query.get('data')}" if query else f"сообщение {payload.get('message', {}).get('text')!r}"
+        line = f"{row['name']}: {action}, {row['duration'] * 1000:.0f} мс"
+    elif row['kind'] == 'api':
+        text = (payload.get('text') or '').split('\n')[0]
+        line = f"бот → {row['name']} {text!r} (код {payload.get('code', '—')})"
+    else:
+        line = row['name']
+    if row['error']:
+        line += f" ⚠️ {row['error']}"
+    return f"{row['recorded_at']:%H:%M:%S.%f}"[:-3] + f" #{row['update_id'] or '—'} {line}"
+
+
+async def _replay(application, rows, speed: float, concurrency: int) -> list[float]:
+    """Передает записанные обновления обработчикам с исходными интервалами, ускоренными в speed раз
+    (0 — без пауз); обновления одного пользователя — по очереди, как в PerUserUpdateProcessor.
+    Возвращает время обработки каждого обновления"""
+    locks = defaultdict(asyncio.Lock)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(payload: dict):
+        update = Update.de_json(payload, application.bot)
+        async with locks[update.effective_user.id if update.effective_user else None], semaphore:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    loop = asyncio.get_running_loop()
+    replay_started = loop.time()
+    tasks = []
+    for row in rows:
+        if speed:
+            delay = (row['recorded_at'] - rows[0]['recorded_at']).total_seconds() / speed
+            delay -= loop.time() - replay_started
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(process(json.loads(row['payload']))))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+# Состояние прошлых прогонов в целевой базе: вызовы и открытые вызовы судей (уникальный индекс),
+# уведомления, диалоги и журнал. С ними повтор разошелся бы с записью
+REPLAY_STATE_TABLES = ("calls", "hj_calls", "outbox", "journal", "bot_persistence", "expert_disciplines", "users")
+
+
+async def _compare_calls(source, target, event_id: int, since: datetime, until: datetime,
+                         replay_started_at: datetime) -> bool:
+    """Сравнивает число вызовов каждого типа в записи и в повторе; True — совпало"""
+    matched = True
+    for call_type, (table, _) in CALL_TABLES.items():
+        recorded = await source.fetchval(CALLS_CREATED.format(table=table), event_id, since, until)
+        replayed = await target.fetchval(
+            CALLS_CREATED.format(table=table), current_event_id(), replay_started_at, datetime.max
+        )
+        print(f"Вызовов {call_type}: в записи {recorded}, в повторе {replayed}")
+        matched = matched and recorded == replayed
+    return matched
+
+
+async def _seed(source, target, event_id: int):
+    """Очищает целевую базу от прошлых прогонов и копирует в нее дисциплины и регистрации соревнования event_id"""
+    target_event_id = current_event_id()
+    async with source.acquire() as src, target.acquire() as dst:
+        async with dst.transaction():
+            # TRUNCATE, а не DELETE: journal только дополняется, триггер запрещает DELETE
+            await dst.execute(f"TRUNCATE {', '.join(REPLAY_STATE_TABLES)}")
+            await dst.execute("DELETE FROM disciplines")
+            await _copy(src, dst, "disciplines", "SELECT * FROM disciplines")
+            for table in ("users", "expert_disciplines"):
+                await _copy(
+                    src, dst, table, f"SELECT * FROM {table} WHERE event_id = $1", event_id,
+                    replace={'event_id': target_event_id}
+                )
+
+
+async def _copy(src, dst, table: str, query: str, *args, replace: Optional[dict] = None):
+    rows = await src.fetch(query, *args)
+    if rows:
+        replace = replace or {}
+        await dst.copy_records_to_table(table, columns=list(rows[0].keys()), records=[
+            tuple(replace.get(column, value) for column, value in row.items()) for row in rows
+        ])
+    print(f"{table}: скопировано {len(rows)}")
+
+
+async def _cli():
+    import asyncpg
+    from disciplines import reload_disciplines
+    from events import reload_event
+    from fake_telegram import FakeBotAPI, fake_application_builder
+    from lifecycle import CallEscalator
+    from main import CALL_ESCALATION_INTERVAL, CALL_MAX_ESCALATIONS, build_application, db_settings, init_db_schema
+    from metrics import InstrumentedPool
+    from persistence import PostgresPersistence
+
+    parser = argparse.ArgumentParser(description="Журнал взаимодействий: хронология пользователя и повтор дня")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="хронология обновлений и сообщений пользователя")
+    show.add_argument("user_id", type=int)
+    show.add_argument("--since", type=datetime.fromisoformat, default=datetime.min)
+    show.add_argument("--until", type=datetime.fromisoformat, default=datetime.max)
+    replay = commands.add_parser("replay", help="прогнать записанные обновления на чистой базе")
+    replay.add_argument("since", type=datetime.fromisoformat)
+    replay.add_argument("until", type=datetime.fromisoformat)
+    replay.add_argument("--target-db", required=True, help="имя пустой базы на том же сервере")
+    replay.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи; 0 — без пауз")
+    replay.add_argument("--concurrency", type=int, default=32, help="обновлений одновременно")
+    replay.add_argument(
+        "--reuse", action="store_true", help="не очищать целевую базу и не копировать регистрации (продолжить прогон)"
+    )
+    replay.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа заглушки Bot API, с")
+    args = parser.parse_args()
+
+    source = await asyncpg.create_pool(**db_settings(), min_size=1, max_size=2)
+    try:
+        if args.command == "show":
+            for row in await source.fetch(USER_HISTORY, args.user_id, args.since, args.until):
+                print(_describe(row))
+            return
+
+        if args.target_db == db_settings()['database']:
+            raise SystemExit("Повтор на рабочей базе запрещен: укажите отдельную --target-db")
+        rows = await source.fetch(RECORDED_UPDATES, args.since, args.until)
+        if not rows:
+            print("За этот период обновлений в журнале нет")
+            return
+
+        target = InstrumentedPool(await asyncpg.create_pool(
+            **{**db_settings(), 'database': args.target_db}, min_size=2, max_size=20
+        ))
+        try:
+            await init_db_schema(target)
+            await reload_event(target)
+            if not args.reuse:
+                await _seed(source, target, rows[0]['event_id'])
+            await reload_disciplines(target)
+
+            journal = Journal(target)
+            api = FakeBotAPI(latency=args.api_latency)
+            builder = fake_application_builder(JournalRequest(api, journal)).persistence(PostgresPersistence(target))
+            application = build_application(builder, target, journal=journal)
+            journal.start()
+            await application.initialize()
+            await application.start()
+            application.bot_data['outbox'].start()
+            escalator = CallEscalator(
+                application.bot_data, interval=CALL_ESCALATION_INTERVAL, max_escalations=CALL_MAX_ESCALATIONS
+            )
+            escalator.start()
+            replay_started_at = datetime.now()
+            started = time.perf_counter()
+            try:
+                latencies = await _replay(application, rows, args.speed, args.concurrency)
+                await api.wait_idle(quiet=1.0)
+            finally:
+                await escalator.stop()
+                await application.bot_data['outbox'].stop()
+                await application.stop()
+                await application.shutdown()
+                await journal.stop()
+
+            elapsed = time.perf_counter() - started
+            errors = await target.fetchval(
+                "SELECT COUNT(*) FROM journal WHERE kind = 'update' AND error IS NOT NULL AND recorded_at >= $1",
+                replay_started_at
+            )
+            quantiles = (
+                statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+            )
+            print(f"Обновлений: {len(latencies)} за {elapsed:.1f} с, с ошибками: {errors}")
+            print(
+                f"Обработка: p50 {quantiles[49] * 1000:.0f} мс, p95 {quantiles[94] * 1000:.0f} мс, "
+                f"p99 {quantiles[98] * 1000:.0f} мс, max {max(latencies) * 1000:.0f} мс"
+            )
+            print(f"Запросов к Bot API: {dict(api.calls)}, ответов 429: {dict(api.flood_waits)}")
+            if not await _compare_calls(
+                source, target, rows[0]['event_id'], args.since, args.until, replay_started_at
+            ):
+                raise SystemExit("Повтор разошелся с записью по числу вызовов")
+        finally:
+            await target.close()
+    finally:
+        await source.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
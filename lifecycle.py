@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from calls import CallStatus, escalate_due_calls
+from events import live_event_id
+from menu import call_message
+from outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+
+class CallEscalator:
+    """Фоновая эскалация вызовов, которые никто не принял вовремя.
+
+    Раз в tick секунд берет из частичного индекса по next_escalation_at вызовы, у которых
+    наступил срок, и рассылает их повторно: первая эскалация вызова эксперта уходит
+    свободным экспертам, которым он еще не приходил, следующие — всем. После max_escalations
+    вызов становится expired, а судья получает уведомление. Уведомления кладутся в outbox
+    в той же транзакции, что и эскалация.
+    """
+
+    def __init__(self, bot_data: dict, interval: float, max_escalations: int, tick: float = 5):
+        self.bot_data = bot_data
+        self.interval = timedelta(seconds=interval)
+        self.max_escalations = max_escalations
+        self.tick = tick
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка эскалации вызовов: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def run_once(self):
+        live_menus = self.bot_data['live_menus']
+        event_id = live_event_id()
+        if event_id is None:
+            return
+        # Индексы грузятся до того, как эскалация возьмет соединение и откроет транзакцию
+        await self.bot_data['roster'].warm()
+        await self.bot_data['expert_load'].warm()
+        for call_type in ('expert', 'hj'):
+            async with self.bot_data['db_pool'].acquire() as conn:
+                async with conn.transaction():
+                    calls = await escalate_due_calls(conn, event_id, call_type, self.interval, self.max_escalations)
+                    for call in calls:
+                        await self._escalate(conn, call_type, call)
+            if not calls:
+                continue
+            self.bot_data['outbox'].wake()
+
+            board = self.bot_data['call_board']
+            for call in calls:
+                if call['status'] == CallStatus.EXPIRED:
+                    board.closed(call_type, call['id'])
+                else:
+                    board.escalated(call_type, call['id'], call['escalations'])
+
+            expired = [call['judge_id'] for call in calls if call['status'] == CallStatus.EXPIRED]
+            if expired:
+                live_menus.touch(expired)
+                if call_type == "hj":
+                    await live_menus.touch_role('head_judge')
+
+    async def _escalate(self, conn, call_type: str, call):
+        judge = await self.bot_data['profile_cache'].get(conn, call['judge_id'])
+        roster = self.bot_data['roster']
+
+        if call['status'] == CallStatus.EXPIRED:
+            logger.info(f"Вызов {call_type} {call['id']} истек без ответа")
+            # Без ссылки на вызов: он уже закрыт, а сообщение судье отправить нужно
+            await enqueue(
+                conn,
+                [call['judge_id']],
+                f"⌛ На вызов {call['id']} никто не ответил, он закрыт. Создайте новый вызов при необходимости."
+            )
+            return
+
+        if call_type == "expert":
+            recipients = await roster.users('expert')
+            if call['escalations'] == 1:
+                # Первая эскалация — свободным экспертам, которым вызов еще не отправляли,
+                # дальше — всем экспертам
+                notified = {
+                    row['chat_id'] for row in await conn.fetch(
+                        "SELECT chat_id FROM outbox WHERE call_type = 'expert' AND call_id = $1", call['id']
+                    )
+                }
+                available = set(await self.bot_data['expert_load'].pick(recipients, 0)) - notified
+                recipients = available or recipients - notified
+        else:
+            recipients = await roster.users('head_judge')
+
+        logger.info(f"Эскалация {call['escalations']} вызова {call_type} {call['id']}: получателей {len(recipients)}")
+        text, reply_markup = call_message(call_type, judge, call['id'], reminder=True)
+        await enqueue(conn, recipients, text, reply_markup, call_type=call_type, call_id=call['id'])
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+from typing import Iterable
+
+from events import live_event_id
+from menu import fetch_menu_state, render_main_menu
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMenus:
+    """Живое обновление главного меню без нажатия «Обновить статус».
+
+    Для каждого пользователя запоминается последнее сообщение с меню (chat_id, message_id).
+    Обработчики сообщают, чье состояние изменилось (touch / touch_role), а изменения
+    копятся debounce секунд и применяются одной правкой сообщения на пользователя
+    (MessageEditor не отправляет правку, если меню не изменилось).
+    При нескольких процессах отметки рассылаются остальным через PgEventBus (attach).
+    """
+
+    def __init__(self, pool, profiles, roster, editor, debounce: float = 1.0):
+        self.pool = pool
+        self.profiles = profiles
+        self.roster = roster
+        self.editor = editor
+        self.debounce = debounce
+        self._subscriptions: dict[int, tuple[int, int]] = {}
+        self._pending: set[int] = set()
+        self._flush_task = None
+        self.bus = None
+
+    def subscribe(self, user_id: int, chat_id: int, message_id: int):
+        """Запоминает сообщение с меню пользователя"""
+        self._subscriptions[user_id] = (chat_id, message_id)
+
+    def unsubscribe(self, user_id: int):
+        self._subscriptions.pop(user_id, None)
+        self._pending.discard(user_id)
+
+    def attach(self, bus):
+        """Подключает обмен отметками с другими процессами"""
+        self.bus = bus
+        bus.subscribe('live_menus', self._on_remote_touch)
+
+    def touch(self, user_ids: Iterable[int]):
+        """Помечает меню пользователей устаревшими"""
+        user_ids = list(user_ids)
+        self._mark(user_ids)
+        self._publish({'users': user_ids})
+
+    async def touch_role(self, role: str):
+        """Помечает устаревшими меню всех участников роли"""
+        self._mark(await self.roster.users(role))
+        self._publish({'role': role})
+
+    def _mark(self, user_ids: Iterable[int]):
+        self._pending.update(user_id for user_id in user_ids if user_id in self._subscriptions)
+        if self._pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def _publish(self, event: dict):
+        if self.bus:
+            event['origin'] = self.bus.origin
+            asyncio.create_task(self._send_event(json.dumps(event)))
+
+    async def _send_event(self, payload: str):
+        try:
+            await self.bus.publish('live_menus', payload)
+        except Exception as e:
+            logger.error(f"Ошибка публикации обновления меню: {e}")
+
+    def _on_remote_touch(self, payload: str):
+        if not payload:
+            return
+        event = json.loads(payload)
+        if event['origin'] == self.bus.origin:
+            return
+        if 'role' in event:
+            asyncio.create_task(self._mark_role(event['role']))
+        else:
+            self._mark(event['users'])
+
+    async def _mark_role(self, role: str):
+        try:
+            self._mark(await self.roster.users(role))
+        except Exception as e:
+            logger.error(f"Ошибка живого обновления меню роли {role}: {e}")
+
+    async def _flush(self):
+        await asyncio.sleep(self.debounce)
+        # Все, что пришло до этого момента, схлопывается в одну правку на пользователя
+        pending, self._pending = self._pending, set()
+        await asyncio.gather(*(self._refresh(user_id) for user_id in pending))
+        if self._pending:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _refresh(self, user_id: int):
+        subscription = self._subscriptions.get(user_id)
+        # Без открытого соревнования меню нечем обновить: подписка ждет следующего
+        if subscription is None or live_event_id() is None:
+            return
+
+        try:
+            state = await fetch_menu_state(self.pool, self.profiles, user_id)
+            if not state:
+                self.unsubscribe(user_id)
+                return
+            text, reply_markup = render_main_menu(state)
+
+            chat_id, message_id = subscription
+            result = await self.editor.edit(chat_id, message_id, text, reply_markup=reply_markup)
+            if not result.ok and self._subscriptions.get(user_id) == subscription:
+                # Сообщение удалено или слишком старое — ждем, пока пользователь откроет меню снова
+                self.unsubscribe(user_id)
+
+        except Exception as e:
+            logger.error(f"Ошибка живого обновления меню {user_id}: {e}")
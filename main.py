@@ -1,21 +1,63 @@
 import asyncio
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from signal import SIGINT, SIGTERM
 
 import asyncpg
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, User
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     filters,
+    ApplicationHandlerStop,
     ContextTypes,
-    ConversationHandler
+    ConversationHandler,
+    TypeHandler
 )
+from telegram.request import HTTPXRequest
+
+from availability import ExpertLoad
+from cache import ProfileCache
+from dashboard import CallBoard, DashboardServer
+from disciplines import DEFAULT_DISCIPLINES, current_disciplines, reload_disciplines
+from events import create_partition, create_partitions, current_event_id, live_event_id, reload_event
+from ingress import PerUserUpdateProcessor, WebhookServer, application_sink, run_ingress
+from calls import (
+    CALL_TABLES,
+    OPEN_CALL,
+    ClaimStatus,
+    OpenStatus,
+    cancel_open_calls,
+    claim_call,
+    fetch_open_queue,
+    open_call,
+    resolve_call
+)
+from journal import Journal, JournalRequest, record_handlers
+from lifecycle import CallEscalator
+from live import LiveMenus
+from menu import (
+    MenuState,
+    call_message,
+    fetch_menu_state,
+    queue_filter_keyboard,
+    render_call_queue,
+    render_main_menu,
+    resolve_keyboard
+)
+from metrics import InstrumentedPool, InstrumentedRequest, MetricsServer, instrument_handlers
+from notifications import MessageEditor, NotificationDispatcher, RateLimiter
+from outbox import OutboxDrainer, enqueue
+from persistence import PostgresPersistence
+from pgbus import PROCESS_ORIGIN, PgEventBus
+from reports import build_report
+from roster import RosterIndex
+from roster_import import claim_preregistration, import_roster, parse_roster_csv
+from unit_of_work import bind_units_of_work, current_unit_of_work
 
 load_dotenv()
 
@@ -25,36 +67,192 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-REGISTER_NAME, REGISTER_ROLE, JUDGE_DISCIPLINE = range(3)
+REGISTER_NAME, REGISTER_ROLE, JUDGE_DISCIPLINE, EXPERT_DISCIPLINES = range(4)
+
+# Через сколько секунд вызов эксперта рассылается всем экспертам, если по дисциплине никто не откликнулся
+EXPERT_FALLBACK_TIMEOUT = int(os.getenv('EXPERT_FALLBACK_TIMEOUT', 60))
+# Интервал повторных рассылок непринятых вызовов и их количество до перевода в expired
+CALL_ESCALATION_INTERVAL = int(os.getenv('CALL_ESCALATION_INTERVAL', 60))
+CALL_MAX_ESCALATIONS = int(os.getenv('CALL_MAX_ESCALATIONS', 3))
+# Повторное нажатие «вызвать» при открытом вызове напоминает о нем не чаще раза в столько секунд
+CALL_REPING_COOLDOWN = timedelta(seconds=int(os.getenv('CALL_REPING_COOLDOWN', 30)))
+# Сколько наименее загруженных свободных экспертов получают новый вызов (0 — все эксперты дисциплины)
+EXPERT_FANOUT = int(os.getenv('EXPERT_FANOUT', 3))
+# Название соревнования, которое открывается при первом запуске (дальше см. events.py)
+EVENT_NAME = os.getenv('EVENT_NAME', 'Соревнование')
+# Telegram id администраторов: они могут прислать боту CSV со списком участников (см. roster_import.py)
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+# Вызовов на одной странице очереди
+QUEUE_PAGE_SIZE = int(os.getenv('QUEUE_PAGE_SIZE', 5))
+# Кто может просматривать очередь вызовов каждого типа
+QUEUE_ROLES = {'expert': 'expert', 'hj': 'head_judge'}
+
+NO_LIVE_EVENT_TEXT = "⚠️ Соревнование не открыто. Вызовы и регистрация недоступны до открытия нового."
+
+EXPERT_DISCIPLINES_TEXT = (
+    "Отметьте дисциплины, по которым вы консультируете, и нажмите «Готово».\n"
+    "Если не выбрать ни одной, вы будете получать вызовы по всем дисциплинам."
+)
 
 
-async def init_db():
-    """Инициализация подключения к PostgreSQL"""
-    return await asyncpg.create_pool(
+def is_discipline(data: str) -> bool:
+    """Фильтр callback_data выбора дисциплины по действующему справочнику"""
+    return data in current_disciplines()
+
+
+def is_discipline_toggle(data: str) -> bool:
+    """Фильтр callback_data отметки дисциплины эксперта"""
+    return data.startswith("toggle_") and data[len("toggle_"):] in current_disciplines()
+
+
+def escalation_deadline(created_at, timeout):
+    """Время первой эскалации вызова; None — эскалация отключена"""
+    return created_at + timedelta(seconds=timeout) if timeout > 0 else None
+
+
+def db_settings():
+    """Параметры подключения к PostgreSQL из окружения"""
+    return dict(
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASSWORD'),
         database=os.getenv('DB_NAME'),
         host=os.getenv('DB_HOST'),
-        port=int(os.getenv('DB_PORT'))
+        port=int(os.getenv('DB_PORT')),
+        # Запросы подготавливаются один раз на соединение и дальше берутся из кэша asyncpg;
+        # за PgBouncer в режиме transaction кэш нужно выключить (DB_STATEMENT_CACHE_SIZE=0)
+        statement_cache_size=int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256)),
+        # Триггеры уведомлений кладут метку процесса в событие, свои изменения процесс пропускает
+        server_settings={'bot.origin': PROCESS_ORIGIN}
+    )
+
+
+def pool_settings():
+    """Размер пула из окружения: обработчик держит не больше одного соединения (см. unit_of_work.py)"""
+    return dict(
+        min_size=int(os.getenv('DB_POOL_MIN_SIZE', 5)),
+        max_size=int(os.getenv('DB_POOL_MAX_SIZE', 20)),
+        max_inactive_connection_lifetime=float(os.getenv('DB_POOL_MAX_IDLE', 300))
+    )
+
+
+async def init_db():
+    """Инициализация подключения к PostgreSQL (пул с метриками, см. metrics.py)"""
+    return InstrumentedPool(await asyncpg.create_pool(**db_settings(), **pool_settings()))
+
+
+async def connect_db():
+    """Отдельное соединение вне пула (для LISTEN)"""
+    return await asyncpg.connect(**db_settings())
+
+
+async def _has_column(conn, table: str, column: str) -> bool:
+    return await conn.fetchval(
+        """SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1 AND column_name = $2
+        )""",
+        table,
+        column
     )
 
 
+async def _partition_by_event(conn, table: str, responder: str, event_id: int):
+    """Переводит обычную таблицу вызовов на партиции по event_id, прежние вызовы относятся к event_id"""
+    legacy = f"{table}_unpartitioned"
+    async with conn.transaction():
+        await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        await conn.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+        # Ключи партиционированной таблицы обязаны включать event_id
+        await conn.execute(f"""
+            CREATE TABLE {table} (
+                LIKE {legacy} INCLUDING DEFAULTS,
+                event_id INT NOT NULL REFERENCES events(id),
+                PRIMARY KEY (event_id, id),
+                FOREIGN KEY (event_id, judge_id) REFERENCES users (event_id, user_id),
+                FOREIGN KEY (event_id, {responder}) REFERENCES users (event_id, user_id)
+            ) PARTITION BY LIST (event_id)
+        """)
+        # id продолжают нумероваться той же последовательностью
+        await conn.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        await create_partition(conn, table, event_id)
+        await conn.execute(f"INSERT INTO {table} SELECT *, $1::int FROM {legacy}", event_id)
+        await conn.execute(f"DROP TABLE {legacy}")
+    logger.info(f"Таблица {table} переведена на партиции по соревнованиям")
+
+
 async def init_db_schema(pool):
     """Инициализация схемы базы данных"""
     async with pool.acquire() as conn:
+        # Соревнования (см. events.py); текущее — единственное незавершенное
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                archived_at TIMESTAMP
+            )
+        """)
+        await conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS events_one_live ON events ((TRUE)) WHERE finished_at IS NULL"
+        )
+        if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM events)"):
+            await conn.execute(
+                "INSERT INTO events (name, started_at) VALUES ($1, $2)", EVENT_NAME, datetime.now()
+            )
+        # Сюда попадают регистрации и вызовы, накопленные до появления соревнований
+        first_event_id = await conn.fetchval("SELECT MIN(id) FROM events")
+
+        # Регистрация участника на соревновании: роль и дисциплины у каждого соревнования свои
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
+                event_id INT NOT NULL REFERENCES events(id),
+                user_id BIGINT NOT NULL,
                 name TEXT NOT NULL,
                 role TEXT NOT NULL,
-                discipline TEXT
+                discipline TEXT,
+                PRIMARY KEY (event_id, user_id)
+            )
+        """)
+        if not await _has_column(conn, "users", "event_id"):
+            # Вместе с первичным ключом удаляются внешние ключи на users(user_id), они пересоздаются ниже
+            async with conn.transaction():
+                await conn.execute("ALTER TABLE users ADD COLUMN event_id INT REFERENCES events(id)")
+                await conn.execute("UPDATE users SET event_id = $1", first_event_id)
+                await conn.execute("""
+                    ALTER TABLE users
+                        ALTER COLUMN event_id SET NOT NULL,
+                        DROP CONSTRAINT users_pkey CASCADE,
+                        ADD PRIMARY KEY (event_id, user_id)
+                """)
+        # Эксперт может отметиться занятым (см. availability.py)
+        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS available BOOLEAN NOT NULL DEFAULT TRUE")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS expert_disciplines (
+                event_id INT NOT NULL,
+                user_id BIGINT NOT NULL,
+                discipline TEXT NOT NULL,
+                PRIMARY KEY (event_id, user_id, discipline),
+                FOREIGN KEY (event_id, user_id) REFERENCES users (event_id, user_id) ON DELETE CASCADE
             )
         """)
+        if not await _has_column(conn, "expert_disciplines", "event_id"):
+            async with conn.transaction():
+                await conn.execute("ALTER TABLE expert_disciplines ADD COLUMN event_id INT")
+                await conn.execute("UPDATE expert_disciplines SET event_id = $1", first_event_id)
+                await conn.execute("""
+                    ALTER TABLE expert_disciplines
+                        ALTER COLUMN event_id SET NOT NULL,
+                        DROP CONSTRAINT expert_disciplines_pkey,
+                        ADD PRIMARY KEY (event_id, user_id, discipline),
+                        ADD FOREIGN KEY (event_id, user_id) REFERENCES users (event_id, user_id) ON DELETE CASCADE
+                """)
+        # calls и hj_calls создаются обычными таблицами и ниже переводятся на партиции по event_id
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS calls (
                 id SERIAL PRIMARY KEY,
-                judge_id BIGINT REFERENCES users(user_id),
-                expert_id BIGINT REFERENCES users(user_id),
+                judge_id BIGINT,
+                expert_id BIGINT,
                 discipline TEXT NOT NULL,
                 created_at TIMESTAMP NOT NULL
             )
@@ -62,31 +260,329 @@ async def init_db_schema(pool):
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS hj_calls (
                 id SERIAL PRIMARY KEY,
-                judge_id BIGINT REFERENCES users(user_id) NOT NULL,
-                head_judge_id BIGINT REFERENCES users(user_id),
+                judge_id BIGINT NOT NULL,
+                head_judge_id BIGINT,
                 created_at TIMESTAMP NOT NULL,
                 resolved_at TIMESTAMP)
         """)
+        # Партиции по соревнованиям: запросы бота с event_id текущего соревнования читают
+        # только его партицию, сколько бы соревнований ни накопилось
+        for table, responder in CALL_TABLES.values():
+            # relkind — тип "char", asyncpg отдает его как bytes; в text он приходит строкой
+            if await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = $1::regclass", table) == 'r':
+                await _partition_by_event(conn, table, responder, first_event_id)
+        for row in await conn.fetch("SELECT id FROM events WHERE archived_at IS NULL"):
+            await create_partitions(conn, row['id'])
+
+        # Справочник дисциплин (см. disciplines.py); code попадает в callback_data, поэтому короткий
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS disciplines (
+                code TEXT PRIMARY KEY CHECK (code ~ '^[A-Za-z0-9]{1,20}$'),
+                label TEXT NOT NULL,
+                position INT NOT NULL DEFAULT 0,
+                active BOOLEAN NOT NULL DEFAULT TRUE
+            )
+        """)
+        if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM disciplines)"):
+            await conn.executemany(
+                "INSERT INTO disciplines (code, label, position) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+                [(code, label, position) for position, (code, label) in enumerate(DEFAULT_DISCIPLINES)]
+            )
+
+        # Журнал взаимодействий (см. journal.py): пишется пачками через COPY и только дополняется.
+        # Записи идут по времени, поэтому BRIN по recorded_at занимает килобайты на миллионы строк
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                id BIGSERIAL PRIMARY KEY,
+                recorded_at TIMESTAMP NOT NULL,
+                event_id INT,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                user_id BIGINT,
+                update_id BIGINT,
+                duration DOUBLE PRECISION,
+                error TEXT,
+                payload JSONB
+            );
+            CREATE INDEX IF NOT EXISTS journal_recorded ON journal USING BRIN (recorded_at);
+            CREATE INDEX IF NOT EXISTS journal_user ON journal (user_id, recorded_at);
+
+            CREATE OR REPLACE FUNCTION journal_append_only() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'journal только дополняется';
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS journal_append_only ON journal;
+            CREATE TRIGGER journal_append_only
+            BEFORE UPDATE OR DELETE ON journal
+            FOR EACH STATEMENT EXECUTE FUNCTION journal_append_only();
+        """)
+
+        # Исходящие уведомления о вызовах (см. outbox.py); call_id NULL — сообщение не привязано к открытому вызову
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id BIGSERIAL PRIMARY KEY,
+                call_type TEXT,
+                call_id INT,
+                chat_id BIGINT NOT NULL,
+                text TEXT NOT NULL,
+                reply_markup JSONB,
+                created_at TIMESTAMP NOT NULL,
+                next_attempt_at TIMESTAMP NOT NULL,
+                attempts INT NOT NULL DEFAULT 0,
+                sent_at TIMESTAMP,
+                failed_at TIMESTAMP,
+                error TEXT
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS outbox_pending
+            ON outbox (next_attempt_at, id) WHERE sent_at IS NULL AND failed_at IS NULL
+        """)
+
+        # Участники, заранее внесенные организаторами (по id или username), см. roster_import.py
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS preregistrations (
+                id SERIAL PRIMARY KEY,
+                telegram_id BIGINT UNIQUE,
+                username TEXT UNIQUE,
+                name TEXT NOT NULL,
+                role TEXT NOT NULL,
+                discipline TEXT,
+                disciplines TEXT[] NOT NULL DEFAULT '{}',
+                CHECK (telegram_id IS NOT NULL OR username IS NOT NULL)
+            )
+        """)
+
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS bot_persistence (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                data JSONB NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+
+        # Уведомления других процессов об изменении регистраций (см. PgEventBus.subscribe_remote).
+        # origin — метка процесса-автора из настройки соединения bot.origin (пусто у утилит)
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_profile_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('profile_changed', json_build_object(
+                    'origin', current_setting('bot.origin', true),
+                    'user_id', COALESCE(NEW.user_id, OLD.user_id)
+                )::text);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_roster_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('roster_changed', '');
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        await conn.execute("""
+            DROP TRIGGER IF EXISTS users_profile_changed ON users;
+            CREATE TRIGGER users_profile_changed
+            AFTER INSERT OR UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_profile_changed();
+
+            DROP TRIGGER IF EXISTS users_roster_changed ON users;
+            CREATE TRIGGER users_roster_changed
+            AFTER INSERT OR UPDATE OF role, discipline OR DELETE ON users
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_roster_changed();
+
+            DROP TRIGGER IF EXISTS expert_disciplines_roster_changed ON expert_disciplines;
+            CREATE TRIGGER expert_disciplines_roster_changed
+            AFTER INSERT OR UPDATE OR DELETE ON expert_disciplines
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_roster_changed();
+        """)
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_disciplines_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('disciplines_changed', '');
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS disciplines_changed ON disciplines;
+            CREATE TRIGGER disciplines_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON disciplines
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_disciplines_changed();
+        """)
+
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_event_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('event_changed', '');
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS events_changed ON events;
+            CREATE TRIGGER events_changed
+            AFTER INSERT OR UPDATE OR DELETE ON events
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_event_changed();
+        """)
+
+        # Жизненный цикл вызовов (см. calls.CallStatus)
+        for table in ("calls", "hj_calls"):
+            await conn.execute(f"""
+                ALTER TABLE {table}
+                    ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'created',
+                    ADD COLUMN IF NOT EXISTS notified_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS accepted_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS resolved_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS cancelled_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS expired_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS escalations INT NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS next_escalation_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS pinged_at TIMESTAMP
+            """)
+        # Дисциплина судьи на момент вызова главного судьи — для фильтра очереди
+        await conn.execute("ALTER TABLE hj_calls ADD COLUMN IF NOT EXISTS discipline TEXT")
+        await conn.execute("""
+            UPDATE hj_calls h SET discipline = u.discipline
+            FROM users u
+            WHERE h.discipline IS NULL AND u.event_id = h.event_id AND u.user_id = h.judge_id
+                AND u.discipline IS NOT NULL
+        """)
+        # Вызовы, принятые до появления статусов. Раньше resolved_at в hj_calls означал момент принятия
+        await conn.execute("""
+            UPDATE calls SET status = 'accepted', accepted_at = created_at
+            WHERE status = 'created' AND expert_id IS NOT NULL
+        """)
+        await conn.execute("""
+            UPDATE hj_calls SET status = 'resolved', accepted_at = resolved_at
+            WHERE status = 'created' AND head_judge_id IS NOT NULL
+        """)
+
+        # Частичные индексы по открытым вызовам: счетчики главного меню и эскалация
+        # читают только открытые вызовы, сколько бы истории ни накопилось
+        await conn.execute("""
+            DROP INDEX IF EXISTS calls_open_by_judge, hj_calls_open_by_judge, hj_calls_open, hj_calls_open_created,
+                calls_open_judge, hj_calls_open_judge
+        """)
+        for table in ("calls", "hj_calls"):
+            # Не больше одного открытого вызова на судью (см. calls.open_call). Лишние открытые
+            # вызовы, накопленные до появления индекса, отменяются — остается самый ранний
+            await conn.execute(f"""
+                UPDATE {table} SET status = 'cancelled', cancelled_at = now(), next_escalation_at = NULL
+                WHERE {OPEN_CALL} AND id NOT IN (
+                    SELECT DISTINCT ON (event_id, judge_id) id FROM {table}
+                    WHERE {OPEN_CALL}
+                    ORDER BY event_id, judge_id, created_at, id
+                )
+            """)
+            await conn.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {table}_one_open_per_judge
+                ON {table} (event_id, judge_id) WHERE {OPEN_CALL}
+            """)
+            # Очередь открытых вызовов: keyset-пагинация по (created_at, id), см. calls.OPEN_QUEUE
+            await conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table}_open_queue
+                ON {table} (created_at, id) WHERE {OPEN_CALL}
+            """)
+            await conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table}_open_discipline
+                ON {table} (discipline, created_at, id) WHERE {OPEN_CALL}
+            """)
+            await conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table}_escalation
+                ON {table} (next_escalation_at) WHERE {OPEN_CALL} AND next_escalation_at IS NOT NULL
+            """)
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_status ON {table} (status, created_at)")
+        # Нагрузка экспертов и их принятые вызовы (availability.EXPERT_LOAD_QUERY, меню эксперта)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS calls_expert_accepted
+            ON calls (expert_id, accepted_at) WHERE expert_id IS NOT NULL
+        """)
+        # Кому уже ушел вызов — эскалация не повторяет его тем же экспертам
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS outbox_call ON outbox (call_type, call_id) WHERE call_id IS NOT NULL
+        """)
+        # Другие процессы сбрасывают индекс нагрузки экспертов (см. availability.ExpertLoad).
+        # Только то, что меняет нагрузку: назначение эксперта, вход в accepted и выход из него,
+        # отметка «занят»; рассылки, эскалации и отмены открытых вызовов событий не дают
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_expert_load_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('expert_load_changed', json_build_object(
+                    'origin', current_setting('bot.origin', true)
+                )::text);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS calls_expert_load_changed ON calls;
+            CREATE TRIGGER calls_expert_load_changed
+            AFTER UPDATE OF status, expert_id ON calls
+            FOR EACH ROW
+            WHEN (OLD.expert_id IS DISTINCT FROM NEW.expert_id
+                  OR (OLD.status = 'accepted') IS DISTINCT FROM (NEW.status = 'accepted'))
+            EXECUTE FUNCTION notify_expert_load_changed();
+
+            DROP TRIGGER IF EXISTS users_expert_load_changed ON users;
+            CREATE TRIGGER users_expert_load_changed
+            AFTER UPDATE OF available ON users
+            FOR EACH ROW WHEN (OLD.available IS DISTINCT FROM NEW.available)
+            EXECUTE FUNCTION notify_expert_load_changed();
+        """)
+
+
+async def edit_query_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None):
+    """Правит сообщение с нажатой кнопкой через общий MessageEditor (без пустых правок)"""
+    message = update.callback_query.message
+    return await context.bot_data['editor'].edit(message.chat_id, message.message_id, text, reply_markup=reply_markup)
+
+
+async def require_live_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Без открытого соревнования отвечает сразу и не пускает обновление к остальным обработчикам"""
+    if live_event_id() is not None:
+        return
+    if update.callback_query:
+        await update.callback_query.answer(NO_LIVE_EVENT_TEXT, show_alert=True)
+    elif update.effective_message:
+        await update.effective_message.reply_text(NO_LIVE_EVENT_TEXT)
+    raise ApplicationHandlerStop
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик команды /start"""
     try:
-        pool = context.bot_data['db_pool']
+        db = current_unit_of_work()
         user_id = update.effective_user.id
 
-        async with pool.acquire() as conn:
-            user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", user_id)
+        user = await context.bot_data['profile_cache'].get(db, user_id)
 
         if user:
+            await db.release()
             await (update.message or update.callback_query.message).reply_text("Вы уже зарегистрированы!")
             return ConversationHandler.END
-        else:
-            await update.message.reply_text("👋 Добро пожаловать! Введите ваше ФИО:")
-            return REGISTER_NAME
+
+        # Организаторы могли внести участника заранее — тогда диалог регистрации не нужен
+        user = await claim_preregistration(db, current_event_id(), user_id, update.effective_user.username)
+        if user:
+            context.bot_data['profile_cache'].put(user_id, user)
+            context.bot_data['roster'].invalidate()
+            state = await fetch_menu_state(db, context.bot_data['profile_cache'], user_id)
+            await db.release()
+            await update.message.reply_text(f"🎉 {user['name']}, организаторы уже зарегистрировали вас!")
+            await show_main_menu(update, context, state=state)
+            return ConversationHandler.END
+
+        await db.release()
+        await update.message.reply_text("👋 Добро пожаловать! Введите ваше ФИО:")
+        return REGISTER_NAME
 
     except Exception as e:
         logger.error(f"Ошибка в start: {str(e)}")
+        # Соединение возвращаем в пул до сообщения пользователю, как и в обычной ветке
+        await current_unit_of_work().release()
         await update.message.reply_text("⚠️ Ошибка при регистрации. Попробуйте позже.")
         return ConversationHandler.END
 
@@ -114,29 +610,22 @@ async def register_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     context.user_data['role'] = role
 
     if role == "judge":
-        await query.edit_message_text(
+        await edit_query_message(
+            update,
+            context,
             "Выберите вашу дисциплину:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Эстафета", callback_data="relay")],
-                [InlineKeyboardButton("Практическая олимпиада LEGO", callback_data="practicallego")],
-                [InlineKeyboardButton("Следование по линии обр. конструкторы", callback_data="linecons")],
-                [InlineKeyboardButton("Следование по линии: BEAM", callback_data="BEAMline")],
-                [InlineKeyboardButton("Следование по узкой линии", callback_data="narrowline")],
-                [InlineKeyboardButton("Лабиринт", callback_data="maze")],
-                [InlineKeyboardButton("RoboCup", callback_data="robocup")],
-                [InlineKeyboardButton("Воздушные гонки", callback_data="airrace")],
-                [InlineKeyboardButton("Сумо", callback_data="sumo")],
-                [InlineKeyboardButton("Аквароботы", callback_data="aqua")],
-                [InlineKeyboardButton("OnStage", callback_data="onstage")],
-                [InlineKeyboardButton("Марафон шагающих роботов", callback_data="walking")],
-                [InlineKeyboardButton("Футбол автономный", callback_data="footballauto")],
-                [InlineKeyboardButton("Ралли по коридору", callback_data="rally")],
-                [InlineKeyboardButton("Сумо андроидных роботов", callback_data="android")],
-                [InlineKeyboardButton("Мини сумо", callback_data="minisumo")],
-                [InlineKeyboardButton("Микро сумо", callback_data="microsumo")],
-            ])
+            reply_markup=current_disciplines().keyboard
         )
         return JUDGE_DISCIPLINE
+    elif role == "expert":
+        context.user_data['disciplines'] = []
+        await edit_query_message(
+            update,
+            context,
+            EXPERT_DISCIPLINES_TEXT,
+            reply_markup=current_disciplines().expert_keyboard(selected=[])
+        )
+        return EXPERT_DISCIPLINES
     else:
         return await complete_registration(update, context)
 
@@ -150,39 +639,128 @@ async def judge_discipline(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return await complete_registration(update, context)
 
 
+async def toggle_expert_discipline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Отметка/снятие дисциплины эксперта"""
+    query = update.callback_query
+    await query.answer()
+
+    discipline = query.data[len("toggle_"):]
+    selected = context.user_data.setdefault('disciplines', [])
+    if discipline in selected:
+        selected.remove(discipline)
+    else:
+        selected.append(discipline)
+
+    # Не ждем отправки: при быстрых нажатиях уйдет только последняя клавиатура
+    context.bot_data['editor'].submit(
+        query.message.chat_id,
+        query.message.message_id,
+        EXPERT_DISCIPLINES_TEXT,
+        reply_markup=current_disciplines().expert_keyboard(selected=selected)
+    )
+    return EXPERT_DISCIPLINES
+
+
+async def expert_disciplines_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Завершение выбора дисциплин эксперта"""
+    query = update.callback_query
+    await query.answer()
+
+    if not context.user_data.pop('editing_disciplines', False):
+        return await complete_registration(update, context)
+
+    try:
+        db = current_unit_of_work()
+        async with db.transaction():
+            await save_expert_disciplines(db, query.from_user.id, context.user_data['disciplines'])
+        context.bot_data['roster'].invalidate()
+
+        await show_main_menu(update, context, notice="✅ Дисциплины обновлены!")
+
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении дисциплин: {e}")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при сохранении данных. Попробуйте позже.")
+
+    return ConversationHandler.END
+
+
+async def edit_disciplines(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработчик команды /disciplines — изменение дисциплин эксперта"""
+    try:
+        db = current_unit_of_work()
+        user_id = update.effective_user.id
+
+        expert = await context.bot_data['profile_cache'].get(db, user_id, role='expert')
+        disciplines = await db.fetch(
+            "SELECT discipline FROM expert_disciplines WHERE event_id = $1 AND user_id = $2",
+            current_event_id(),
+            user_id
+        )
+        await db.release()
+
+        if not expert:
+            await update.message.reply_text("❌ Выбор дисциплин доступен только экспертам.")
+            return ConversationHandler.END
+
+        context.user_data['disciplines'] = [row['discipline'] for row in disciplines]
+        context.user_data['editing_disciplines'] = True
+        await update.message.reply_text(
+            EXPERT_DISCIPLINES_TEXT,
+            reply_markup=current_disciplines().expert_keyboard(selected=context.user_data['disciplines'])
+        )
+        return EXPERT_DISCIPLINES
+
+    except Exception as e:
+        logger.error(f"Ошибка в edit_disciplines: {e}")
+        await current_unit_of_work().release()
+        await update.message.reply_text("⚠️ Произошла ошибка. Попробуйте позже.")
+        return ConversationHandler.END
+
+
+async def save_expert_disciplines(db, user_id, disciplines):
+    """Перезаписывает список дисциплин эксперта (вызывать внутри транзакции)"""
+    event_id = current_event_id()
+    await db.execute("DELETE FROM expert_disciplines WHERE event_id = $1 AND user_id = $2", event_id, user_id)
+    await db.executemany(
+        "INSERT INTO expert_disciplines (event_id, user_id, discipline) VALUES ($1, $2, $3)",
+        [(event_id, user_id, discipline) for discipline in disciplines]
+    )
+
+
 async def complete_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Завершение регистрации и показ главного меню"""
     try:
-        pool = context.bot_data['db_pool']
+        db = current_unit_of_work()
         user_data = context.user_data
 
         message = update.message or update.callback_query.message
 
-        async with pool.acquire() as conn:
-            if user_data['role'] == "judge":
-                await conn.execute(
-                    """INSERT INTO users (user_id, name, role, discipline)
-                    VALUES ($1, $2, $3, $4)""",
-                    update.effective_user.id,
-                    user_data['name'],
-                    user_data['role'],
-                    user_data.get('discipline')
-                )
-            else:
-                await conn.execute(
-                    """INSERT INTO users (user_id, name, role)
-                    VALUES ($1, $2, $3)""",
-                    update.effective_user.id,
-                    user_data['name'],
-                    user_data['role']
-                )
+        async with db.transaction():
+            user = await db.fetchrow(
+                """INSERT INTO users (event_id, user_id, name, role, discipline)
+                VALUES ($1, $2, $3, $4, $5) RETURNING *""",
+                current_event_id(),
+                update.effective_user.id,
+                user_data['name'],
+                user_data['role'],
+                user_data.get('discipline') if user_data['role'] == "judge" else None
+            )
+            if user_data['role'] == "expert":
+                await save_expert_disciplines(db, update.effective_user.id, user_data.get('disciplines', []))
+
+        context.bot_data['profile_cache'].put(user['user_id'], user)
+        context.bot_data['roster'].invalidate()
+        state = await fetch_menu_state(db, context.bot_data['profile_cache'], user['user_id'])
+        await db.release()
 
         await message.reply_text("🎉 Регистрация завершена!")
-        await show_main_menu(update, context)
+        await show_main_menu(update, context, state=state)
         return ConversationHandler.END
 
     except Exception as e:
         logger.error(f"Ошибка при завершении регистрации: {str(e)}")
+        await current_unit_of_work().release()
         message = update.callback_query.message if update.callback_query else update.message
         await message.reply_text("⚠️ Ошибка при сохранении данных. Попробуйте позже.")
         return ConversationHandler.END
@@ -194,91 +772,240 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
-async def call_expert(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик вызова эксперта"""
+async def answer_call_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Отвечает на нажатие кнопки вызова; False — судья нажимает слишком часто, до базы не доходим"""
+    query = update.callback_query
+    if not context.bot_data['call_limiter'].allow(query.from_user.id):
+        await query.answer("⏳ Слишком частые нажатия. Вызов уже отправлен, подождите немного.")
+        return False
+    await query.answer()
+    return True
+
+
+async def import_roster_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Загрузка списка участников из CSV, присланного администратором"""
+    try:
+        file = await update.message.document.get_file()
+        text = bytes(await file.download_as_bytearray()).decode('utf-8-sig')
+        entries, errors = parse_roster_csv(text, current_disciplines().items)
+        result = await import_roster(context.bot_data['db_pool'], current_event_id(), entries)
+
+        report = [
+            f"📥 Загружено участников: {result.imported}",
+            f"Уже зарегистрированы в боте: {result.already_registered}",
+            f"Строк с ошибками: {len(errors)}",
+        ]
+        report += errors[:20]
+        if len(errors) > 20:
+            report.append(f"... и еще {len(errors) - 20}")
+        await update.message.reply_text("\n".join(report))
+
+    except UnicodeDecodeError:
+        await update.message.reply_text("⚠️ Файл должен быть в кодировке UTF-8.")
+    except Exception as e:
+        logger.error(f"Ошибка импорта списка участников: {e}")
+        await current_unit_of_work().release()
+        await update.message.reply_text("⚠️ Не удалось загрузить список. Попробуйте позже.")
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stats [часов] — статистика вызовов для администраторов"""
+    try:
+        hours = float(context.args[0]) if context.args else None
+        db = current_unit_of_work()
+        report = await build_report(db, current_event_id(), current_disciplines().labels, hours)
+        await db.release()
+        await update.message.reply_text(report[:4096])
+
+    except ValueError:
+        await update.message.reply_text("Использование: /stats [количество последних часов]")
+    except Exception as e:
+        logger.error(f"Ошибка при построении статистики: {e}")
+        await current_unit_of_work().release()
+        await update.message.reply_text("⚠️ Не удалось построить статистику. Попробуйте позже.")
+
+
+async def reload_disciplines_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /reload_disciplines — перечитать справочник дисциплин после правки таблицы"""
+    try:
+        db = current_unit_of_work()
+        registry = await reload_disciplines(db)
+        await db.release()
+        await update.message.reply_text(f"✅ Справочник дисциплин обновлен: {len(registry)}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке справочника дисциплин: {e}")
+        await current_unit_of_work().release()
+        await update.message.reply_text("⚠️ Не удалось обновить справочник. Попробуйте позже.")
+
+
+async def toggle_availability(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Эксперт отмечается занятым или свободным"""
     query = update.callback_query
     await query.answer()
 
-    pool = context.bot_data['db_pool']
+    db = current_unit_of_work()
+    user_id = query.from_user.id
+
+    try:
+        expert = await db.fetchrow(
+            """UPDATE users SET available = NOT available
+            WHERE event_id = $1 AND user_id = $2 AND role = 'expert' RETURNING *""",
+            current_event_id(),
+            user_id
+        )
+        if not expert:
+            await db.release()
+            await edit_query_message(update, context, "❌ Отмечать занятость могут только эксперты.")
+            return
+
+        context.bot_data['profile_cache'].put(user_id, expert)
+        context.bot_data['expert_load'].set_available(user_id, expert['available'])
+        state = await fetch_menu_state(db, context.bot_data['profile_cache'], user_id)
+        await db.release()
+
+        await show_main_menu(
+            update,
+            context,
+            notice="✅ Вы снова получаете вызовы." if expert['available'] else "⏸ Новые вызовы вам приходить не будут.",
+            state=state
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка при смене занятости эксперта: {e}")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при смене статуса. Попробуйте позже.")
+
+
+async def call_expert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик вызова эксперта: повторное нажатие не создает второй вызов"""
+    query = update.callback_query
+    if not await answer_call_button(update, context):
+        return
+
+    db = current_unit_of_work()
+    roster = context.bot_data['roster']
+    expert_load = context.bot_data['expert_load']
     judge_id = query.from_user.id
 
     try:
-        async with pool.acquire() as conn:
-            judge = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1 AND role = 'judge'", judge_id)
-            if not judge:
-                await query.edit_message_text("❌ Только судьи могут вызывать экспертов!")
-                return
-
-            call_id = await conn.fetchval(
-                """INSERT INTO calls (judge_id, discipline, created_at) 
-                VALUES ($1, $2, $3) RETURNING id""",
-                judge_id,
-                judge['discipline'],
-                datetime.now()
+        # Индексы грузятся из пула своим соединением — до того, как обработчик возьмет свое
+        await roster.warm()
+        await expert_load.warm()
+        judge = await context.bot_data['profile_cache'].get(db, judge_id, role='judge')
+        if judge:
+            # Получатели берутся из индексов в памяти заранее, чтобы не держать транзакцию:
+            # несколько наименее загруженных свободных экспертов дисциплины, если таких нет —
+            # любой дисциплины, если свободных нет вовсе — все эксперты дисциплины
+            discipline_experts = await roster.users('expert', judge['discipline']) or await roster.users('expert')
+            targeted = discipline_experts if not EXPERT_FANOUT else (
+                await expert_load.pick(discipline_experts, EXPERT_FANOUT)
+                or await expert_load.pick(await roster.users('expert'), EXPERT_FANOUT)
+                or discipline_experts
             )
-
-            experts = await conn.fetch("SELECT user_id FROM users WHERE role = 'expert'")
-            for expert in experts:
-                try:
-                    await context.bot.send_message(
-                        expert['user_id'],
-                        f"🔔 Судья {judge['name']} вызывает эксперта!\n"
-                        f"📍 Дисциплина: {judge['discipline']}\n"
-                        f"🆔 ID вызова: {call_id}",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Откликнуться", callback_data=f"respond_expert_{call_id}")]
-                        ])
+            created_at = datetime.now()
+            # Вызов и уведомления о нем в outbox появляются вместе или не появляются вовсе
+            async with db.transaction():
+                opened = await open_call(
+                    db,
+                    current_event_id(),
+                    "expert",
+                    judge_id,
+                    judge['discipline'],
+                    created_at,
+                    escalation_deadline(created_at, EXPERT_FALLBACK_TIMEOUT),
+                    CALL_REPING_COOLDOWN
+                )
+                if opened.status is not OpenStatus.DUPLICATE:
+                    # Остальным экспертам вызов уйдет при эскалации (см. CallEscalator)
+                    text, reply_markup = call_message(
+                        "expert", judge, opened.call_id, reminder=opened.status is OpenStatus.REPINGED
                     )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки эксперту {expert['user_id']}: {e}")
+                    await enqueue(db, targeted, text, reply_markup, call_type="expert", call_id=opened.call_id)
+            # Меню читаем на том же соединении, пока оно не возвращено в пул
+            state = await fetch_menu_state(db, context.bot_data['profile_cache'], judge_id)
+        await db.release()
 
-        await query.edit_message_text("✅ Новый вызов эксперта создан!")
-        await show_main_menu(update, context)
+        # Соединение уже возвращено в пул, дальше только сетевые операции
+        if not judge:
+            await edit_query_message(update, context, "❌ Только судьи могут вызывать экспертов!")
+            return
+
+        if opened.status is OpenStatus.DUPLICATE:
+            await show_main_menu(
+                update,
+                context,
+                notice=f"⏳ Вызов {opened.call_id} уже отправлен экспертам. Ожидайте ответа.",
+                state=state
+            )
+            return
+
+        context.bot_data['outbox'].wake()
+        if opened.status is OpenStatus.CREATED:
+            context.bot_data['call_board'].opened("expert", opened.call_id, judge, created_at)
+        await show_main_menu(
+            update,
+            context,
+            notice=f"🔁 Напоминание о вызове {opened.call_id} отправлено экспертам."
+            if opened.status is OpenStatus.REPINGED
+            else "✅ Новый вызов эксперта создан!",
+            state=state
+        )
 
     except Exception as e:
         logger.error(f"Ошибка при вызове эксперта: {e}")
-        await query.edit_message_text("⚠️ Ошибка при вызове эксперта. Попробуйте позже.")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при вызове эксперта. Попробуйте позже.")
 
 
 async def call_head_judge(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик вызова главного судьи с изменением сообщения"""
     query = update.callback_query
-    await query.answer()
+    if not await answer_call_button(update, context):
+        return
 
-    pool = context.bot_data['db_pool']
+    db = current_unit_of_work()
     judge_id = query.from_user.id
 
     try:
-        async with pool.acquire() as conn:
-            judge = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1 AND role = 'judge'", judge_id)
-            if not judge:
-                await query.edit_message_text("❌ Только судьи могут вызывать главного судью!")
-                return
-
-            call_id = await conn.fetchval(
-                """INSERT INTO hj_calls (judge_id, created_at) 
-                VALUES ($1, $2) RETURNING id""",
-                judge_id,
-                datetime.now()
-            )
-
-            head_judges = await conn.fetch("SELECT user_id FROM users WHERE role = 'head_judge'")
-            for hj in head_judges:
-                try:
-                    await context.bot.send_message(
-                        hj['user_id'],
-                        f"🔔 Судья {judge['name']} вызывает главного судью!\n"
-                        f"📍 Дисциплина: {judge.get('discipline', 'не указана')}\n"
-                        f"🆔 ID вызова: {call_id}",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Принять вызов", callback_data=f"respond_hj_{call_id}")]
-                        ])
+        await context.bot_data['roster'].warm()
+        judge = await context.bot_data['profile_cache'].get(db, judge_id, role='judge')
+        if judge:
+            head_judges = await context.bot_data['roster'].users('head_judge')
+            created_at = datetime.now()
+            async with db.transaction():
+                opened = await open_call(
+                    db,
+                    current_event_id(),
+                    "hj",
+                    judge_id,
+                    judge['discipline'],
+                    created_at,
+                    escalation_deadline(created_at, CALL_ESCALATION_INTERVAL),
+                    CALL_REPING_COOLDOWN
+                )
+                if opened.status is not OpenStatus.DUPLICATE:
+                    text, reply_markup = call_message(
+                        "hj", judge, opened.call_id, reminder=opened.status is OpenStatus.REPINGED
                     )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки главному судье {hj['user_id']}: {e}")
+                    await enqueue(db, head_judges, text, reply_markup, call_type="hj", call_id=opened.call_id)
+        await db.release()
+
+        if not judge:
+            await edit_query_message(update, context, "❌ Только судьи могут вызывать главного судью!")
+            return
+
+        if opened.status is not OpenStatus.DUPLICATE:
+            context.bot_data['outbox'].wake()
+
+        if opened.status is OpenStatus.CREATED:
+            context.bot_data['call_board'].opened("hj", opened.call_id, judge, created_at)
+            await context.bot_data['live_menus'].touch_role('head_judge')
 
         # Изменяем сообщение на "Запрос отправлен, ожидайте ответа"
-        await query.edit_message_text(
+        await edit_query_message(
+            update,
+            context,
             "✅ Запрос отправлен главным судьям. Ожидайте ответа...",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_status")]
@@ -287,7 +1014,8 @@ async def call_head_judge(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except Exception as e:
         logger.error(f"Ошибка при вызове главного судьи: {e}")
-        await query.edit_message_text("⚠️ Ошибка при вызове главного судьи. Попробуйте позже.")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при вызове главного судьи. Попробуйте позже.")
 
 
 async def respond_to_call(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -295,120 +1023,105 @@ async def respond_to_call(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    pool = context.bot_data['db_pool']
+    db = current_unit_of_work()
+    profiles = context.bot_data['profile_cache']
     responder_id = query.from_user.id
     call_type, call_id = query.data.split('_')[1], int(query.data.split('_')[2])
 
     try:
-        async with pool.acquire() as conn:
-            if call_type == "expert":
-                # Обработка эксперта (оставляем как было)
-                responder = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1 AND role = 'expert'", responder_id)
-                if not responder:
-                    await query.edit_message_text("❌ Только эксперты могут откликаться на этот вызов!")
-                    return
-
-                call = await conn.fetchrow("SELECT * FROM calls WHERE id = $1", call_id)
-                if not call:
-                    await query.edit_message_text("❌ Этот вызов не существует!")
-                    return
-
-                if call['expert_id'] is not None:
-                    await query.edit_message_text("❌ Этот вызов уже занят другим экспертом!")
-                    return
-
-                await conn.execute(
-                    "UPDATE calls SET expert_id = $1 WHERE id = $2",
-                    responder_id,
-                    call_id
-                )
+        responder = await profiles.get(db, responder_id, role='expert' if call_type == "expert" else 'head_judge')
+        if not responder:
+            await db.release()
+            await edit_query_message(
+                update,
+                context,
+                "❌ Только эксперты могут откликаться на этот вызов!" if call_type == "expert"
+                else "❌ Только главные судьи могут принимать вызовы!"
+            )
+            return
+
+        claim = await claim_call(db, current_event_id(), call_type, call_id, responder_id)
+        judge = await profiles.get(db, claim.judge_id) if claim.status is ClaimStatus.CLAIMED else None
+        await db.release()
+
+        if claim.status is ClaimStatus.NOT_FOUND:
+            await edit_query_message(update, context, "❌ Этот вызов не существует!")
+            return
+        if claim.status is ClaimStatus.TAKEN:
+            await edit_query_message(
+                update,
+                context,
+                "❌ Этот вызов уже занят другим экспертом!" if call_type == "expert" else "❌ Этот вызов уже обработан!"
+            )
+            return
+
+        context.bot_data['call_board'].accepted(call_type, call_id, responder)
+        if call_type == "expert":
+            # Эксперт занят до завершения вызова и не попадет в адресную рассылку
+            context.bot_data['expert_load'].accepted(responder_id)
+            await context.bot_data['dispatcher'].send(
+                judge['user_id'],
+                f"✅ Эксперт {responder['name']} ответил на ваш вызов!\n"
+                f"Он уже направляется к вам."
+            )
+            await edit_query_message(
+                update,
+                context,
+                "✅ Вы успешно откликнулись на вызов!\n"
+                "Когда закончите, нажмите «Завершить вызов».",
+                reply_markup=resolve_keyboard(call_type, call_id)
+            )
+        else:
+            await context.bot_data['dispatcher'].send(
+                judge['user_id'],
+                f"✅ Главный судья {responder['name']} принял ваш вызов!\n"
+                f"Он уже направляется к вам."
+            )
+            await edit_query_message(
+                update,
+                context,
+                f"✅ Вы приняли вызов от судьи {judge['name']}\n"
+                f"Дисциплина: {judge.get('discipline', 'не указана')}",
+                reply_markup=resolve_keyboard(call_type, call_id)
+            )
 
-                judge = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", call['judge_id'])
-                await context.bot.send_message(
-                    judge['user_id'],
-                    f"✅ Эксперт {responder['name']} ответил на ваш вызов!\n"
-                    f"Он уже направляется к вам."
-                )
+        # Меню судьи и эксперта, а при вызове главного судьи — и всех главных судей, обновятся сами
+        live_menus = context.bot_data['live_menus']
+        live_menus.touch([claim.judge_id, responder_id] if call_type == "expert" else [claim.judge_id])
+        if call_type == "hj":
+            await live_menus.touch_role('head_judge')
 
-                await query.edit_message_text("✅ Вы успешно откликнулись на вызов!")
+    except Exception as e:
+        logger.error(f"Ошибка при отклике на вызов: {e}")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при обработке вашего отклика.")
 
-            elif call_type == "hj":
-                # Обработка главного судьи
-                responder = await conn.fetchrow(
-                    "SELECT * FROM users WHERE user_id = $1 AND role = 'head_judge'",
-                    responder_id
-                )
-                if not responder:
-                    await query.edit_message_text("❌ Только главные судьи могут принимать вызовы!")
-                    return
-
-                call = await conn.fetchrow(
-                    """SELECT * FROM hj_calls 
-                    WHERE id = $1 AND head_judge_id IS NULL
-                    FOR UPDATE""",
-                    call_id
-                )
-                if not call:
-                    await query.edit_message_text("❌ Этот вызов уже обработан!")
-                    return
-
-                await conn.execute(
-                    """UPDATE hj_calls 
-                    SET head_judge_id = $1, resolved_at = $2
-                    WHERE id = $3""",
-                    responder_id,
-                    datetime.now(),
-                    call_id
-                )
 
-                judge = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", call['judge_id'])
-                await context.bot.send_message(
-                    judge['user_id'],
-                    f"✅ Главный судья {responder['name']} принял ваш вызов!\n"
-                    f"Он уже направляется к вам."
-                )
+async def finish_call(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Завершение принятого вызова тем, кто его принял"""
+    query = update.callback_query
+    await query.answer()
 
-                # Обновляем сообщение у главного судьи (оставляем его меню)
-                await query.edit_message_text(
-                    f"✅ Вы приняли вызов от судьи {judge['name']}\n"
-                    f"Дисциплина: {judge.get('discipline', 'не указана')}"
-                )
+    call_type, call_id = query.data.split('_')[1], int(query.data.split('_')[2])
 
-        # Обновляем меню для всех участников
-        if call and 'judge_id' in call:
-            # Обновляем меню судьи
-            await show_main_menu(
-                Update(
-                    update.update_id,
-                    callback_query=CallbackQuery(
-                        id=str(update.update_id),
-                        from_user=User(id=call['judge_id'], first_name=judge['name'], is_bot=False),
-                        message=query.message,
-                        chat_instance=query.chat_instance
-                    )
-                ),
-                context
-            )
+    try:
+        db = current_unit_of_work()
+        resolved = await resolve_call(db, current_event_id(), call_type, call_id, query.from_user.id)
+        await db.release()
 
-        if call_type == "hj":
-            # Обновляем меню главного судьи
-            await show_main_menu(
-                Update(
-                    update.update_id,
-                    callback_query=CallbackQuery(
-                        id=str(update.update_id),
-                        from_user=User(id=responder_id, first_name=responder['name'], is_bot=False),
-                        message=query.message,
-                        chat_instance=query.chat_instance
-                    )
-                ),
-                context
-            )
+        if resolved:
+            context.bot_data['call_board'].closed(call_type, call_id)
+            if call_type == "expert":
+                context.bot_data['expert_load'].resolved(query.from_user.id)
+                context.bot_data['live_menus'].touch([query.from_user.id])
+            await edit_query_message(update, context, f"🏁 Вызов {call_id} завершен. Спасибо!")
+        else:
+            await edit_query_message(update, context, "❌ Этот вызов уже завершен или принят не вами.")
 
     except Exception as e:
-        logger.error(f"Ошибка при отклике на вызов: {e}")
-        await query.edit_message_text("⚠️ Ошибка при обработке вашего отклика.")
-
+        logger.error(f"Ошибка при завершении вызова: {e}")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при завершении вызова. Попробуйте позже.")
 
 
 async def cancel_call(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -416,117 +1129,130 @@ async def cancel_call(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    pool = context.bot_data['db_pool']
+    db = current_unit_of_work()
     judge_id = query.from_user.id
 
     try:
-        async with pool.acquire() as conn:
-            # Отменяем вызовы экспертов
-            expert_calls = await conn.execute(
-                "DELETE FROM calls WHERE judge_id = $1 AND expert_id IS NULL",
-                judge_id
-            )
-
-            # Отменяем вызовы главного судьи
-            hj_calls = await conn.execute(
-                "DELETE FROM hj_calls WHERE judge_id = $1 AND head_judge_id IS NULL",
-                judge_id
-            )
-
-            total_cancelled = int(expert_calls[-1]) + int(hj_calls[-1])
-            if total_cancelled == 0:
-                await query.edit_message_text("Нет активных вызовов для отмены.")
-            else:
-                await query.edit_message_text(f"✅ Отменено {total_cancelled} активных вызовов.")
-
-        await show_main_menu(update, context)
+        # Вызовы не удаляются, а переходят в cancelled — история сохраняется
+        expert_cancelled, hj_cancelled = await cancel_open_calls(db, current_event_id(), judge_id)
+        state = await fetch_menu_state(db, context.bot_data['profile_cache'], judge_id)
+        await db.release()
+
+        total_cancelled = expert_cancelled + hj_cancelled
+        if total_cancelled:
+            context.bot_data['call_board'].judge_cancelled(judge_id)
+        if hj_cancelled:
+            await context.bot_data['live_menus'].touch_role('head_judge')
+
+        await show_main_menu(
+            update,
+            context,
+            notice=f"✅ Отменено {total_cancelled} активных вызовов." if total_cancelled
+            else "Нет активных вызовов для отмены.",
+            state=state
+        )
 
     except Exception as e:
         logger.error(f"Ошибка при отмене вызова: {e}")
-        await query.edit_message_text("⚠️ Ошибка при отмене вызова. Попробуйте позже.")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при отмене вызова. Попробуйте позже.")
+
 
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = None,
+                         state: MenuState = None):
+    """Показывает главное меню с информацией о статусе; notice — результат действия над меню.
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает главное меню с информацией о статусе"""
-    pool = context.bot_data['db_pool']
+    state — состояние меню, уже прочитанное вызывающим на соединении единицы работы.
+    """
     user_id = update.effective_user.id
 
     try:
         message = update.message or update.callback_query.message
 
-        async with pool.acquire() as conn:
-            user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", user_id)
-
-            if not user:
-                await message.reply_text("Пожалуйста, сначала зарегистрируйтесь через /start")
-                return
+        if state is None:
+            db = current_unit_of_work()
+            state = await fetch_menu_state(db, context.bot_data['profile_cache'], user_id)
+            await db.release()
+        if not state:
+            await message.reply_text("Пожалуйста, сначала зарегистрируйтесь через /start")
+            return
+
+        text, reply_markup = render_main_menu(state)
+        if notice:
+            # Одна правка вместо двух: сообщение о результате и меню в одном тексте
+            text = f"{notice}\n\n{text}"
+
+        # Старое сообщение не удалось отредактировать — присылаем меню заново
+        if not update.callback_query or not (await edit_query_message(update, context, text, reply_markup)).ok:
+            message = await message.reply_text(
+                text,
+                reply_markup=reply_markup
+            )
+            context.bot_data['editor'].remember(message.chat_id, message.message_id, text, reply_markup)
 
-            if user['role'] == "judge":
-                active_expert_calls = await conn.fetchval(
-                    "SELECT COUNT(*) FROM calls WHERE judge_id = $1 AND expert_id IS NULL",
-                    user_id
-                )
+        # Дальше это сообщение обновляется само при изменении статуса вызовов
+        context.bot_data['live_menus'].subscribe(user_id, message.chat_id, message.message_id)
 
-                active_hj_calls = await conn.fetchval(
-                    "SELECT COUNT(*) FROM hj_calls WHERE judge_id = $1 AND head_judge_id IS NULL",
-                    user_id
-                )
+    except Exception as e:
+        logger.error(f"Ошибка в show_main_menu: {e}")
+        await current_unit_of_work().release()
+        message = update.message or (update.callback_query.message if update.callback_query else None)
+        if message:
+            await message.reply_text("⚠️ Произошла ошибка. Попробуйте позже.")
 
-                text = (
-                    f"👨‍⚖️ Главное меню судьи ({user.get('discipline', 'без дисциплины')})\n"
-                    f"Активных вызовов экспертов: {active_expert_calls}\n"
-                    f"Активных вызовов главного судьи: {active_hj_calls}"
-                )
 
-                keyboard = [
-                    [InlineKeyboardButton("📢 Вызвать эксперта", callback_data="call_expert")],
-                    [InlineKeyboardButton("🆘 Вызвать главного судью", callback_data="call_head_judge")],
-                    [InlineKeyboardButton("❌ Отменить все вызовы", callback_data="cancel_calls")],
-                    [InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_status")]
-                ]
+async def show_call_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Страница очереди открытых вызовов (callback queue_<тип>_<дисциплина|all>_<после id>)"""
+    query = update.callback_query
+    await query.answer()
 
-            elif user['role'] == "head_judge":
-                active_calls = await conn.fetchval(
-                    "SELECT COUNT(*) FROM hj_calls WHERE head_judge_id IS NULL"
-                )
+    db = current_unit_of_work()
+    user_id = query.from_user.id
+    _, call_type, discipline, after_id = query.data.split('_')
+    after_id = int(after_id)
+    if discipline not in current_disciplines():
+        # Дисциплину могли убрать из справочника, пока кнопка висела в чате
+        discipline = "all"
 
-                text = (
-                    "👨‍⚖️ Вы главный судья\n"
-                    f"Ожидает обработки вызовов: {active_calls}"
-                )
+    try:
+        if not await context.bot_data['profile_cache'].get(db, user_id, role=QUEUE_ROLES[call_type]):
+            await db.release()
+            await edit_query_message(update, context, "❌ Эта очередь вам недоступна.")
+            return
+
+        rows = await fetch_open_queue(
+            db,
+            current_event_id(),
+            call_type,
+            discipline=None if discipline == "all" else discipline,
+            after_id=after_id,
+            limit=QUEUE_PAGE_SIZE + 1
+        )
+        await db.release()
+        text, reply_markup = render_call_queue(
+            call_type,
+            rows[:QUEUE_PAGE_SIZE],
+            discipline,
+            after_id,
+            has_more=len(rows) > QUEUE_PAGE_SIZE
+        )
 
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_status")]
-                ]
+        # Сообщение теперь показывает очередь — живое обновление меню перезаписало бы его
+        context.bot_data['live_menus'].unsubscribe(user_id)
+        await edit_query_message(update, context, text, reply_markup)
 
-            else:  # expert
-                text = "🛎 Вы эксперт. Ожидайте вызовов."
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_status")]
-                ]
+    except Exception as e:
+        logger.error(f"Ошибка при показе очереди вызовов: {e}")
+        await current_unit_of_work().release()
+        await edit_query_message(update, context, "⚠️ Ошибка при загрузке очереди. Попробуйте позже.")
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
 
-        if update.callback_query:
-            try:
-                await update.callback_query.edit_message_text(
-                    text,
-                    reply_markup=reply_markup
-                )
-            except Exception as edit_error:
-                if "Message is not modified" not in str(edit_error):
-                    raise edit_error
-        else:
-            await message.reply_text(
-                text,
-                reply_markup=reply_markup
-            )
-
-    except Exception as e:
-        logger.error(f"Ошибка в show_main_menu: {e}")
-        message = update.message or (update.callback_query.message if update.callback_query else None)
-        if message:
-            await message.reply_text("⚠️ Произошла ошибка. Попробуйте позже.")
+async def choose_queue_discipline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор дисциплины для фильтра очереди"""
+    query = update.callback_query
+    await query.answer()
+    call_type = query.data.split('_')[1]
+    await edit_query_message(update, context, "Выберите дисциплину:", queue_filter_keyboard(call_type))
 
 
 async def refresh_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -536,41 +1262,223 @@ async def refresh_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_main_menu(update, context)
 
 
+def build_application(builder, pool, journal: Journal = None) -> Application:
+    """Собирает приложение: сервисы процесса в bot_data и все обработчики; с journal — пишет их вызовы в журнал"""
+    application = builder.build()
+    application.bot_data['db_pool'] = pool
+    # Лимит Telegram общий на токен, поэтому делим его между воркерами
+    application.bot_data['dispatcher'] = NotificationDispatcher(
+        application.bot,
+        concurrency=int(os.getenv('NOTIFY_CONCURRENCY', 16)),
+        global_rate=float(os.getenv('NOTIFY_GLOBAL_RATE', 30)) / int(os.getenv('WORKER_COUNT', 1)),
+        per_chat_rate=float(os.getenv('NOTIFY_PER_CHAT_RATE', 1))
+    )
+    application.bot_data['editor'] = MessageEditor(application.bot_data['dispatcher'])
+    application.bot_data['outbox'] = OutboxDrainer(
+        application.bot_data,
+        batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', 100)),
+        lease=float(os.getenv('OUTBOX_LEASE', 60)),
+        max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+    )
+    # Частые нажатия «вызвать» отсекаются в памяти, не доходя до базы
+    application.bot_data['call_limiter'] = RateLimiter(
+        rate=float(os.getenv('CALL_PRESS_RATE', 0.2)),
+        capacity=float(os.getenv('CALL_PRESS_BURST', 3))
+    )
+    application.bot_data['profile_cache'] = ProfileCache(
+        max_size=int(os.getenv('PROFILE_CACHE_SIZE', 5000)),
+        ttl=float(os.getenv('PROFILE_CACHE_TTL', 300))
+    )
+    application.bot_data['roster'] = RosterIndex(pool)
+    application.bot_data['expert_load'] = ExpertLoad(
+        pool,
+        window=timedelta(minutes=float(os.getenv('EXPERT_LOAD_WINDOW', 60)))
+    )
+    # Снимок вызовов для панели организаторов; обработчики обновляют его сами (см. dashboard.py)
+    application.bot_data['call_board'] = CallBoard(
+        pool,
+        window=timedelta(minutes=float(os.getenv('DASHBOARD_WAIT_WINDOW', 60))),
+        resync=float(os.getenv('DASHBOARD_RESYNC', 60))
+    )
+    application.bot_data['live_menus'] = LiveMenus(
+        pool,
+        application.bot_data['profile_cache'],
+        application.bot_data['roster'],
+        application.bot_data['editor'],
+        debounce=float(os.getenv('LIVE_MENU_DEBOUNCE', 1.0))
+    )
+
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("start", start), CommandHandler("disciplines", edit_disciplines)],
+        states={
+            REGISTER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_name)],
+            REGISTER_ROLE: [CallbackQueryHandler(register_role, pattern="^(expert|judge|head_judge)$")],
+            JUDGE_DISCIPLINE: [CallbackQueryHandler(judge_discipline, pattern=is_discipline)],
+            EXPERT_DISCIPLINES: [
+                CallbackQueryHandler(toggle_expert_discipline, pattern=is_discipline_toggle),
+                CallbackQueryHandler(expert_disciplines_done, pattern="^disciplines_done$")
+            ]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        per_chat=True,
+        per_user=True,
+        name="registration",
+        persistent=True
+    )
+
+    # Группа -1 идет раньше всех: после завершения соревнования обработчики до базы не доходят
+    application.add_handler(TypeHandler(Update, require_live_event), group=-1)
+    application.add_handler(conv_handler)
+    application.add_handler(CallbackQueryHandler(call_expert, pattern="^call_expert$"))
+    application.add_handler(CallbackQueryHandler(call_head_judge, pattern="^call_head_judge$"))
+    application.add_handler(CallbackQueryHandler(respond_to_call, pattern=r"^respond_(expert|hj)_\d+$"))
+    application.add_handler(CallbackQueryHandler(finish_call, pattern=r"^resolve_(expert|hj)_\d+$"))
+    application.add_handler(CallbackQueryHandler(cancel_call, pattern="^cancel_calls$"))
+    application.add_handler(CallbackQueryHandler(toggle_availability, pattern="^availability_toggle$"))
+    application.add_handler(CallbackQueryHandler(refresh_status, pattern="^refresh_status$"))
+    application.add_handler(
+        CallbackQueryHandler(show_call_queue, pattern=r"^queue_(expert|hj)_[A-Za-z0-9]+_\d+$")
+    )
+    application.add_handler(CallbackQueryHandler(choose_queue_discipline, pattern="^queuefilter_(expert|hj)$"))
+    if ADMIN_IDS:
+        application.add_handler(CommandHandler("stats", stats_command, filters=filters.User(user_id=ADMIN_IDS)))
+        application.add_handler(CommandHandler(
+            "reload_disciplines", reload_disciplines_command, filters=filters.User(user_id=ADMIN_IDS)
+        ))
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("csv") & filters.User(user_id=ADMIN_IDS), import_roster_file
+        ))
+
+    # Одно соединение на обновление: обработчик и вложенные вызовы делят его, а не берут новое из пула
+    bind_units_of_work(application, pool)
+    # Время и ошибки каждого обработчика; при SLOW_HANDLER_THRESHOLD > 0 — журнал медленных с разбивкой по запросам
+    instrument_handlers(application, slow_threshold=float(os.getenv('SLOW_HANDLER_THRESHOLD', 0)))
+    if journal:
+        record_handlers(application, journal)
+    return application
+
+
+async def switch_event(bot_data: dict, db):
+    """Перечитывает текущее соревнование; регистрации и нагрузка экспертов у нового — свои"""
+    await reload_event(db)
+    bot_data['profile_cache'].invalidate()
+    bot_data['roster'].invalidate()
+    bot_data['expert_load'].invalidate()
+    bot_data['call_board'].invalidate()
+
+
 async def main():
     """Основная функция"""
+    # polling — долгий опрос; webhook — собственный вебхук; worker — вебхук за ingress (см. ingress.py)
+    mode = os.getenv('BOT_MODE', 'polling')
+    if mode == 'ingress':
+        await run_ingress()
+        return
+
     pool = None
     application = None
+    webhook = None
+    bus = None
+    escalator = None
+    metrics_server = None
+    dashboard = None
+    journal = None
 
     try:
         pool = await init_db()
         await init_db_schema(pool)
-
-        application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
-        application.bot_data['db_pool'] = pool
-
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", start)],
-            states={
-                REGISTER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_name)],
-                REGISTER_ROLE: [CallbackQueryHandler(register_role, pattern="^(expert|judge|head_judge)$")],
-                JUDGE_DISCIPLINE: [CallbackQueryHandler(judge_discipline,
-                                                      pattern="^(relay|practicallego|linecons|BEAMline|narrowline|maze|robocup|airrace|sumo|aqua|onstage|walking|footballauto|rally|android|minisumo|microsumo)$")]
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-            per_chat=True,
-            per_user=True
+        await reload_disciplines(pool)
+        await reload_event(pool)
+
+        # Журнал обновлений и сообщений бота; JOURNAL_ENABLED=0 — выключен
+        if os.getenv('JOURNAL_ENABLED', '1') != '0':
+            journal = Journal(
+                pool,
+                flush_interval=float(os.getenv('JOURNAL_FLUSH_INTERVAL', 1)),
+                batch_size=int(os.getenv('JOURNAL_BATCH_SIZE', 1000)),
+                max_buffer=int(os.getenv('JOURNAL_MAX_BUFFER', 100000))
+            )
+            journal.start()
+
+        builder = Application.builder().token(os.getenv('BOT_TOKEN'))
+        request = HTTPXRequest(connection_pool_size=int(os.getenv('BOT_API_CONNECTIONS', 256)))
+        builder.request(InstrumentedRequest(JournalRequest(request, journal) if journal else request))
+        # Обновления разных пользователей обрабатываются параллельно, одного пользователя — по очереди
+        builder.concurrent_updates(PerUserUpdateProcessor(int(os.getenv('UPDATE_CONCURRENCY', 32))))
+        builder.persistence(PostgresPersistence(pool, update_interval=float(os.getenv('PERSISTENCE_INTERVAL', 5))))
+        if mode != 'polling':
+            builder.updater(None)
+        application = build_application(builder, pool, journal=journal)
+
+        # Кэши процесса сбрасываются при изменениях из других процессов (воркеры, импорт)
+        bus = PgEventBus(pool, connect_db)
+        # Свои записи в users процесс уже положил в кэш (ProfileCache.put)
+        bus.subscribe_remote(
+            'profile_changed',
+            lambda event: application.bot_data['profile_cache'].invalidate(event['user_id'] if event else None)
         )
-
-        application.add_handler(conv_handler)
-        application.add_handler(CallbackQueryHandler(call_expert, pattern="^call_expert$"))
-        application.add_handler(CallbackQueryHandler(call_head_judge, pattern="^call_head_judge$"))
-        application.add_handler(CallbackQueryHandler(respond_to_call, pattern=r"^respond_(expert|hj)_\d+$"))
-        application.add_handler(CallbackQueryHandler(cancel_call, pattern="^cancel_calls$"))
-        application.add_handler(CallbackQueryHandler(refresh_status, pattern="^refresh_status$"))
+        bus.subscribe('roster_changed', lambda payload: application.bot_data['roster'].invalidate())
+        # Свои изменения нагрузки процесс уже применил к индексу (ExpertLoad.accepted и т.п.)
+        bus.subscribe_remote('expert_load_changed', lambda event: application.bot_data['expert_load'].invalidate())
+        bus.subscribe('disciplines_changed', lambda payload: application.create_task(reload_disciplines(pool)))
+        bus.subscribe(
+            'event_changed', lambda payload: application.create_task(switch_event(application.bot_data, pool))
+        )
+        # Отметками меню и изменениями панели процессы обмениваются, только если воркеров несколько:
+        # одному процессу каждое изменение стоило бы лишнего pg_notify через пул
+        if mode == 'worker':
+            application.bot_data['live_menus'].attach(bus)
+            application.bot_data['call_board'].attach(bus)
+        await bus.start()
 
         await application.initialize()
         await application.start()
-        await application.updater.start_polling()
+
+        # Сразу после старта дорассылает то, что не успел отправить предыдущий процесс
+        application.bot_data['outbox'].start()
+
+        escalator = CallEscalator(
+            application.bot_data,
+            interval=CALL_ESCALATION_INTERVAL,
+            max_escalations=CALL_MAX_ESCALATIONS
+        )
+        escalator.start()
+
+        if os.getenv('METRICS_PORT'):
+            metrics_server = MetricsServer(
+                listen=os.getenv('METRICS_LISTEN', '127.0.0.1'),
+                port=int(os.getenv('METRICS_PORT'))
+            )
+            await metrics_server.start()
+
+        # Панель организаторов; экраны читают снимок в памяти и не нагружают базу
+        if os.getenv('DASHBOARD_PORT'):
+            application.bot_data['call_board'].start()
+            dashboard = DashboardServer(
+                application.bot_data['call_board'],
+                listen=os.getenv('DASHBOARD_LISTEN', '127.0.0.1'),
+                port=int(os.getenv('DASHBOARD_PORT'))
+            )
+            await dashboard.start()
+
+        if mode != 'polling':
+            webhook = WebhookServer(
+                application_sink(application),
+                listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+                port=int(os.getenv('WEBHOOK_PORT', 8443)),
+                path=os.getenv('WEBHOOK_PATH', '/telegram'),
+                secret_token=os.getenv('WEBHOOK_SECRET')
+            )
+            await webhook.start()
+            # Без WEBHOOK_URL вебхук в Telegram не регистрируется — удобно для офлайн-проверки
+            if mode == 'webhook' and os.getenv('WEBHOOK_URL'):
+                await application.bot.set_webhook(
+                    url=os.getenv('WEBHOOK_URL'),
+                    secret_token=os.getenv('WEBHOOK_SECRET'),
+                    allowed_updates=Update.ALL_TYPES
+                )
+        else:
+            await application.updater.start_polling()
 
         loop = asyncio.get_running_loop()
         stop_event = asyncio.Event()
@@ -584,11 +1492,27 @@ async def main():
         print(e)
         logger.error(f"Фатальная ошибка: {str(e)}")
     finally:
+        if escalator:
+            await escalator.stop()
+        if webhook:
+            await webhook.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        if dashboard:
+            await dashboard.stop()
+            await application.bot_data['call_board'].stop()
         if application:
             if application.updater and application.updater.running:
                 await application.updater.stop()
             await application.stop()
+            # Обработчики завершены — дорассылаем очередь, пока клиент Bot API еще открыт
+            await application.bot_data['outbox'].stop(deadline=float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 10)))
             await application.shutdown()
+            logger.info(f"Кэш профилей: {application.bot_data['profile_cache'].stats}")
+        if journal:
+            await journal.stop()
+        if bus:
+            await bus.stop()
         if pool:
             await pool.close()
         logger.info("Бот остановлен")
@@ -0,0 +1,211 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from calls import OPEN_CALL
+from disciplines import current_disciplines
+from events import current_event_id
+
+# Счетчики открытых вызовов читаются по частичным индексам партиции текущего соревнования
+# (см. init_db_schema), поэтому стоимость не растет вместе с историей вызовов.
+# $1 — соревнование, $2 — пользователь
+_JUDGE_COUNTERS = f"""
+    (SELECT COUNT(*) FROM calls WHERE event_id = $1 AND judge_id = $2 AND {OPEN_CALL}) AS active_expert_calls,
+    (SELECT COUNT(*) FROM hj_calls WHERE event_id = $1 AND judge_id = $2 AND {OPEN_CALL}) AS active_hj_calls
+"""
+_HEAD_JUDGE_COUNTERS = f"""
+    (SELECT COUNT(*) FROM hj_calls WHERE event_id = $1 AND {OPEN_CALL}) AS pending_hj_calls
+"""
+_EXPERT_COUNTERS = """
+    (SELECT COUNT(*) FROM calls WHERE event_id = $1 AND expert_id = $2 AND status = 'accepted') AS accepted_calls
+"""
+
+# Профиль и счетчики одним запросом, если профиля нет в кэше
+MENU_STATE_QUERY = f"""
+    SELECT u AS profile,
+        CASE WHEN u.role = 'judge' THEN
+            (SELECT COUNT(*) FROM calls WHERE event_id = $1 AND judge_id = u.user_id AND {OPEN_CALL})
+        END AS active_expert_calls,
+        CASE WHEN u.role = 'judge' THEN
+            (SELECT COUNT(*) FROM hj_calls WHERE event_id = $1 AND judge_id = u.user_id AND {OPEN_CALL})
+        END AS active_hj_calls,
+        CASE WHEN u.role = 'head_judge' THEN
+            (SELECT COUNT(*) FROM hj_calls WHERE event_id = $1 AND {OPEN_CALL})
+        END AS pending_hj_calls,
+        CASE WHEN u.role = 'expert' THEN
+            (SELECT COUNT(*) FROM calls WHERE event_id = $1 AND expert_id = u.user_id AND status = 'accepted')
+        END AS accepted_calls
+    FROM users u
+    WHERE u.event_id = $1 AND u.user_id = $2
+"""
+
+REFRESH_BUTTON = InlineKeyboardButton("🔄 Обновить статус", callback_data="refresh_status")
+
+JUDGE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📢 Вызвать эксперта", callback_data="call_expert")],
+    [InlineKeyboardButton("🆘 Вызвать главного судью", callback_data="call_head_judge")],
+    [InlineKeyboardButton("❌ Отменить все вызовы", callback_data="cancel_calls")],
+    [REFRESH_BUTTON]
+])
+HEAD_JUDGE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Очередь вызовов", callback_data="queue_hj_all_0")],
+    [REFRESH_BUTTON]
+])
+EXPERT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔴 Я занят", callback_data="availability_toggle")],
+    [InlineKeyboardButton("📋 Открытые вызовы", callback_data="queue_expert_all_0")],
+    [REFRESH_BUTTON]
+])
+BUSY_EXPERT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🟢 Я свободен", callback_data="availability_toggle")],
+    [InlineKeyboardButton("📋 Открытые вызовы", callback_data="queue_expert_all_0")],
+    [REFRESH_BUTTON]
+])
+MENU_BUTTON = InlineKeyboardButton("↩️ В меню", callback_data="refresh_status")
+
+
+@dataclass
+class MenuState:
+    """Все, что нужно для отрисовки главного меню пользователя"""
+    profile: object
+    active_expert_calls: int = 0
+    active_hj_calls: int = 0
+    pending_hj_calls: int = 0
+    accepted_calls: int = 0
+
+
+async def fetch_menu_state(db, profiles, user_id: int) -> Optional[MenuState]:
+    """Состояние меню не более чем за один запрос к базе; None — пользователь не зарегистрирован"""
+    profile = profiles.peek(user_id)
+    event_id = current_event_id()
+
+    if profile is None:
+        row = await db.fetchrow(MENU_STATE_QUERY, event_id, user_id)
+        if row is None:
+            profiles.put(user_id, None)
+            return None
+        profiles.put(user_id, row['profile'])
+        return MenuState(
+            row['profile'],
+            active_expert_calls=row['active_expert_calls'] or 0,
+            active_hj_calls=row['active_hj_calls'] or 0,
+            pending_hj_calls=row['pending_hj_calls'] or 0,
+            accepted_calls=row['accepted_calls'] or 0
+        )
+
+    if profile['role'] == "judge":
+        row = await db.fetchrow(f"SELECT {_JUDGE_COUNTERS}", event_id, user_id)
+        return MenuState(profile, active_expert_calls=row['active_expert_calls'], active_hj_calls=row['active_hj_calls'])
+    if profile['role'] == "head_judge":
+        return MenuState(profile, pending_hj_calls=await db.fetchval(f"SELECT {_HEAD_JUDGE_COUNTERS}", event_id))
+    if profile['role'] == "expert":
+        return MenuState(
+            profile, accepted_calls=await db.fetchval(f"SELECT {_EXPERT_COUNTERS}", event_id, user_id)
+        )
+    return MenuState(profile)
+
+
+def render_main_menu(state: MenuState) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура главного меню"""
+    profile = state.profile
+
+    if profile['role'] == "judge":
+        text = (
+            f"👨‍⚖️ Главное меню судьи ({current_disciplines().label(profile.get('discipline'))})\n"
+            f"Активных вызовов экспертов: {state.active_expert_calls}\n"
+            f"Активных вызовов главного судьи: {state.active_hj_calls}"
+        )
+        return text, JUDGE_KEYBOARD
+
+    if profile['role'] == "head_judge":
+        text = (
+            "👨‍⚖️ Вы главный судья\n"
+            f"Ожидает обработки вызовов: {state.pending_hj_calls}"
+        )
+        return text, HEAD_JUDGE_KEYBOARD
+
+    if state.accepted_calls:
+        status = "⏳ Вы на вызове: новые вызовы придут после его завершения."
+    elif profile.get('available', True):
+        status = "🟢 Вы свободны: вызовы приходят в первую очередь вам."
+    else:
+        status = "🔴 Вы заняты: вызовы приходят вам, только если их долго никто не принимает."
+    return f"🛎 Вы эксперт.\n{status}", EXPERT_KEYBOARD if profile.get('available', True) else BUSY_EXPERT_KEYBOARD
+
+
+def call_message(call_type: str, judge, call_id: int, reminder: bool = False) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и кнопка уведомления о вызове эксперта ('expert') или главного судьи ('hj')"""
+    prefix = "🔁 Вызов все еще ждет ответа!\n" if reminder else ""
+    if call_type == "expert":
+        text = (
+            f"{prefix}🔔 Судья {judge['name']} вызывает эксперта!\n"
+            f"📍 Дисциплина: {current_disciplines().label(judge['discipline'])}\n"
+            f"🆔 ID вызова: {call_id}"
+        )
+        button = InlineKeyboardButton("Откликнуться", callback_data=f"respond_expert_{call_id}")
+    else:
+        text = (
+            f"{prefix}🔔 Судья {judge['name']} вызывает главного судью!\n"
+            f"📍 Дисциплина: {current_disciplines().label(judge.get('discipline'), 'не указана')}\n"
+            f"🆔 ID вызова: {call_id}"
+        )
+        button = InlineKeyboardButton("Принять вызов", callback_data=f"respond_hj_{call_id}")
+    return text, InlineKeyboardMarkup([[button]])
+
+
+def resolve_keyboard(call_type: str, call_id: int) -> InlineKeyboardMarkup:
+    """Кнопка завершения принятого вызова"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🏁 Завершить вызов", callback_data=f"resolve_{call_type}_{call_id}")]
+    ])
+
+
+def render_call_queue(call_type: str, rows, discipline: str, after_id: int,
+                      has_more: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """Страница очереди открытых вызовов с кнопкой «Принять» у каждого вызова.
+
+    discipline — код дисциплины фильтра или 'all', after_id — вызов, после которого начинается страница.
+    """
+    disciplines = current_disciplines()
+    title = "📋 Открытые вызовы главного судьи" if call_type == "hj" else "📋 Открытые вызовы экспертов"
+    title += f" ({disciplines.label(discipline) if discipline in disciplines else 'все дисциплины'})"
+
+    if not rows:
+        lines = [title, "", "Открытых вызовов нет." if not after_id else "Больше открытых вызовов нет."]
+    else:
+        lines = [title, ""] + [
+            f"#{row['id']} · {row['created_at']:%H:%M} · {disciplines.label(row['discipline'])}"
+            f" · судья {row['judge_name']}" + (f" · 🔁{row['escalations']}" if row['escalations'] else "")
+            for row in rows
+        ]
+
+    keyboard = [
+        [InlineKeyboardButton(f"✋ Принять #{row['id']}", callback_data=f"respond_{call_type}_{row['id']}")]
+        for row in rows
+    ]
+    navigation = []
+    if after_id:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=f"queue_{call_type}_{discipline}_0"))
+    if has_more:
+        navigation.append(
+            InlineKeyboardButton("Далее ▶️", callback_data=f"queue_{call_type}_{discipline}_{rows[-1]['id']}")
+        )
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([
+        InlineKeyboardButton("🔎 Дисциплина", callback_data=f"queuefilter_{call_type}"),
+        InlineKeyboardButton("🔄", callback_data=f"queue_{call_type}_{discipline}_{after_id}")
+    ])
+    keyboard.append([MENU_BUTTON])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+def queue_filter_keyboard(call_type: str) -> InlineKeyboardMarkup:
+    """Выбор дисциплины для фильтра очереди"""
+    keyboard = [[InlineKeyboardButton("Все дисциплины", callback_data=f"queue_{call_type}_all_0")]]
+    keyboard += [
+        [InlineKeyboardButton(label, callback_data=f"queue_{call_type}_{code}_0")]
+        for code, label in current_disciplines().items
+    ]
+    return InlineKeyboardMarkup(keyboard)
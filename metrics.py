@@ -0,0 +1,417 @@
+"""Метрики процесса бота в текстовом формате Prometheus.
+
+Обработчики, запросы к PostgreSQL и запросы к Bot API оборачиваются при сборке приложения
+(см. build_application и main), а MetricsServer отдает накопленное на GET /metrics.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Optional
+
+from aiohttp import web
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import BaseRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое считывается функцией в момент запроса метрик"""
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def collect(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.function()}",
+        ]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Некумулятивные счетчики корзин (последняя — +Inf), сумма и количество по каждому набору меток
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self) -> int:
+        """Число наблюдений по всем меткам"""
+        return sum(series[2] for series in self._series.values())
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по всем меткам, как histogram_quantile в Prometheus"""
+        counts = [sum(series[0][i] for series in self._series.values()) for i in range(len(self.buckets) + 1)]
+        rank = q * sum(counts)
+        if not rank:
+            return 0.0
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Регистрирует метрику; метрика с тем же именем заменяется"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика обновления", ("handler",)
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_query_duration_seconds", "Время запроса к PostgreSQL", ("method",)
+))
+DB_ACQUIRE_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_pool_acquire_seconds", "Ожидание свободного соединения из пула"
+))
+API_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_request_duration_seconds", "Время запроса к Bot API", ("method",)
+))
+API_ERRORS = REGISTRY.register(Counter(
+    "bot_api_errors_total", "Ответы Bot API с кодом ошибки (429 — превышен лимит Telegram)", ("method", "code")
+))
+BROADCAST_SECONDS = REGISTRY.register(Histogram(
+    "bot_broadcast_duration_seconds", "Длительность отправки одной порции уведомлений из outbox"
+))
+BROADCAST_DELIVERIES = REGISTRY.register(Counter(
+    "bot_broadcast_deliveries_total", "Доставки уведомлений из outbox", ("result",)
+))
+EDITS_SKIPPED = REGISTRY.register(Counter(
+    "bot_edits_skipped_total", "Правки сообщений, не дошедшие до API: без изменений или вытесненные более новой",
+    ("reason",)
+))
+
+
+@dataclass
+class _Trace:
+    """Запросы к базе в рамках одного обработчика — для журнала медленных обработчиков"""
+    queries: list = field(default_factory=list)
+    acquire_wait: float = 0.0
+
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("metrics_trace", default=None)
+
+
+def _query_label(query: str) -> str:
+    return " ".join(query.split())[:80]
+
+
+class _InstrumentedConnection:
+    """Соединение asyncpg, замеряющее каждый запрос"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method: str, query: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await getattr(self._conn, method)(query, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, method=method)
+            trace = _trace.get()
+            if trace is not None:
+                trace.queries.append((_query_label(query), elapsed))
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self._timed('fetch', query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self._timed('fetchrow', query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self._timed('fetchval', query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await self._timed('execute', query, *args, **kwargs)
+
+    async def executemany(self, query: str, *args, **kwargs):
+        return await self._timed('executemany', query, *args, **kwargs)
+
+
+class _AcquireContext:
+    def __init__(self, pool: "InstrumentedPool"):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self._conn = await self._pool.pool.acquire()
+        elapsed = time.perf_counter() - started
+        DB_ACQUIRE_SECONDS.observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.acquire_wait += elapsed
+        return _InstrumentedConnection(self._conn)
+
+    async def __aexit__(self, *exc):
+        await self._pool.pool.release(self._conn)
+
+
+class InstrumentedPool:
+    """Пул asyncpg с замером ожидания соединения и времени запросов; остальное передается пулу как есть"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        REGISTRY.register(Gauge("bot_db_pool_size", "Открытых соединений в пуле", pool.get_size))
+        REGISTRY.register(Gauge("bot_db_pool_max_size", "Максимальный размер пула", pool.get_max_size))
+        REGISTRY.register(Gauge(
+            "bot_db_pool_in_use", "Занятых соединений пула", lambda: pool.get_size() - pool.get_idle_size()
+        ))
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, **kwargs)
+
+    async def executemany(self, query: str, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.executemany(query, *args, **kwargs)
+
+
+class InstrumentedRequest(BaseRequest):
+    """Обертка транспорта Bot API: время каждого метода и ответы с ошибками, включая 429"""
+
+    def __init__(self, request: BaseRequest):
+        super().__init__()
+        self._request = request
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(
+                url,
+                method,
+                request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception:
+            API_ERRORS.inc(method=api_method, code="network")
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if code >= 400:
+            API_ERRORS.inc(method=api_method, code=str(code))
+        return code, payload
+
+
+def _instrument_callback(handler, slow_threshold: float):
+    callback = handler.callback
+    name = callback.__name__
+
+    @wraps(callback)
+    async def timed(update, context):
+        trace = _Trace()
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            if slow_threshold and elapsed >= slow_threshold:
+                _log_slow_handler(name, elapsed, trace)
+
+    handler.callback = timed
+
+
+def _log_slow_handler(name: str, elapsed: float, trace: _Trace):
+    db_time = sum(duration for _, duration in trace.queries)
+    breakdown = "; ".join(
+        f"{duration * 1000:.1f} мс {query}"
+        for query, duration in sorted(trace.queries, key=lambda q: q[1], reverse=True)[:5]
+    )
+    logger.warning(
+        f"Медленный обработчик {name}: {elapsed * 1000:.0f} мс, запросов к БД {len(trace.queries)} "
+        f"({db_time * 1000:.0f} мс), ожидание пула {trace.acquire_wait * 1000:.0f} мс. {breakdown}"
+    )
+
+
+def iter_callback_handlers(application, min_group: Optional[int] = None):
+    """Обработчики приложения с собственным callback, включая вложенные в ConversationHandler.
+
+    Общий обход для instrument_handlers, bind_units_of_work и journal.record_handlers;
+    min_group — пропустить группы ниже этой.
+    """
+    for group, handlers in application.handlers.items():
+        if min_group is not None and group < min_group:
+            continue
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield from handler.entry_points
+                for state_handlers in handler.states.values():
+                    yield from state_handlers
+                yield from handler.fallbacks
+            else:
+                yield handler
+
+
+def instrument_handlers(application, slow_threshold: float = 0):
+    """Оборачивает все зарегистрированные обработчики, включая вложенные в ConversationHandler.
+
+    slow_threshold — порог в секундах для журнала медленных обработчиков (0 — выключен).
+    """
+    for handler in iter_callback_handlers(application):
+        _instrument_callback(handler, slow_threshold)
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus"""
+
+    def __init__(self, listen: str, port: int, registry: Registry = REGISTRY):
+        self.listen = listen
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
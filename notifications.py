@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from metrics import EDITS_SKIPPED
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: не более rate операций в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """Ведро полное — им давно не пользовались"""
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def try_acquire(self) -> bool:
+        """Забирает токен без ожидания, если он есть"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Ждет, пока освободится токен (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """Запрещает операции на seconds секунд (например, после 429 от Telegram)"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class RateLimiter:
+    """Отдельное ведро токенов на каждый ключ (чат, пользователь); давно не нужные ведра выбрасываются"""
+
+    def __init__(self, rate: float, capacity: float, max_buckets: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_buckets = max_buckets
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def bucket(self, key: int) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.idle}
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+        return bucket
+
+    def allow(self, key: int) -> bool:
+        """Разрешает действие, если у ключа есть токен (без ожидания)"""
+        return self.bucket(key).try_acquire()
+
+
+@dataclass
+class DeliveryResult:
+    """Результат доставки сообщения одному получателю"""
+    chat_id: int
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    # Повтор не поможет или навредит: бот заблокирован, чат или сообщение не существует,
+    # либо отправка оборвалась по таймауту и сообщение могло уже дойти
+    permanent: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class NotificationDispatcher:
+    """Рассылка уведомлений с ограничением параллельности и лимитами Telegram"""
+
+    def __init__(self, bot, concurrency: int = 16, global_rate: float = 30, per_chat_rate: float = 1,
+                 max_retries: int = 3, max_chat_buckets: int = 10000):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = RateLimiter(per_chat_rate, 1, max_buckets=max_chat_buckets)
+
+    async def _deliver(self, chat_id: int, request, idempotent: bool) -> DeliveryResult:
+        """Выполняет запрос к Bot API с повторами при 429 и сетевых ошибках. Не выбрасывает исключений.
+
+        Таймаут повторяется только для idempotent-запросов: правку можно повторить, а отправку нет —
+        Telegram мог принять сообщение, и повтор пришел бы получателю вторым.
+        """
+        result = DeliveryResult(chat_id)
+        chat_bucket = self._chat_buckets.bucket(chat_id)
+
+        while True:
+            result.attempts += 1
+            await chat_bucket.acquire()
+            try:
+                async with self._semaphore:
+                    await self._global_bucket.acquire()
+                    message = await request()
+                result.message_id = getattr(message, 'message_id', None)
+                result.error = None
+                return result
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                chat_bucket.penalize(delay)
+                result.error = f"RetryAfter {delay}"
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота, чат или сообщение не существует — повтор не поможет
+                result.error = str(e)
+                result.permanent = True
+                if "Message is not modified" not in result.error:
+                    logger.error(f"Ошибка отправки {chat_id}: {e}")
+                return result
+            except TimedOut as e:
+                result.error = str(e)
+                if not idempotent:
+                    result.permanent = True
+                    logger.error(f"Таймаут отправки {chat_id}, сообщение могло дойти, повтора не будет: {e}")
+                    return result
+                await asyncio.sleep(min(2 ** result.attempts, 30))
+            except NetworkError as e:
+                result.error = str(e)
+                await asyncio.sleep(min(2 ** result.attempts, 30))
+            except Exception as e:
+                result.error = str(e)
+                logger.error(f"Ошибка отправки {chat_id}: {e}")
+                return result
+
+            if result.attempts > self.max_retries:
+                logger.error(f"Не удалось доставить сообщение {chat_id} за {result.attempts} попыток: {result.error}")
+                return result
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> DeliveryResult:
+        """Отправляет сообщение с учетом лимитов"""
+        return await self._deliver(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), idempotent=False)
+
+    async def edit(self, chat_id: int, message_id: int, text: str, **kwargs) -> DeliveryResult:
+        """Редактирует ранее отправленное сообщение с учетом лимитов"""
+        return await self._deliver(
+            chat_id,
+            lambda: self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs),
+            idempotent=True
+        )
+
+
+class MessageEditor:
+    """Правки сообщений через диспетчер без пустых и промежуточных обращений к API.
+
+    Для каждого сообщения (chat_id, message_id) помнит последние отправленные текст и клавиатуру
+    и не правит сообщение, если новое состояние совпадает. Пока правка сообщения в полете,
+    следующие правки того же сообщения копятся, и после ответа уходит только последняя.
+    """
+
+    def __init__(self, dispatcher: NotificationDispatcher, max_messages: int = 10000):
+        self.dispatcher = dispatcher
+        self.max_messages = max_messages
+        self._rendered: OrderedDict[tuple[int, int], tuple] = OrderedDict()
+        self._pending: dict[tuple[int, int], tuple[tuple, list[asyncio.Future]]] = {}
+        self._writers: dict[tuple[int, int], asyncio.Task] = {}
+
+    def remember(self, chat_id: int, message_id: int, text: str, reply_markup=None):
+        """Запоминает состояние сообщения, отправленного в обход редактора (например, reply_text)"""
+        key = (chat_id, message_id)
+        self._rendered[key] = (text, reply_markup)
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_messages:
+            self._rendered.popitem(last=False)
+
+    def forget(self, chat_id: int, message_id: int):
+        self._rendered.pop((chat_id, message_id), None)
+
+    def submit(self, chat_id: int, message_id: int, text: str, reply_markup=None) -> asyncio.Future:
+        """Ставит правку в очередь, не дожидаясь отправки; результат — DeliveryResult"""
+        key = (chat_id, message_id)
+        state = (text, reply_markup)
+        future = asyncio.get_running_loop().create_future()
+
+        if key not in self._writers and self._rendered.get(key) == state:
+            EDITS_SKIPPED.inc(reason="unchanged")
+            future.set_result(DeliveryResult(chat_id, message_id))
+            return future
+
+        if key in self._pending:
+            # Еще не отправленная правка устарела — отправим только новую
+            _, waiters = self._pending[key]
+            EDITS_SKIPPED.inc(reason="coalesced")
+        else:
+            waiters = []
+        waiters.append(future)
+        self._pending[key] = (state, waiters)
+
+        if key not in self._writers:
+            self._writers[key] = asyncio.create_task(self._write(key))
+        return future
+
+    async def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None) -> DeliveryResult:
+        """Правит сообщение и ждет результата. Не выбрасывает исключений"""
+        return await self.submit(chat_id, message_id, text, reply_markup)
+
+    async def _write(self, key: tuple[int, int]):
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                (text, reply_markup), waiters = self._pending.pop(key)
+                if self._rendered.get(key) == (text, reply_markup):
+                    EDITS_SKIPPED.inc(reason="unchanged")
+                    result = DeliveryResult(chat_id, message_id)
+                else:
+                    result = await self.dispatcher.edit(chat_id, message_id, text, reply_markup=reply_markup)
+                    if not result.ok and "Message is not modified" in result.error:
+                        result.error = None
+                    if result.ok:
+                        self.remember(chat_id, message_id, text, reply_markup)
+                    else:
+                        self.forget(chat_id, message_id)
+
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(result)
+        finally:
+            self._writers.pop(key, None)
+            _, waiters = self._pending.pop(key, (None, []))
+            for waiter in waiters:
+                waiter.cancel()
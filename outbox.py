@@ -0,0 +1,201 @@
+"""Надежная рассылка уведомлений о вызовах через таблицу outbox.
+
+Строки outbox пишутся в той же транзакции, что и сам вызов (или его эскалация), поэтому
+вызов не может оказаться в базе без уведомлений о нем. OutboxDrainer забирает строки
+порциями с арендой (lease): если процесс упал посреди рассылки, после истечения аренды
+строки заберет следующий процесс. Уведомления о вызовах, которые уже приняли или
+отменили, не отправляются. При остановке drain() дорассылает очередь до дедлайна.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from telegram import InlineKeyboardMarkup
+
+from calls import CALL_TABLES, OPEN_CALL, mark_notified
+from events import live_event_id
+from metrics import BROADCAST_DELIVERIES, BROADCAST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ENQUEUE = """
+    INSERT INTO outbox (call_type, call_id, chat_id, text, reply_markup, created_at, next_attempt_at)
+    SELECT $1, $2, chat_id, $4, $5::jsonb, $6, $6
+    FROM unnest($3::bigint[]) AS chat_id
+"""
+
+# Порция к отправке: строки арендуются до $3, параллельные процессы пропускают чужие (SKIP LOCKED).
+# call_open — вызов текущего соревнования $4 еще ждет ответа; для строк без вызова всегда TRUE
+CLAIM_BATCH = f"""
+    UPDATE outbox o SET attempts = o.attempts + 1, next_attempt_at = $3
+    FROM (
+        SELECT id FROM outbox
+        WHERE sent_at IS NULL AND failed_at IS NULL AND next_attempt_at <= $1
+        ORDER BY next_attempt_at, id
+        LIMIT $2
+        FOR UPDATE SKIP LOCKED
+    ) due
+    WHERE o.id = due.id
+    RETURNING o.id, o.call_type, o.call_id, o.chat_id, o.text, o.reply_markup, o.attempts,
+        CASE
+            WHEN o.call_id IS NULL THEN TRUE
+            WHEN o.call_type = 'expert' THEN EXISTS (
+                SELECT 1 FROM calls c WHERE c.event_id = $4 AND c.id = o.call_id AND c.{OPEN_CALL}
+            )
+            ELSE EXISTS (SELECT 1 FROM hj_calls h WHERE h.event_id = $4 AND h.id = o.call_id AND h.{OPEN_CALL})
+        END AS call_open
+"""
+
+
+async def enqueue(db, recipients: Iterable[int], text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                  call_type: Optional[str] = None, call_id: Optional[int] = None) -> int:
+    """Кладет сообщение для каждого получателя в outbox (вызывать в транзакции вместе с изменением вызова)"""
+    recipients = list(dict.fromkeys(recipients))
+    if recipients:
+        await db.execute(
+            ENQUEUE,
+            call_type,
+            call_id,
+            recipients,
+            text,
+            reply_markup.to_json() if reply_markup else None,
+            datetime.now()
+        )
+    return len(recipients)
+
+
+class OutboxDrainer:
+    """Фоновая отправка строк outbox через NotificationDispatcher (с его лимитами Telegram)"""
+
+    def __init__(self, bot_data: dict, batch_size: int = 100, tick: float = 1, lease: float = 60,
+                 max_attempts: int = 5):
+        self.bot_data = bot_data
+        self.batch_size = batch_size
+        self.tick = tick
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        # Первый проход сразу: подбираем то, что не успел отправить предыдущий процесс
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Новые строки в outbox — отправить, не дожидаясь следующего тика"""
+        self._wakeup.set()
+
+    async def stop(self, deadline: float = 10):
+        """Дорассылает очередь, но не дольше deadline секунд, и останавливает фоновую задачу.
+
+        Текущая порция досылается целиком; если дедлайн истек раньше, арендованные строки
+        заберет следующий процесс по истечении аренды.
+        """
+        if not self._task:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            sent = await asyncio.wait_for(self._finish(), timeout=deadline)
+            logger.info(f"При остановке дорассылано уведомлений: {sent}")
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Очередь уведомлений не разослана за {deadline} с, остаток отправит следующий процесс"
+            )
+        finally:
+            self._task = None
+
+    async def _finish(self) -> int:
+        await self._task
+        return await self.drain()
+
+    async def drain(self) -> int:
+        """Отправляет порции, пока в outbox есть строки, которым пора уйти"""
+        total = 0
+        while processed := await self.run_once():
+            total += processed
+        return total
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if await self.run_once() == self.batch_size and not self._stopping:
+                    # Порция полная — за ней, скорее всего, есть еще
+                    continue
+            except Exception as e:
+                logger.error(f"Ошибка рассылки из outbox: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_once(self) -> int:
+        """Одна порция: аренда строк, отправка, отметка результатов. Возвращает число строк"""
+        pool = self.bot_data['db_pool']
+        event_id = live_event_id()
+        if event_id is None:
+            # Соревнование завершено: его уведомления уже не нужны, ждем нового
+            return 0
+        now = datetime.now()
+        rows = await pool.fetch(CLAIM_BATCH, now, self.batch_size, now + self.lease, event_id)
+        if not rows:
+            return 0
+
+        stale = [row for row in rows if not row['call_open']]
+        due = [row for row in rows if row['call_open']]
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._send(row) for row in due))
+        if due:
+            BROADCAST_SECONDS.observe(time.monotonic() - started)
+
+        sent = [row['id'] for row, result in zip(due, results) if result.ok]
+        failed = [(row, result) for row, result in zip(due, results) if not result.ok]
+        BROADCAST_DELIVERIES.inc(len(sent), result="ok")
+        BROADCAST_DELIVERIES.inc(len(failed), result="failed")
+        now = datetime.now()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if sent:
+                    await conn.execute("UPDATE outbox SET sent_at = $2 WHERE id = ANY($1)", sent, now)
+                if stale:
+                    await conn.execute(
+                        "UPDATE outbox SET failed_at = $2, error = 'вызов уже закрыт' WHERE id = ANY($1)",
+                        [row['id'] for row in stale],
+                        now
+                    )
+                for row, result in failed:
+                    if result.permanent or row['attempts'] >= self.max_attempts:
+                        await conn.execute(
+                            "UPDATE outbox SET failed_at = $2, error = $3 WHERE id = $1", row['id'], now, result.error
+                        )
+                    else:
+                        await conn.execute(
+                            "UPDATE outbox SET next_attempt_at = $2, error = $3 WHERE id = $1",
+                            row['id'],
+                            now + timedelta(seconds=min(5 * 2 ** row['attempts'], 300)),
+                            result.error
+                        )
+
+                # created → notified, как только вызов дошел хотя бы до одного получателя
+                for call_type in CALL_TABLES:
+                    notified = {
+                        row['call_id'] for row, result in zip(due, results)
+                        if result.ok and row['call_type'] == call_type and row['call_id'] is not None
+                    }
+                    if notified:
+                        await mark_notified(conn, event_id, call_type, list(notified))
+
+        if failed or stale:
+            logger.info(f"Outbox: отправлено {len(sent)}, ошибок {len(failed)}, закрытых вызовов {len(stale)}")
+        return len(rows)
+
+    async def _send(self, row):
+        reply_markup = None
+        if row['reply_markup']:
+            reply_markup = InlineKeyboardMarkup.de_json(json.loads(row['reply_markup']), self.bot_data['dispatcher'].bot)
+        return await self.bot_data['dispatcher'].send(row['chat_id'], row['text'], reply_markup=reply_markup)
@@ -0,0 +1,88 @@
+import json
+from typing import Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+class PostgresPersistence(BasePersistence):
+    """Хранит user_data и состояния ConversationHandler в PostgreSQL (таблица bot_persistence).
+
+    bot_data не сохраняется: там лежат пул соединений и прочие объекты процесса.
+    Обновления одного пользователя всегда попадают в один процесс (см. ingress.UpdateRouter),
+    поэтому перечитывать данные перед каждым обновлением не нужно — refresh_* ничего не делают.
+    """
+
+    def __init__(self, pool, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.pool = pool
+
+    async def _load(self, kind: str) -> dict[str, object]:
+        rows = await self.pool.fetch("SELECT key, data FROM bot_persistence WHERE kind = $1", kind)
+        return {row['key']: json.loads(row['data']) for row in rows}
+
+    async def _store(self, kind: str, key: str, data):
+        await self.pool.execute(
+            """INSERT INTO bot_persistence (kind, key, data) VALUES ($1, $2, $3::jsonb)
+            ON CONFLICT (kind, key) DO UPDATE SET data = EXCLUDED.data""",
+            kind,
+            key,
+            json.dumps(data)
+        )
+
+    async def _drop(self, kind: str, key: str):
+        await self.pool.execute("DELETE FROM bot_persistence WHERE kind = $1 AND key = $2", kind, key)
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return {int(key): data for key, data in (await self._load('user_data')).items()}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        await self._store('user_data', str(user_id), data)
+
+    async def drop_user_data(self, user_id: int):
+        await self._drop('user_data', str(user_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = await self._load(f'conversation:{name}')
+        return {tuple(json.loads(key)): state for key, state in conversations.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        if new_state is None:
+            await self._drop(f'conversation:{name}', json.dumps(list(key)))
+        else:
+            await self._store(f'conversation:{name}', json.dumps(list(key)), new_state)
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        pass
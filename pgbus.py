@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Метка процесса. Соединения бота передают ее в настройке bot.origin (см. main.db_settings),
+# и триггеры кладут ее в свои события, чтобы процесс-автор пропускал собственные изменения
+PROCESS_ORIGIN = uuid.uuid4().hex
+
+
+class PgEventBus:
+    """Обмен событиями между процессами бота через LISTEN/NOTIFY PostgreSQL.
+
+    Слушает на отдельном соединении (не из пула), публикует через пул.
+    Каждый процесс помечает свои события origin, чтобы не обрабатывать их повторно.
+    После потери соединения обработчики получают пустой payload: события могли потеряться,
+    и локальные кэши нужно сбросить целиком.
+    """
+
+    def __init__(self, pool, connect: Callable):
+        self.pool = pool
+        self.origin = PROCESS_ORIGIN
+        self._connect = connect
+        self._conn = None
+        self._handlers: dict[str, list[Callable[[str], None]]] = {}
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        """Регистрирует обработчик канала; вызывать до start()"""
+        self._handlers.setdefault(channel, []).append(callback)
+
+    def subscribe_remote(self, channel: str, callback: Callable[[Optional[dict]], None]):
+        """Подписка на события триггеров (JSON с origin): изменения этого процесса пропускаются.
+
+        callback получает событие или None после переподключения, когда события могли потеряться.
+        """
+        def on_event(payload: str):
+            if not payload:
+                callback(None)
+                return
+            event = json.loads(payload)
+            if event.get('origin') != self.origin:
+                callback(event)
+
+        self.subscribe(channel, on_event)
+
+    async def start(self):
+        self._conn = await self._connect()
+        for channel in self._handlers:
+            await self._conn.add_listener(channel, self._on_notify)
+        self._conn.add_termination_listener(self._on_terminate)
+
+    async def stop(self):
+        if self._conn:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+    async def publish(self, channel: str, payload: str = ""):
+        await self.pool.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        for callback in self._handlers.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события {channel}: {e}")
+
+    def _on_terminate(self, conn):
+        if self._conn is conn:
+            logger.error("Соединение LISTEN/NOTIFY потеряно, переподключаемся")
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while self._conn is not None:
+            try:
+                await self.start()
+            except Exception as e:
+                logger.error(f"Не удалось переподключить LISTEN/NOTIFY: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+
+            for channel in self._handlers:
+                self._on_notify(self._conn, None, channel, "")
+            return
@@ -0,0 +1,233 @@
+"""Статистика по вызовам после соревнования: время до принятия, нагрузка по людям и по часам.
+
+Агрегаты считает PostgreSQL, в бот и в CLI приходят только итоговые строки. Выгрузка истории
+читается серверным курсором порциями и сразу пишется в файл, поэтому не зависит от объема истории.
+Отчет строится по одному соревнованию (по умолчанию текущему) и читает только его партиции;
+соревнования, перенесенные в архив (events.py archive), в отчет не попадают.
+
+    python reports.py stats [--hours 24] [--event ID]
+    python reports.py export calls.csv [--hours 24] [--event ID]
+    python reports.py export calls.parquet        # нужен pyarrow
+"""
+import argparse
+import asyncio
+import csv
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Все вызовы обоих типов в одном наборе строк; $1 — соревнование, $2 — начало периода
+CALL_HISTORY = """
+    SELECT 'expert' AS call_type, c.id, c.judge_id, c.discipline, c.expert_id AS responder_id, c.status,
+           c.created_at, c.notified_at, c.accepted_at, c.resolved_at, c.cancelled_at, c.expired_at, c.escalations
+    FROM calls c
+    WHERE c.event_id = $1 AND c.created_at >= $2
+    UNION ALL
+    SELECT 'hj', h.id, h.judge_id, h.discipline, h.head_judge_id, h.status,
+           h.created_at, h.notified_at, h.accepted_at, h.resolved_at, h.cancelled_at, h.expired_at, h.escalations
+    FROM hj_calls h
+    WHERE h.event_id = $1 AND h.created_at >= $2
+"""
+
+_RESPONSE_SECONDS = "EXTRACT(EPOCH FROM accepted_at - created_at)::float8"
+
+DISCIPLINE_STATS = f"""
+    WITH history AS ({CALL_HISTORY})
+    SELECT call_type, discipline,
+           COUNT(*) AS calls,
+           COUNT(accepted_at) AS accepted,
+           COUNT(*) FILTER (WHERE status = 'expired') AS expired,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY {_RESPONSE_SECONDS}) AS median_seconds,
+           percentile_cont(0.9) WITHIN GROUP (ORDER BY {_RESPONSE_SECONDS}) AS p90_seconds
+    FROM history
+    GROUP BY call_type, discipline
+    ORDER BY call_type, calls DESC
+"""
+
+RESPONDER_STATS = f"""
+    WITH history AS ({CALL_HISTORY})
+    SELECT h.call_type, h.responder_id, u.name,
+           COUNT(*) AS accepted,
+           COUNT(h.resolved_at) AS resolved,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY {_RESPONSE_SECONDS}) AS median_seconds
+    FROM history h
+    JOIN users u ON u.event_id = $1 AND u.user_id = h.responder_id
+    WHERE h.accepted_at IS NOT NULL
+    GROUP BY h.call_type, h.responder_id, u.name
+    ORDER BY h.call_type, accepted DESC
+"""
+
+BUSIEST_HOURS = f"""
+    WITH history AS ({CALL_HISTORY})
+    SELECT date_trunc('hour', created_at) AS hour,
+           COUNT(*) FILTER (WHERE call_type = 'expert') AS expert_calls,
+           COUNT(*) FILTER (WHERE call_type = 'hj') AS hj_calls
+    FROM history
+    GROUP BY 1
+    ORDER BY COUNT(*) DESC, 1
+    LIMIT $3
+"""
+
+EXPORT_CALLS = f"""
+    WITH history AS ({CALL_HISTORY})
+    SELECT h.*, judge.name AS judge_name, responder.name AS responder_name,
+           {_RESPONSE_SECONDS} AS response_seconds
+    FROM history h
+    LEFT JOIN users judge ON judge.event_id = $1 AND judge.user_id = h.judge_id
+    LEFT JOIN users responder ON responder.event_id = $1 AND responder.user_id = h.responder_id
+    ORDER BY h.created_at
+"""
+
+EXPORT_COLUMNS = (
+    "call_type", "id", "judge_id", "judge_name", "discipline", "responder_id", "responder_name", "status",
+    "created_at", "notified_at", "accepted_at", "resolved_at", "cancelled_at", "expired_at", "escalations",
+    "response_seconds",
+)
+
+
+def period_start(hours: Optional[float]) -> datetime:
+    """Начало периода отчета: последние hours часов или вся история"""
+    return datetime.now() - timedelta(hours=hours) if hours else datetime.min
+
+
+async def discipline_stats(db, event_id: int, since: datetime):
+    return await db.fetch(DISCIPLINE_STATS, event_id, since)
+
+
+async def responder_stats(db, event_id: int, since: datetime):
+    return await db.fetch(RESPONDER_STATS, event_id, since)
+
+
+async def busiest_hours(db, event_id: int, since: datetime, limit: int = 5):
+    return await db.fetch(BUSIEST_HOURS, event_id, since, limit)
+
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+async def build_report(db, event_id: int, labels: dict[str, str], hours: Optional[float] = None,
+                       top: int = 10) -> str:
+    """Текстовый отчет для /stats: медиана и p90 времени до принятия (мин:сек)"""
+    since = period_start(hours)
+    by_discipline = await discipline_stats(db, event_id, since)
+    by_responder = await responder_stats(db, event_id, since)
+    hours_rows = await busiest_hours(db, event_id, since)
+
+    lines = [f"📊 Статистика вызовов {f'за последние {hours:g} ч' if hours else 'за все время'}"]
+    for call_type, title in (("expert", "Вызовы экспертов"), ("hj", "Вызовы главного судьи")):
+        rows = [row for row in by_discipline if row['call_type'] == call_type]
+        if not rows:
+            continue
+        lines += ["", f"{title} (всего / принято / истекло, медиана, p90):"]
+        lines += [
+            f"• {labels.get(row['discipline'], row['discipline'] or 'без дисциплины')}: "
+            f"{row['calls']} / {row['accepted']} / {row['expired']}, "
+            f"{_duration(row['median_seconds'])}, {_duration(row['p90_seconds'])}"
+            for row in rows[:top]
+        ]
+
+    for call_type, title in (("expert", "Эксперты"), ("hj", "Главные судьи")):
+        rows = [row for row in by_responder if row['call_type'] == call_type]
+        if not rows:
+            continue
+        lines += ["", f"{title} (принято / завершено, медиана):"]
+        lines += [
+            f"• {row['name']}: {row['accepted']} / {row['resolved']}, {_duration(row['median_seconds'])}"
+            for row in rows[:top]
+        ]
+
+    if hours_rows:
+        lines += ["", "Самые загруженные часы (эксперты / главный судья):"]
+        lines += [f"• {row['hour']:%d.%m %H:00}: {row['expert_calls']} / {row['hj_calls']}" for row in hours_rows]
+
+    if len(lines) == 1:
+        lines.append("Вызовов пока не было.")
+    return "\n".join(lines)
+
+
+async def export_calls(conn, path: str, event_id: int, since: datetime, chunk_size: int = 5000) -> int:
+    """Пишет историю вызовов соревнования в CSV или Parquet (по расширению), читая ее серверным курсором"""
+    if path.endswith(".parquet"):
+        return await _export_parquet(conn, path, event_id, since, chunk_size)
+
+    exported = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        async with conn.transaction():
+            async for row in conn.cursor(EXPORT_CALLS, event_id, since, prefetch=chunk_size):
+                writer.writerow([row[column] for column in EXPORT_COLUMNS])
+                exported += 1
+    return exported
+
+
+async def _export_parquet(conn, path: str, event_id: int, since: datetime, chunk_size: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для выгрузки в Parquet установите pyarrow или выберите .csv")
+
+    schema = pa.schema([
+        ("call_type", pa.string()), ("id", pa.int64()), ("judge_id", pa.int64()), ("judge_name", pa.string()),
+        ("discipline", pa.string()), ("responder_id", pa.int64()), ("responder_name", pa.string()),
+        ("status", pa.string()), ("created_at", pa.timestamp("us")), ("notified_at", pa.timestamp("us")),
+        ("accepted_at", pa.timestamp("us")), ("resolved_at", pa.timestamp("us")),
+        ("cancelled_at", pa.timestamp("us")), ("expired_at", pa.timestamp("us")),
+        ("escalations", pa.int32()), ("response_seconds", pa.float64()),
+    ])
+
+    exported = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        async with conn.transaction():
+            cursor = await conn.cursor(EXPORT_CALLS, event_id, since)
+            while rows := await cursor.fetch(chunk_size):
+                columns = {column: [row[column] for row in rows] for column in EXPORT_COLUMNS}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                exported += len(rows)
+    return exported
+
+
+async def _cli():
+    import asyncpg
+    from disciplines import reload_disciplines
+    from events import reload_event
+    from main import db_settings
+
+    parser = argparse.ArgumentParser(description="Статистика и выгрузка истории вызовов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats = commands.add_parser("stats", help="отчет в консоль")
+    stats.add_argument("--hours", type=float, help="только последние N часов")
+    stats.add_argument("--event", type=int, help="id соревнования (по умолчанию текущее)")
+    export = commands.add_parser("export", help="выгрузка истории вызовов в .csv или .parquet")
+    export.add_argument("path")
+    export.add_argument("--hours", type=float, help="только последние N часов")
+    export.add_argument("--event", type=int, help="id соревнования (по умолчанию текущее)")
+    export.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(**db_settings())
+    try:
+        event_id = args.event
+        if event_id is None:
+            event = await reload_event(conn)
+            if event is None:
+                print("Нет текущего соревнования, укажите --event")
+                return
+            event_id = event.id
+
+        if args.command == "stats":
+            registry = await reload_disciplines(conn)
+            print(await build_report(conn, event_id, registry.labels, args.hours, top=100))
+        else:
+            exported = await export_calls(conn, args.path, event_id, period_start(args.hours), args.chunk_size)
+            print(f"Выгружено вызовов: {exported} → {args.path}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from typing import Optional
+
+from events import current_event_id
+
+logger = logging.getLogger(__name__)
+
+
+class RosterIndex:
+    """Индекс участников текущего соревнования в памяти процесса: роль → дисциплина → user_id.
+
+    Строится одним запросом при первом обращении и сбрасывается через invalidate()
+    при любом изменении регистрации и при смене соревнования. Участники без дисциплины (например, эксперты,
+    не выбравшие ни одной) лежат под ключом None и подходят для любой дисциплины.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._index: Optional[dict[str, dict[Optional[str], frozenset[int]]]] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Сбрасывает индекс, следующий запрос перечитает его из базы"""
+        self._generation += 1
+        self._index = None
+
+    async def _load(self) -> dict[str, dict[Optional[str], frozenset[int]]]:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT u.user_id, u.role, COALESCE(ed.discipline, u.discipline) AS discipline
+                FROM users u
+                LEFT JOIN expert_disciplines ed ON ed.event_id = u.event_id AND ed.user_id = u.user_id
+                WHERE u.event_id = $1
+            """, current_event_id())
+
+        index: dict[str, dict[Optional[str], set[int]]] = {}
+        for row in rows:
+            index.setdefault(row['role'], {}).setdefault(row['discipline'], set()).add(row['user_id'])
+        logger.info(f"Индекс участников перестроен: {len(rows)} записей")
+        return {
+            role: {discipline: frozenset(ids) for discipline, ids in disciplines.items()}
+            for role, disciplines in index.items()
+        }
+
+    async def _get(self) -> dict[str, dict[Optional[str], frozenset[int]]]:
+        index = self._index
+        if index is not None:
+            return index
+        async with self._lock:
+            while self._index is None:
+                generation = self._generation
+                index = await self._load()
+                # Если во время загрузки регистрация изменилась, читаем заново
+                if generation == self._generation:
+                    self._index = index
+            return self._index
+
+    async def warm(self):
+        """Загружает индекс, если его нет. Вызывать до первого запроса через UnitOfWork:
+        загрузка берет свое соединение из пула, и обработчик не должен держать при этом второе"""
+        await self._get()
+
+    async def users(self, role: str, discipline: Optional[str] = None) -> set[int]:
+        """Участники роли; если указана дисциплина — только подходящие для нее"""
+        by_discipline = (await self._get()).get(role, {})
+        if discipline is None:
+            return set().union(*by_discipline.values())
+        return set(by_discipline.get(discipline, ())) | set(by_discipline.get(None, ()))
@@ -0,0 +1,237 @@
+"""Предварительная регистрация участников из CSV.
+
+Организатор загружает список (CLI или CSV-файл боту от администратора, см. ADMIN_IDS),
+строки попадают в preregistrations, а /start забирает строку участника одним запросом
+вместо диалога регистрации — участник регистрируется на текущем соревновании (см. events.py).
+
+Формат CSV (заголовок обязателен, разделитель — запятая или точка с запятой):
+
+    name,role,discipline,telegram
+    Иванов Иван,судья,maze,@ivanov
+    Петров Петр,эксперт,Сумо,123456789
+    Петров Петр,эксперт,Мини сумо,123456789
+
+Эксперт с несколькими дисциплинами записывается несколькими строками.
+
+    python roster_import.py roster.csv [--dry-run]
+"""
+import argparse
+import asyncio
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+ROLE_ALIASES = {
+    'judge': 'judge',
+    'судья': 'judge',
+    'expert': 'expert',
+    'эксперт': 'expert',
+    'head_judge': 'head_judge',
+    'главный судья': 'head_judge',
+    'главный_судья': 'head_judge',
+}
+
+COLUMNS = ('telegram_id', 'username', 'name', 'role', 'discipline', 'disciplines')
+
+# Участник забирает свою строку: удаление из preregistrations, запись в users
+# и дисциплины эксперта — один запрос и одна транзакция
+CLAIM_PREREGISTRATION = """
+    WITH claimed AS (
+        DELETE FROM preregistrations
+        WHERE id = (
+            SELECT id FROM preregistrations
+            WHERE telegram_id = $2 OR username = lower($3)
+            ORDER BY telegram_id IS NULL
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING name, role, discipline, disciplines
+    ), registered AS (
+        INSERT INTO users (event_id, user_id, name, role, discipline)
+        SELECT $1, $2, name, role, discipline FROM claimed
+        ON CONFLICT (event_id, user_id) DO NOTHING
+        RETURNING *
+    ), expert_rows AS (
+        INSERT INTO expert_disciplines (event_id, user_id, discipline)
+        SELECT registered.event_id, registered.user_id, d.code
+        FROM registered, claimed, unnest(claimed.disciplines) AS d(code)
+        WHERE registered.role = 'expert'
+    )
+    SELECT * FROM registered
+"""
+
+UPSERT_PREREGISTRATIONS = """
+    INSERT INTO preregistrations (telegram_id, username, name, role, discipline, disciplines)
+    SELECT telegram_id, username, name, role, discipline, disciplines FROM roster_staging
+    WHERE {condition}
+    ON CONFLICT ({key}) DO UPDATE SET
+        name = EXCLUDED.name,
+        role = EXCLUDED.role,
+        discipline = EXCLUDED.discipline,
+        disciplines = EXCLUDED.disciplines
+"""
+
+
+@dataclass
+class RosterEntry:
+    """Участник из списка организаторов"""
+    name: str
+    role: str
+    telegram_id: Optional[int] = None
+    username: Optional[str] = None
+    discipline: Optional[str] = None
+    disciplines: list[str] = field(default_factory=list)
+
+    @property
+    def key(self):
+        return self.telegram_id or self.username
+
+    def record(self) -> tuple:
+        return self.telegram_id, self.username, self.name, self.role, self.discipline, self.disciplines
+
+
+@dataclass
+class ImportResult:
+    """Итог загрузки списка"""
+    imported: int = 0
+    already_registered: int = 0
+
+
+def _discipline_lookup(disciplines: Iterable[tuple[str, str]]) -> dict[str, str]:
+    lookup = {}
+    for code, label in disciplines:
+        lookup[code.lower()] = code
+        lookup[label.lower()] = code
+    return lookup
+
+
+def parse_roster_csv(text: str, disciplines: Iterable[tuple[str, str]]) -> tuple[list[RosterEntry], list[str]]:
+    """Разбирает CSV; возвращает участников (строки эксперта объединены) и ошибки по строкам"""
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    lookup = _discipline_lookup(disciplines)
+    entries: dict = {}
+    errors = []
+
+    for line, row in enumerate(reader, start=2):
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+        name, telegram = row.get('name', ''), row.get('telegram', '').lstrip('@')
+        role = ROLE_ALIASES.get(row.get('role', '').lower())
+        discipline = lookup.get(row.get('discipline', '').lower())
+
+        if not name or not telegram:
+            errors.append(f"строка {line}: нужны имя и Telegram (username или id)")
+            continue
+        if role is None:
+            errors.append(f"строка {line}: неизвестная роль «{row.get('role', '')}»")
+            continue
+        if row.get('discipline') and discipline is None:
+            errors.append(f"строка {line}: неизвестная дисциплина «{row['discipline']}»")
+            continue
+        if role == 'judge' and discipline is None:
+            errors.append(f"строка {line}: у судьи должна быть дисциплина")
+            continue
+
+        if telegram.lstrip('-').isdigit():
+            entry = RosterEntry(name, role, telegram_id=int(telegram))
+        else:
+            entry = RosterEntry(name, role, username=telegram.lower())
+
+        previous = entries.get(entry.key)
+        if previous and previous.role == role == 'expert':
+            # Следующая дисциплина того же эксперта
+            if discipline and discipline not in previous.disciplines:
+                previous.disciplines.append(discipline)
+            continue
+        if previous:
+            errors.append(f"строка {line}: {telegram} уже встречался выше, используется эта строка")
+
+        if role == 'expert':
+            entry.disciplines = [discipline] if discipline else []
+        elif role == 'judge':
+            entry.discipline = discipline
+        entries[entry.key] = entry
+
+    return list(entries.values()), errors
+
+
+async def import_roster(pool, event_id: int, entries: list[RosterEntry]) -> ImportResult:
+    """Загружает участников в preregistrations (COPY во временную таблицу и upsert)"""
+    result = ImportResult()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE roster_staging (
+                    telegram_id BIGINT,
+                    username TEXT,
+                    name TEXT,
+                    role TEXT,
+                    discipline TEXT,
+                    disciplines TEXT[]
+                ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                'roster_staging',
+                records=[entry.record() for entry in entries],
+                columns=COLUMNS
+            )
+            # Уже зарегистрированных по id не трогаем — их профиль меняется через бота
+            result.already_registered = await conn.fetchval("""
+                WITH registered AS (
+                    DELETE FROM roster_staging s USING users u
+                    WHERE u.event_id = $1 AND s.telegram_id = u.user_id
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM registered
+            """, event_id)
+            for condition, key in (("telegram_id IS NOT NULL", "telegram_id"), ("telegram_id IS NULL", "username")):
+                status = await conn.execute(UPSERT_PREREGISTRATIONS.format(condition=condition, key=key))
+                result.imported += int(status.split()[-1])
+    return result
+
+
+async def claim_preregistration(db, event_id: int, user_id: int, username: Optional[str]):
+    """Регистрирует пользователя на соревновании по строке из списка организаторов; None — его нет в списке"""
+    return await db.fetchrow(CLAIM_PREREGISTRATION, event_id, user_id, username)
+
+
+async def _cli():
+    # main импортирует этот модуль, поэтому настройки бота берем только при запуске из командной строки
+    import asyncpg
+    from disciplines import reload_disciplines
+    from events import reload_event
+    from main import db_settings, init_db_schema
+
+    parser = argparse.ArgumentParser(description="Предварительная регистрация участников из CSV")
+    parser.add_argument("path", help="CSV со столбцами name, role, discipline, telegram")
+    parser.add_argument("--dry-run", action="store_true", help="только проверить файл")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(**db_settings())
+    try:
+        await init_db_schema(pool)
+        registry = await reload_disciplines(pool)
+        with open(args.path, encoding="utf-8-sig") as f:
+            entries, errors = parse_roster_csv(f.read(), registry.items)
+        for error in errors:
+            print(error)
+        print(f"Участников в файле: {len(entries)}, ошибок: {len(errors)}")
+        if args.dry_run or not entries:
+            return
+
+        event = await reload_event(pool)
+        if event is None:
+            print("Нет текущего соревнования: откройте его командой python events.py start")
+            return
+        result = await import_roster(pool, event.id, entries)
+        print(f"Загружено: {result.imported}, уже зарегистрированы: {result.already_registered}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
@@ -0,0 +1,122 @@
+"""Нагрузочная проверка захвата вызовов на локальном PostgreSQL.
+
+Создает синтетических судей и экспертов, на каждый вызов одновременно отправляет
+сотни попыток захвата и проверяет, что победитель ровно один и именно он записан в базе.
+Подключение берется из тех же переменных окружения, что и у бота.
+
+    python stress_claims.py --calls 20 --claimers 300
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+import asyncpg
+from dotenv import load_dotenv
+
+from calls import ClaimStatus, claim_call
+from events import reload_event
+from main import init_db_schema
+
+# Синтетические пользователи живут в отрицательном диапазоне, чтобы не пересекаться с Telegram id
+# У судьи может быть только один открытый вызов каждого типа, поэтому на каждый вызов свой судья
+FIRST_JUDGE_ID = -1_000_000
+FIRST_CLAIMER_ID = -1_000_001
+
+
+async def run(calls: int, claimers: int, pool_size: int):
+    pool = await asyncpg.create_pool(
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT')),
+        min_size=pool_size,
+        max_size=pool_size
+    )
+    claimer_ids = [FIRST_CLAIMER_ID - i for i in range(claimers)]
+    judge_ids = [FIRST_JUDGE_ID + i for i in range(calls)]
+    failures = 0
+
+    try:
+        await init_db_schema(pool)
+        event_id = (await reload_event(pool)).id
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO users (event_id, user_id, name, role) VALUES ($1, $2, 'stress judge', 'judge')",
+                [(event_id, user_id) for user_id in judge_ids]
+            )
+            await conn.executemany(
+                "INSERT INTO users (event_id, user_id, name, role) VALUES ($1, $2, 'stress claimer', 'expert')",
+                [(event_id, user_id) for user_id in claimer_ids]
+            )
+
+        # Захват идет тем же claim_call, что и в обработчике respond_to_call
+        for table, call_type, column, insert in (
+            ("calls", "expert", "expert_id",
+             "INSERT INTO calls (event_id, judge_id, discipline, created_at) "
+             "VALUES ($1, $2, 'stress', $3) RETURNING id"),
+            ("hj_calls", "hj", "head_judge_id",
+             "INSERT INTO hj_calls (event_id, judge_id, created_at) VALUES ($1, $2, $3) RETURNING id"),
+        ):
+            async with pool.acquire() as conn:
+                call_ids = [
+                    await conn.fetchval(insert, event_id, judge_id, datetime.now()) for judge_id in judge_ids
+                ]
+
+            started = time.monotonic()
+            results = await asyncio.gather(*(
+                claim_call(pool, event_id, call_type, call_id, claimer_id)
+                for call_id in call_ids
+                for claimer_id in claimer_ids
+            ))
+            elapsed = time.monotonic() - started
+
+            async with pool.acquire() as conn:
+                owners = dict(await conn.fetch(
+                    f"SELECT id, {column} FROM {table} WHERE event_id = $1 AND id = ANY($2)",
+                    event_id,
+                    call_ids
+                ))
+
+            winners = Counter()
+            for (call_id, claimer_id), result in zip(
+                ((c, e) for c in call_ids for e in claimer_ids), results
+            ):
+                if result.status is ClaimStatus.CLAIMED:
+                    winners[call_id] += 1
+                    if owners[call_id] != claimer_id:
+                        failures += 1
+                        print(f"{table} #{call_id}: победил {claimer_id}, а в базе {owners[call_id]}")
+
+            for call_id in call_ids:
+                if winners[call_id] != 1:
+                    failures += 1
+                    print(f"{table} #{call_id}: победителей {winners[call_id]}")
+
+            print(
+                f"{table}: {len(results)} захватов за {elapsed:.2f} с "
+                f"({len(results) / elapsed:.0f}/с), статусы {dict(Counter(r.status.value for r in results))}"
+            )
+
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM calls WHERE judge_id = ANY($1)", judge_ids)
+            await conn.execute("DELETE FROM hj_calls WHERE judge_id = ANY($1)", judge_ids)
+            await conn.execute("DELETE FROM users WHERE user_id = ANY($1)", judge_ids + claimer_ids)
+        await pool.close()
+
+    print("OK" if not failures else f"Ошибок: {failures}")
+    return failures
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка захвата вызовов")
+    parser.add_argument("--calls", type=int, default=20, help="количество вызовов каждого типа")
+    parser.add_argument("--claimers", type=int, default=300, help="одновременных претендентов на вызов")
+    parser.add_argument("--pool-size", type=int, default=50, help="размер пула соединений")
+    args = parser.parse_args()
+    raise SystemExit(1 if asyncio.run(run(args.calls, args.claimers, args.pool_size)) else 0)
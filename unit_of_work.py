@@ -0,0 +1,107 @@
+"""Единица работы обработчика: одно соединение с базой на обновление.
+
+Обработчик и все вложенные вызовы (show_main_menu, кэш профилей) работают через
+текущую UnitOfWork, а не через пул напрямую. Соединение берется при первом запросе,
+транзакция открывается только там, где нужна атомарность нескольких запросов
+(db.transaction()), а перед сетевыми операциями соединение возвращается в пул (db.release()),
+чтобы медленный Bot API не держал его занятым.
+"""
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from metrics import iter_callback_handlers
+
+_current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+
+class UnitOfWork:
+    """Соединение из пула, взятое лениво и общее для всех запросов одного обновления"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._acquire = None
+        self._conn = None
+        self._transactions = 0
+        self._closed = False
+
+    async def connection(self):
+        """Соединение единицы работы; после release() берется заново"""
+        if self._closed:
+            raise RuntimeError("Единица работы уже завершена: обработчик вернул управление")
+        if self._conn is None:
+            acquire = self._pool.acquire()
+            self._conn = await acquire.__aenter__()
+            self._acquire = acquire
+        return self._conn
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Транзакция на соединении единицы работы; вложенная становится точкой сохранения"""
+        conn = await self.connection()
+        self._transactions += 1
+        try:
+            async with conn.transaction():
+                yield self
+        finally:
+            self._transactions -= 1
+
+    async def release(self):
+        """Возвращает соединение в пул до следующего запроса (вызывать перед сетевыми операциями)"""
+        if self._transactions:
+            raise RuntimeError("Нельзя вернуть соединение в пул внутри транзакции")
+        if self._conn is not None:
+            acquire, self._acquire, self._conn = self._acquire, None, None
+            await acquire.__aexit__(None, None, None)
+
+    async def close(self):
+        await self.release()
+        self._closed = True
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await (await self.connection()).fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await (await self.connection()).fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await (await self.connection()).fetchval(query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await (await self.connection()).execute(query, *args, **kwargs)
+
+    async def executemany(self, query: str, *args, **kwargs):
+        return await (await self.connection()).executemany(query, *args, **kwargs)
+
+
+def current_unit_of_work() -> UnitOfWork:
+    """Единица работы текущего обработчика"""
+    unit = _current.get()
+    if unit is None:
+        raise RuntimeError("Обработчик запущен без единицы работы (см. bind_units_of_work)")
+    return unit
+
+
+def _bind_callback(handler, pool):
+    callback = handler.callback
+
+    @wraps(callback)
+    async def with_unit_of_work(update, context):
+        unit = UnitOfWork(pool)
+        token = _current.set(unit)
+        try:
+            return await callback(update, context)
+        finally:
+            _current.reset(token)
+            # Задачи, запущенные из обработчика, унаследовали единицу работы — закрываем ее,
+            # чтобы они не взяли соединение, которое никто не вернет
+            await unit.close()
+
+    handler.callback = with_unit_of_work
+
+
+def bind_units_of_work(application, pool):
+    """Оборачивает все обработчики (включая вложенные в ConversationHandler) в UnitOfWork"""
+    for handler in iter_callback_handlers(application):
+        _bind_callback(handler, pool)